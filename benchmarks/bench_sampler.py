@@ -0,0 +1,40 @@
+#
+# microbenchmark of the sampler: steps per second of the whole sampling
+# against the time spent in the likelihood (prob_cali).
+#
+# usage: python bench_sampler.py [--nmcmc 2000] [--threads 1] [--sync 1]
+#
+# run in the top directory of pycali so that the data files are found.
+#
+import argparse
+import pycali
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--fcont", default="data/ngc5548_cont.txt")
+parser.add_argument("--fline", default="data/ngc5548_line.txt",
+                    help="line files separated by commas, empty for no line")
+parser.add_argument("--nmcmc", type=int, default=2000)
+parser.add_argument("--threads", type=int, default=1)
+parser.add_argument("--sync", type=int, default=1, help="sync policy of sample files, 0, 1, or 2")
+parser.add_argument("--work_dir", default="bench")
+args = parser.parse_args()
+
+cfg = pycali.Config()
+fline = [fl for fl in args.fline.split(",") if fl]
+cfg.setup(fcont=args.fcont, fline=fline, nmcmc=args.nmcmc, ptol=0.1, work_dir=args.work_dir)
+cfg.num_threads = args.threads
+cfg.sync_policy = args.sync
+
+cali = pycali.Cali(cfg)
+cali.mcmc()
+t = cali.get_sampler_timing()
+
+thread_time = t["time_sampling"]*t["num_threads"]
+print("")
+print("steps:                 %d"%t["steps"])
+print("threads:               %d"%t["num_threads"])
+print("sampling time (s):     %.3f"%t["time_sampling"])
+print("steps per second:      %.1f"%t["steps_per_second"])
+print("likelihood per second: %.1f (per thread)"%t["likelihood_per_second"])
+print("likelihood fraction:   %.1f%%"%(100.0*t["time_likelihood"]/thread_time))
+print("sampler overhead:      %.1f%%"%(100.0*(1.0-t["time_likelihood"]/thread_time)))
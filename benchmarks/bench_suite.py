@@ -0,0 +1,220 @@
+#
+# benchmark suite on mock data from pycali.generate_mock_data, sweeping
+# the number of points per code, the number of codes, and the number of lines.
+#
+# for each case, it times loading the light curves (Data), one likelihood
+# evaluation, a fixed-step mcmc, get_best_params, and recon, and reports
+# steps per second and the peak RSS. the likelihood is checked against
+# a dense Gaussian-process reference to guard the accuracy.
+#
+# usage: python bench_suite.py [--points 100,400] [--codes 2,5] [--lines 0,1]
+#                              [--nmcmc 2000] [--seed 1] [--json results.json]
+#
+# each case runs in its own process in work_dir/case_name/, the outputs of
+# the C++ code go to bench.log there. get_best_params requires at least 500
+# posterior samples, otherwise it is skipped along with recon; increase --nmcmc then.
+#
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import itertools
+import multiprocessing as mp
+import numpy as np
+
+def dense_log_likelihood(data, sigma, tau, scale, shift, syserr, error_scale):
+  """
+  log-likelihood of a light curve with a dense covariance matrix,
+  the mean is marginalized as in Cali::prob_drw().
+  """
+  t = np.array(data.time)
+  code = np.array(data.code)
+  flux = np.array(data.flux_org) * scale[code]
+  if shift is not None:
+    flux -= shift[code]
+  error = np.sqrt(np.array(data.error_org)**2 * error_scale[code]**2 + syserr[code]**2) * scale[code]
+
+  C = sigma**2 * np.exp(-np.abs(t[:, None] - t[None, :])/tau) + np.diag(error**2)
+  L = np.linalg.cholesky(C)
+  a = np.linalg.solve(L, np.stack((flux, np.ones(t.shape[0])), axis=-1))
+  lam = np.dot(a[:, 1], a[:, 1])
+  ave = np.dot(a[:, 1], a[:, 0])/lam
+  y = a[:, 0] - ave * a[:, 1]
+  lndet = 2.0*np.sum(np.log(np.diag(L)))
+  lndet_n = np.sum(2.0*np.log(scale) * np.array(data.num_code))
+  return -0.5*np.dot(y, y) - 0.5*lndet - 0.5*np.log(lam) + 0.5*lndet_n
+
+def reference_params(cali, rng):
+  """
+  a set of parameters around the mock input, in the layout of best_params
+  """
+  nlines = len(cali.lines)
+  ncode = cali.ncode
+  npv = 2 + 2*nlines
+  model = np.zeros(cali.num_params)
+  model[0:npv:2] = np.log(0.1) - 0.5*np.log(50.0)  # sigma = exp(model[0]) * sqrt(tau)
+  model[1:npv:2] = np.log(50.0)
+  model[npv:npv+ncode] = 1.0 + 0.05*rng.standard_normal(ncode)
+  model[npv+ncode:npv+2*ncode] = 0.05*rng.standard_normal(ncode)
+  for k in range(1 + nlines):
+    model[npv+(2+2*k)*ncode:npv+(3+2*k)*ncode] = rng.uniform(0.0, 0.02, ncode)
+    model[npv+(3+2*k)*ncode:npv+(4+2*k)*ncode] = rng.uniform(0.9, 1.1, ncode)
+  return model
+
+def dense_reference(cali, model):
+  """
+  dense-GP log-likelihood of all light curves
+  """
+  nlines = len(cali.lines)
+  ncode = cali.ncode
+  npv = 2 + 2*nlines
+  scale = model[npv:npv+ncode]
+  shift = model[npv+ncode:npv+2*ncode]
+  data = [cali.cont] + list(cali.lines)
+  prob = 0.0
+  for k in range(1 + nlines):
+    tau = np.exp(model[1+2*k])
+    sigma = np.exp(model[2*k]) * np.sqrt(tau)
+    syserr = model[npv+(2+2*k)*ncode:npv+(3+2*k)*ncode]
+    error_scale = model[npv+(3+2*k)*ncode:npv+(4+2*k)*ncode]
+    prob += dense_log_likelihood(data[k], sigma, tau, scale, shift if k==0 else None, syserr, error_scale)
+  return prob
+
+def run_case(case, args, queue):
+  """
+  run one case in work_dir/case_name/ and put the results into queue
+  """
+  wdir = os.path.join(args.work_dir, case["name"])
+  os.makedirs(os.path.join(wdir, "data"), exist_ok=True)
+  os.chdir(wdir)
+
+  # redirect outputs of the C++ code to a log file
+  sys.stdout.flush()
+  sys.stderr.flush()
+  flog = os.open("bench.log", os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0o644)
+  os.dup2(flog, 1)
+  os.dup2(flog, 2)
+  os.close(flog)
+
+  import pycali
+  res = dict(case)
+  pycali.generate_mock_data(num_codes=case["codes"], num_points=case["points"], num_lines=case["lines"],
+                            seed=args.seed, data_dir="data", plot=False)
+  fcont = "data/sim_cont.txt"
+  fline = ["data/sim_line%s.txt"%("" if j == 0 else j+1) for j in range(case["lines"])]
+
+  t0 = time.perf_counter()
+  pycali.Data(fcont)
+  for fl in fline:
+    pycali.Data(fl)
+  res["time_load"] = time.perf_counter() - t0
+
+  cfg = pycali.Config()
+  cfg.setup(fcont=fcont, fline=fline, nmcmc=args.nmcmc, ptol=0.1,
+            fixed_syserr=False, fixed_error_scale=False)
+  cfg.num_threads = args.threads
+  cfg.seed = args.seed
+  cali = pycali.Cali(cfg)
+  res["num_points"] = len(cali.cont.time) + sum([len(line.time) for line in cali.lines])
+
+  # one likelihood evaluation, and the dense reference
+  model = reference_params(cali, np.random.default_rng(args.seed))
+  nrep = max(1, int(args.repeat))
+  t0 = time.perf_counter()
+  for i in range(nrep):
+    prob = cali.log_likelihood(model)
+  res["time_likelihood"] = (time.perf_counter() - t0)/nrep
+  res["log_likelihood"] = prob
+  if max([len(cali.cont.time)] + [len(line.time) for line in cali.lines]) <= args.dense_max:
+    prob_ref = dense_reference(cali, model)
+    res["log_likelihood_dense"] = prob_ref
+    res["error_dense"] = abs(prob - prob_ref)/max(1.0, abs(prob_ref))
+
+  t0 = time.perf_counter()
+  cali.mcmc()
+  res["time_mcmc"] = time.perf_counter() - t0
+  timing = cali.get_sampler_timing()
+  res["steps"] = timing["steps"]
+  res["steps_per_second"] = timing["steps_per_second"]
+
+  # get_best_params raises RuntimeError with too few posterior samples
+  try:
+    t0 = time.perf_counter()
+    cali.get_best_params()
+    res["time_best_params"] = time.perf_counter() - t0
+  except RuntimeError:
+    pass
+  else:
+    t0 = time.perf_counter()
+    cali.recon()
+    res["time_recon"] = time.perf_counter() - t0
+
+  res["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+  sys.stdout.flush()
+  queue.put(res)
+
+def fmt(res, key, form):
+  return form%res[key] if key in res else "-"
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--points", default="100,400", help="points per code, separated by commas")
+  parser.add_argument("--codes", default="2,5", help="numbers of codes, separated by commas")
+  parser.add_argument("--lines", default="0,1", help="numbers of lines, separated by commas")
+  parser.add_argument("--nmcmc", type=int, default=2000)
+  parser.add_argument("--threads", type=int, default=1)
+  parser.add_argument("--seed", type=int, default=1, help="seed of mock data and of the sampler, must be positive")
+  parser.add_argument("--repeat", type=int, default=100, help="repeats of likelihood evaluation")
+  parser.add_argument("--dense_max", type=int, default=3000, help="maximum points of a light curve for the dense reference")
+  parser.add_argument("--tol", type=float, default=1.0e-8, help="tolerance of relative error to the dense reference")
+  parser.add_argument("--work_dir", default="bench_suite")
+  parser.add_argument("--json", default="", help="dump results to a json file")
+  args = parser.parse_args()
+  args.work_dir = os.path.abspath(args.work_dir)
+
+  cases = []
+  for npt, ncode, nline in itertools.product([int(x) for x in args.points.split(",")],
+                                             [int(x) for x in args.codes.split(",")],
+                                             [int(x) for x in args.lines.split(",")]):
+    cases.append({"name": "p%d_c%d_l%d"%(npt, ncode, nline), "points": npt, "codes": ncode, "lines": nline})
+
+  # a fresh process for each case, for the peak RSS and as the C++ code calls exit() on errors
+  ctx = mp.get_context("spawn")
+  queue = ctx.Queue()
+  results = []
+  for case in cases:
+    p = ctx.Process(target=run_case, args=(case, args, queue))
+    p.start()
+    p.join()
+    if p.exitcode == 0:
+      results.append(queue.get())
+    else:
+      results.append(dict(case, exitcode=p.exitcode))
+
+  print("%-14s %7s %10s %10s %10s %10s %10s %10s %9s %9s"%("case", "N", "load(s)", "like(ms)", "mcmc(s)",
+        "steps/s", "best(s)", "recon(s)", "RSS(MB)", "dense"))
+  failed = False
+  for res in results:
+    if "exitcode" in res:
+      print("%-14s failed with exit code %d, see %s"%(res["name"], res["exitcode"],
+            os.path.join(args.work_dir, res["name"], "bench.log")))
+      failed = True
+      continue
+    if "error_dense" in res:
+      dense = "%.1e"%res["error_dense"]
+      failed = failed or res["error_dense"] > args.tol
+    else:
+      dense = "-"
+    print("%-14s %7d %10.4f %10.4f %10.2f %10.1f %10s %10s %9.1f %9s"%(res["name"], res["num_points"], res["time_load"],
+          1.0e3*res["time_likelihood"], res["time_mcmc"], res["steps_per_second"],
+          fmt(res, "time_best_params", "%.3f"), fmt(res, "time_recon", "%.3f"), res["peak_rss_mb"], dense))
+
+  if args.json:
+    with open(args.json, "w") as fp:
+      json.dump({"args": vars(args), "results": results}, fp, indent=2)
+
+  if failed:
+    print("some cases failed or deviate from the dense reference.")
+    sys.exit(1)
@@ -7,7 +7,7 @@ import numpy as np
 # data/sim_cont.txt, data/sim_line.txt
 #
 
-pycali.generate_mock_data()
+pycali.generate_mock_data(plot=True)
 
 #######################################################
 # setup configurations, there are two ways:
@@ -13,6 +13,7 @@ import numpy as np
 from matplotlib.backends.backend_pdf import PdfPages
 from os.path import basename
 from matplotlib.ticker import MultipleLocator, FormatStrFormatter
+from pycali import read_binary
 
 class Config:
   def __init__(self, fname="param.txt"):
@@ -62,6 +63,16 @@ class Config:
     else:
       self.fixed_error_scale = 1
     
+    if "WorkDir" in param:
+      self.work_dir = param["WorkDir"]
+    else:
+      self.work_dir = "."
+
+    if "BinaryOutput" in param:
+      self.binary_output = int(param["BinaryOutput"])
+    else:
+      self.binary_output = 0
+    
 
 def simple_plot(cfg):
   """
@@ -104,7 +115,7 @@ def plot_results(cfg):
   """
   pdf = PdfPages("PyCALI_results.pdf")
   
-  file_dir = "data"
+  file_dir = cfg.work_dir + "/data"
   file_dir += "/"
   #===================================================================
   # load params
@@ -159,7 +170,11 @@ def plot_results(cfg):
     line_mean_code = np.zeros(ncode)
     lines_mean_code["%d"%j] = lines_mean_code
   
-  sample = np.loadtxt(file_dir + "/posterior_sample.txt")
+  if cfg.binary_output:
+    # map the binary file, copy on write as sample is modified below
+    sample, _ = read_binary(file_dir + "/posterior_sample.bin", mode="c")
+  else:
+    sample = np.loadtxt(file_dir + "/posterior_sample.txt")
   # take into account continuum normalization
   sample[:, 0] += np.log(cont_mean[i]) 
   sample[:, 0] /= np.log(10.0)
@@ -2,5 +2,8 @@ from .pycali import *
 from .test import *
 from .plot_results import *
 from .gen_mock import generate_mock_data
+from .batch import batch_cali
+from .async_mcmc import mcmc_async
+from .binary import read_binary
 
 del pycali
\ No newline at end of file
@@ -0,0 +1,56 @@
+#
+# run mcmc of a Cali object in a background thread, returning a future.
+#
+import threading
+from concurrent.futures import Future
+
+__all__ = ["mcmc_async", "McmcFuture"]
+
+class McmcFuture(Future):
+  """
+  future of a background mcmc run.
+
+  cancel() before the run starts prevents it, without touching the outputs of the previous run 
+  even if the thread has already called mcmc; during the run, it requests a stop,
+  the sampling stops at the next round with a checkpoint saved, and the future
+  completes normally (use mcmc(resume=True) to continue). cancel() returns False then.
+  """
+  def __init__(self, cali):
+    super().__init__()
+    self._cali = cali
+
+  def cancel(self):
+    if super().cancel():
+      return True
+    if self.running():
+      self._cali.stop()
+    return False
+
+def mcmc_async(cali, resume=False, callback=None):
+  """
+  run cali.mcmc() in a background thread, with the GIL released during sampling.
+
+  callback: called as callback(count_saves, num_levels, likelihood_per_second) after every save,
+            from the background thread. an exception raised in callback stops the sampling and
+            is set to the future.
+
+  return a McmcFuture, which completes when mcmc returns. in asyncio, use
+  "await asyncio.wrap_future(future)".
+
+  different Cali objects can run mcmc at the same time, each object runs one at a time.
+  """
+  future = McmcFuture(cali)
+
+  def run():
+    if not future.set_running_or_notify_cancel():
+      return
+    try:
+      cali.mcmc(resume, callback)
+    except BaseException as e:
+      future.set_exception(e)
+    else:
+      future.set_result(None)
+
+  thread = threading.Thread(target=run, name="pycali-mcmc", daemon=True)
+  thread.start()
+  return future
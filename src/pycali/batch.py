@@ -0,0 +1,171 @@
+#
+# batch intercalibration of many objects, each object runs in its
+# own process and its own working directory.
+#
+import os
+import sys
+import shutil
+import multiprocessing as mp
+from queue import Empty
+import numpy as np
+
+__all__ = ["batch_cali"]
+
+# attributes of Config passed to the job processes
+_cfg_keys = ["nmcmc", "ptol",
+             "scale_range_low", "scale_range_up",
+             "shift_range_low", "shift_range_up",
+             "syserr_range_low", "syserr_range_up",
+             "errscale_range_low", "errscale_range_up",
+             "sigma_range_low", "sigma_range_up",
+             "tau_range_low", "tau_range_up",
+             "fixed_scale", "fixed_shift",
+             "fixed_syserr", "fixed_error_scale"]
+
+# options set as attributes since Config.setup() does not take them
+_cfg_opts = ["num_particles", "new_level_interval", "save_interval", "thread_steps",
+             "max_num_levels", "lambda_", "beta", "auto_tune",
+             "binary_output", "sync_policy", "cache_dir",
+             "stop_ess", "stop_logz_tol", "max_wall_time", "marg_shift",
+             "recon_cadence", "recon_time_low", "recon_time_up",
+             "recon_time_cont", "recon_time_line"]
+
+def _cfg_to_dict(cfg):
+  """
+  convert a Config into a dict, Config itself cannot be pickled.
+  """
+  if isinstance(cfg, str):
+    from .pycali import Config
+    cfg = Config(cfg)
+
+  par = {}
+  par["fcont"] = os.path.abspath(cfg.fcont)
+  par["fline"] = [os.path.abspath(fl) for fl in cfg.fline]
+  for key in _cfg_keys:
+    par[key] = getattr(cfg, key)
+  par["num_threads"] = cfg.num_threads
+  par["seed"] = cfg.seed
+  for key in _cfg_opts:
+    par[key] = getattr(cfg, key)
+  # jobs run in their own workdir, share one cache among them
+  if par["cache_dir"]:
+    par["cache_dir"] = os.path.abspath(par["cache_dir"])
+  return par
+
+def _run_job(name, workdir, par, recon, queue):
+  """
+  run intercalibration of one object in workdir.
+  the light curves are copied into workdir/data/ so that outputs
+  of different jobs do not clobber each other.
+  """
+  os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+
+  fcont = os.path.join("data", os.path.basename(par["fcont"]))
+  shutil.copy(par["fcont"], os.path.join(workdir, fcont))
+  fline = []
+  for fl in par["fline"]:
+    fline.append(os.path.join("data", os.path.basename(fl)))
+    shutil.copy(fl, os.path.join(workdir, fline[-1]))
+
+  os.chdir(workdir)
+
+  # redirect outputs of the C++ code to a log file
+  sys.stdout.flush()
+  sys.stderr.flush()
+  flog = os.open("cali.log", os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0o644)
+  os.dup2(flog, 1)
+  os.dup2(flog, 2)
+  os.close(flog)
+
+  from .pycali import Config, Cali
+  cfg = Config()
+  kwargs = {key: par[key] for key in _cfg_keys}
+  cfg.setup(fcont=fcont, fline=fline, **kwargs)
+  cfg.num_threads = par["num_threads"]
+  cfg.seed = par["seed"]
+  for key in _cfg_opts:
+    setattr(cfg, key, par[key])
+  cfg.print_cfg()
+
+  cali = Cali(cfg)
+  cali.mcmc()
+  cali.get_best_params()
+  cali.output()
+  if recon:
+    cali.recon()
+
+  sys.stdout.flush()
+  queue.put((name, np.array(cali.best_params), np.array(cali.best_params_std)))
+
+def batch_cali(cfgs, names=None, workdir="batch", processes=None, recon=False):
+  """
+  intercalibrate a list of objects over a pool of processes.
+
+  cfgs: list of Config instances or param file names.
+  names: names of the objects, used as the subdirectories of workdir.
+         default: obj0000, obj0001, ...
+  workdir: the top directory of outputs.
+  processes: number of processes, default: the number of cpus.
+  recon: whether do reconstruction.
+
+  return a dict with names as keys, each item is a dict with keys
+  "workdir", "best_params", "best_params_std", and "exitcode".
+  best_params and best_params_std are None if the job fails;
+  see cali.log in the job directory for details.
+
+  note that the main script should be protected by
+  'if __name__ == "__main__":', as the jobs are started by spawning.
+  """
+  if names is None:
+    names = ["obj%04d"%i for i in range(len(cfgs))]
+  if len(names) != len(cfgs):
+    raise ValueError("names and cfgs have different lengths.")
+  if len(set(names)) != len(names):
+    raise ValueError("names are not unique.")
+
+  if processes is None:
+    processes = os.cpu_count() or 1
+
+  # the C++ code calls exit() on errors, so each job runs in
+  # a fresh process instead of a reused pool worker.
+  ctx = mp.get_context("spawn")
+  queue = ctx.Queue()
+  pending = []
+  for name, cfg in zip(names, cfgs):
+    pending.append((name, os.path.abspath(os.path.join(workdir, name)), _cfg_to_dict(cfg)))
+  pending.reverse()
+
+  results = {}
+  running = {}
+  while pending or running:
+    while pending and len(running) < processes:
+      name, wdir, par = pending.pop()
+      results[name] = {"workdir": wdir, "best_params": None, "best_params_std": None, "exitcode": None}
+      p = ctx.Process(target=_run_job, args=(name, wdir, par, recon, queue))
+      p.start()
+      running[name] = p
+
+    try:
+      name, best, std = queue.get(timeout=1.0)
+      results[name]["best_params"] = best
+      results[name]["best_params_std"] = std
+    except Empty:
+      pass
+
+    # collect finished jobs, including those exit without results
+    for key in list(running.keys()):
+      if not running[key].is_alive():
+        running[key].join()
+        results[key]["exitcode"] = running[key].exitcode
+        del running[key]
+
+  # results put just before the processes exit
+  while True:
+    try:
+      name, best, std = queue.get(timeout=0.1)
+      results[name]["best_params"] = best
+      results[name]["best_params_std"] = std
+    except Empty:
+      break
+
+  return results
@@ -0,0 +1,39 @@
+#
+# read binary sample files generated by PyCALI (with BinaryOutput turned on).
+#
+# a binary file consists of a 64-byte header followed by a contiguous float64
+# array with a shape of (num_rows, num_cols).
+#
+import numpy as np
+
+__all__ = ["read_binary"]
+
+# layout of the header, see DNestBinHeader in cdnest/dnestvars.h
+_header_dtype = np.dtype([("magic", "S8"), ("version", "<i4"), ("num_cols", "<i4"),
+                          ("num_rows", "<i8"), ("layout", "<i4", (10,))])
+
+def read_binary(fname, mode="r"):
+  """
+  read a binary file through np.memmap, no data are copied.
+
+  mode: mode of np.memmap, use "c" if the returned array is to be modified
+        without changing the file.
+
+  return the array with a shape of (num_rows, num_cols) and the header as a dict.
+  the layout of the header stores [num_params, num_params_var, ncode, nlines, num_params_free].
+  sample.bin only holds the free parameters, whose indices are in data/free_params.txt.
+  """
+  header = np.fromfile(fname, dtype=_header_dtype, count=1)
+  if header.shape[0] != 1 or header["magic"][0] != b"DNESTBIN":
+    raise ValueError("%s is not a binary file of PyCALI."%fname)
+
+  num_cols = int(header["num_cols"][0])
+
+  # number of rows is determined by file size so that files of an interrupted run are readable.
+  data = np.memmap(fname, dtype=np.float64, mode=mode, offset=_header_dtype.itemsize)
+  num_rows = data.shape[0]//num_cols
+  data = data[:num_rows*num_cols].reshape((num_rows, num_cols))
+
+  info = {"version": int(header["version"][0]), "num_cols": num_cols, "num_rows": num_rows,
+          "layout": header["layout"][0].tolist()}
+  return data, info
@@ -13,285 +13,508 @@
 #include <unistd.h>
 #include <math.h>
 #include <float.h>
+#include <stddef.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 #include <gsl/gsl_rng.h>
 #include <gsl/gsl_randist.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 #include "dnestvars.h"
 
-double dnest(int argc, char** argv, DNestFptrSet *fptrset, int num_params, 
+/*
+ * run the sampler on ctx, which holds all the state of the run, 
+ * so that samplers of different contexts can run in different threads at the same time.
+ * if the run does not complete, dnest_get_error() returns nonzero.
+ */
+double dnest(DNestContext *ctx, int argc, char** argv, DNestFptrSet *fptrset, int num_params, 
              char *sample_dir, int max_num_saves, double ptol, const void *arg)
 {
-  int opt;
+  int i, opt, flag;
+  char *p, *optval;
   
-  dnest_arg = arg;
+  /* the context of the calling thread, see dnest_get_arg() etc. */
+  dnest_ctx = ctx;
+  ctx->arg = arg;
   
   dnest_check_fptrset(fptrset);
 
   // cope with argv
   
-  dnest_post_temp = 1.0;
-  dnest_flag_restart = 0;
-  dnest_flag_postprc = 0;
-  dnest_flag_sample_info = 0;
-  dnest_flag_limits = 0;
-
-  strcpy(file_save_restart, "restart_dnest.txt");
-  strcpy(dnest_sample_postfix, "\0");
-  strcpy(dnest_sample_tag, "\0");
-    
-  opterr = 0;
-  optind = 0;
-  while( (opt = getopt(argc, argv, "r:s:pt:clx:g:")) != -1)
+  ctx->post_temp = 1.0;
+  ctx->flag_restart = 0;
+  ctx->flag_postprc = 0;
+  ctx->flag_sample_info = 0;
+  ctx->flag_limits = 0;
+  ctx->flag_binary = 0;
+  ctx->error = 0;
+
+  strcpy(ctx->file_save_restart, "restart_dnest.txt");
+  strcpy(ctx->sample_postfix, "\0");
+  strcpy(ctx->sample_tag, "\0");
+  
+  /* options as getopt() with "r:s:pt:clx:g:b", which keeps its state in globals */
+  for(i=1; i<argc; i++)
   {
-    switch(opt)
+    if(argv[i][0] != '-')
+      continue;
+
+    for(p=argv[i]+1; *p != '\0'; p++)
     {
-      case 'r':
-        dnest_flag_restart = 1;
-        strcpy(file_restart, optarg);
-        printf("# Dnest restarts.\n");
-        break;
-      case 's':
-        strcpy(file_save_restart, optarg);
-        //printf("# Dnest sets restart file %s.\n", file_save_restart);
-        break;
-      case 'p':
-        dnest_flag_postprc = 1;
-        dnest_post_temp = 1.0;
-        printf("# Dnest does postprocess.\n");
-        break;
-      case 't':
-        dnest_post_temp = atof(optarg);
-        printf("# Dnest sets a temperature %f.\n", dnest_post_temp);
-        if(dnest_post_temp == 0.0)
+      opt = *p;
+      optval = NULL;
+      if(strchr("rstxg", opt) != NULL)
+      {
+        if(*(p+1) != '\0')
+          optval = p+1;
+        else if(i+1 < argc)
+          optval = argv[++i];
+        else
         {
-          printf("# Dnest incorrect option -t %s.\n", optarg);
+          printf("# Dnest option -%c requires an argument.\n", opt);
           exit(0);
         }
-        if(dnest_post_temp < 1.0)
-        {
-          printf("# Dnest temperature should >= 1.0\n");
+      }
+
+      switch(opt)
+      {
+        case 'r':
+          ctx->flag_restart = 1;
+          strcpy(ctx->file_restart, optval);
+          printf("# Dnest restarts.\n");
+          break;
+        case 's':
+          strcpy(ctx->file_save_restart, optval);
+          //printf("# Dnest sets restart file %s.\n", ctx->file_save_restart);
+          break;
+        case 'p':
+          ctx->flag_postprc = 1;
+          ctx->post_temp = 1.0;
+          printf("# Dnest does postprocess.\n");
+          break;
+        case 't':
+          ctx->post_temp = atof(optval);
+          printf("# Dnest sets a temperature %f.\n", ctx->post_temp);
+          if(ctx->post_temp == 0.0)
+          {
+            printf("# Dnest incorrect option -t %s.\n", optval);
+            exit(0);
+          }
+          if(ctx->post_temp < 1.0)
+          {
+            printf("# Dnest temperature should >= 1.0\n");
+            exit(0);
+          }
+          break;
+        case 'c':
+          ctx->flag_sample_info = 1;
+          printf("# Dnest recalculates sample information.\n");
+          break;
+        case 'l':
+          ctx->flag_limits = 1;
+          printf("# Dnest level-dependent sampling.\n");
+          break;
+        case 'x':
+          strcpy(ctx->sample_postfix, optval);
+          printf("# Dnest sets sample postfix %s.\n", ctx->sample_postfix);
+          break;
+        case 'g':
+          strcpy(ctx->sample_tag, optval);
+          printf("# Dnest sets sample tag %s.\n", ctx->sample_tag);
+          break;
+        case 'b':
+          ctx->flag_binary = 1;
+          printf("# Dnest uses binary sample files.\n");
+          break;
+        default:
+          printf("# Dnest incorrect option -%c.\n", opt);
           exit(0);
-        }
-        break;
-      case 'c':
-        dnest_flag_sample_info = 1;
-        printf("# Dnest recalculates sample information.\n");
-        break;
-      case 'l':
-        dnest_flag_limits = 1;
-        printf("# Dnest level-dependent sampling.\n");
-        break;
-      case 'x':
-        strcpy(dnest_sample_postfix, optarg);
-        printf("# Dnest sets sample postfix %s.\n", dnest_sample_postfix);
-        break;
-      case 'g':
-        strcpy(dnest_sample_tag, optarg);
-        printf("# Dnest sets sample tag %s.\n", dnest_sample_tag);
-        break;
-      case '?':
-        printf("# Dnest incorrect option -%c %s.\n", optopt, optarg);
-        exit(0);
-        break;
-      default:
+          break;
+      }
+      if(optval != NULL)
         break;
     }
   }
   
-  setup(argc, argv, fptrset, num_params, sample_dir, max_num_saves, ptol);
-
-  if(dnest_flag_postprc == 1)
+  /* a stop requested before the start (e.g., a cancelled run) returns at once, 
+   * leaving the outputs of the previous run untouched */
+  flag = ctx->stop_request;
+#ifdef USE_MPI
+  MPI_Allreduce(MPI_IN_PLACE, &flag, 1, MPI_INT, MPI_MAX, MPI_COMM_WORLD);
+#endif
+  if(flag != 0)
   {
-    dnest_postprocess(dnest_post_temp, max_num_saves, ptol);
-    finalise();
-    return post_logz;
+    if(dnest_get_thistask() == 0)
+      printf("# Dnest stops on request before the start.\n");
+    ctx->error = DNEST_ERROR_STOPPED;
+    return 0.0;
   }
 
-  if(dnest_flag_sample_info == 1)
+  setup(ctx, fptrset, num_params, sample_dir, max_num_saves, ptol);
+
+  /* sample files are written and postprocessed by the root task */
+  if(ctx->flag_postprc == 1 || ctx->flag_sample_info == 1)
   {
-    dnest_postprocess(dnest_post_temp, max_num_saves, ptol);
-    finalise();
-    return post_logz;
+    if(ctx->thistask == ctx->root)
+      dnest_postprocess(ctx, ctx->post_temp, max_num_saves, ptol);
+#ifdef USE_MPI
+    MPI_Bcast(&ctx->post_logz, 1, MPI_DOUBLE, ctx->root, MPI_COMM_WORLD);
+#endif
+    finalise(ctx);
+    return ctx->post_logz;
   }
 
-  if(dnest_flag_restart==1)
-    dnest_restart();
-
-  initialize_output_file();
-  dnest_run();
-  close_output_file();
+  /* a failed restart leaves the outputs of the previous run untouched */
+  if(ctx->flag_restart==1 && dnest_restart(ctx) != 0)
+    ctx->error = DNEST_ERROR_CHECKPOINT;
+#ifdef USE_MPI
+  MPI_Allreduce(MPI_IN_PLACE, &ctx->error, 1, MPI_INT, MPI_MAX, MPI_COMM_WORLD);
+#endif
+  if(ctx->error != 0)
+  {
+    finalise(ctx);
+    return 0.0;
+  }
 
-  dnest_postprocess(dnest_post_temp, max_num_saves, ptol);
+  if(ctx->thistask == ctx->root)
+    initialize_output_file(ctx);
+  if(dnest_run(ctx) != 0)
+    ctx->error = DNEST_ERROR_CHECKPOINT;
+  if(ctx->thistask == ctx->root)
+  {
+    close_output_file(ctx);
+    if(ctx->error == 0)
+      dnest_postprocess(ctx, ctx->post_temp, max_num_saves, ptol);
+  }
+  if(ctx->error != 0)
+  {
+    finalise(ctx);
+    return 0.0;
+  }
+#ifdef USE_MPI
+  MPI_Bcast(&ctx->post_logz, 1, MPI_DOUBLE, ctx->root, MPI_COMM_WORLD);
+#endif
 
-  finalise();
+  finalise(ctx);
   
-  return post_logz;
+  return ctx->post_logz;
 }
 
 // postprocess, calculate evidence, generate posterior sample.
-void dnest_postprocess(double temperature, int max_num_saves, double ptol)
+void dnest_postprocess(DNestContext *ctx, double temperature, int max_num_saves, double ptol)
 {
-  options_load(max_num_saves, ptol);
-  postprocess(temperature);
+  double t0 = dnest_wtime();
+
+  options_load(ctx, max_num_saves, ptol);
+  postprocess(ctx, temperature);
+
+  ctx->time_postprocess = dnest_wtime() - t0;
 }
 
-void dnest_run()
+/* 
+ * run the sampling, return nonzero if a checkpoint cannot be written.
+ */
+int dnest_run(DNestContext *ctx)
 {
-  int i, j, k, size_all_above_incr;
-  Level *pl, *levels_orig;
-  int *buf_size_above, *buf_displs;
-  double *plimits;
+  int i, j, k, flag_error = 0;
+  
+  double t_start, t_io, t_conv;
+  unsigned long long int steps_start = ctx->count_mcmc_steps; /* nonzero if restarted */
+  long int offset_start = 0;
   
-  printf("# Start diffusive nested sampling.\n");
+  int flag_stop = 0;
+  bool flag_kill;
+  
+  if(ctx->thistask == ctx->root)
+  {
+    printf("# Start diffusive nested sampling with %d task(s).\n", ctx->totaltask);
+    fseek(ctx->fsample, 0, SEEK_END);
+    fseek(ctx->fsample_info, 0, SEEK_END);
+    offset_start = ftell(ctx->fsample) + ftell(ctx->fsample_info);
+  }
+  t_start = dnest_wtime();
+  ctx->time_likelihood = 0.0;
+  ctx->stop_logz_last = -DBL_MAX;
+  ctx->time_io = ctx->time_convergence = 0.0;
+  ctx->bytes_written = 0;
 
   while(true)
   {
     //check for termination
-    if(options.max_num_saves !=0 &&
-        count_saves != 0 && (count_saves%options.max_num_saves == 0))
+    if(ctx->options.max_num_saves !=0 &&
+        ctx->count_saves != 0 && ctx->count_saves >= ctx->options.max_num_saves)
+      break;
+
+    /* the root task decides on stopping for all tasks */
+    if(ctx->thistask == ctx->root)
+    {
+      if(ctx->stop_time > 0.0 && dnest_wtime() - t_start >= ctx->stop_time)
+      {
+        printf("# Reach the maximum wall-clock time %.1f s at N= %d.\n", ctx->stop_time, ctx->count_saves);
+        flag_stop = 1;
+      }
+      else if(ctx->stop_request)
+      {
+        printf("# Stop on request at N= %d.\n", ctx->count_saves);
+        flag_stop = 1;
+      }
+    }
+#ifdef USE_MPI
+    MPI_Bcast(&flag_stop, 1, MPI_INT, ctx->root, MPI_COMM_WORLD);
+#endif
+    if(flag_stop == 1)
       break;
 
-    dnest_mcmc_run();
+#ifdef USE_MPI
+    memcpy(ctx->levels_task_orig, ctx->levels, ctx->size_levels * sizeof(Level));
+#endif
+    if(ctx->num_threads > 1)
+    {
+      dnest_mcmc_run_threads(ctx);
+    }
+    else
+    {
+      dnest_time_likelihood_thread = 0.0;
+      dnest_mcmc_run(ctx);
+      ctx->time_likelihood += dnest_time_likelihood_thread;
+    }
+
+    ctx->count_mcmc_steps += ctx->options.thread_steps * ctx->num_threads * ctx->totaltask;
 
-    count_mcmc_steps += options.thread_steps;
-    
-    if(dnest_flag_limits == 1)
+#ifdef USE_MPI
+    dnest_mpi_merge_levels(ctx);
+#endif
+
+    /* levels are created on the root task and then sent to the others */
+    flag_kill = false;
+    if(ctx->thistask == ctx->root)
     {
-      // limits of smaller levels should be larger than those of higher levels
-      for(j=size_levels-2; j >= 0; j--)
-        for(k=0; k<particle_offset_double; k++)
-        {
-          limits[ j * particle_offset_double *2 + k*2 ] = fmin( limits[ j * particle_offset_double *2 + k*2 ],
-                  limits[ (j+1) * particle_offset_double *2 + k*2 ] );
-          limits[ j * particle_offset_double *2 + k*2 + 1] = fmax( limits[ j * particle_offset_double *2 + k*2 +1 ],
-                  limits[ (j+1) * particle_offset_double *2 + k*2 + 1 ] );
-        }
+      if(ctx->flag_limits == 1)
+      {
+        // limits of smaller levels should be larger than those of higher levels
+        for(j=ctx->size_levels-2; j >= 0; j--)
+          for(k=0; k<ctx->particle_offset_double; k++)
+          {
+            ctx->limits[ j * ctx->particle_offset_double *2 + k*2 ] = 
+                fmin( ctx->limits[ j * ctx->particle_offset_double *2 + k*2 ],
+                    ctx->limits[ (j+1) * ctx->particle_offset_double *2 + k*2 ] );
+            ctx->limits[ j * ctx->particle_offset_double *2 + k*2 + 1] = 
+                fmax( ctx->limits[ j * ctx->particle_offset_double *2 + k*2 +1 ],
+                    ctx->limits[ (j+1) * ctx->particle_offset_double *2 + k*2 + 1 ] );
+          }
+      }
+
+      flag_kill = do_bookkeeping(ctx);
     }
 
-    do_bookkeeping();
+#ifdef USE_MPI
+    dnest_mpi_bcast_levels(ctx, &flag_kill);
+#endif
+    if(flag_kill)
+      kill_lagging_particles(ctx);
 
-    if(count_mcmc_steps >= (count_saves + 1)*options.save_interval)
+    if(ctx->count_mcmc_steps >= (ctx->count_saves + 1)*ctx->options.save_interval)
     {
-      save_particle();
+      t_io = dnest_wtime();
+      save_particle(ctx);
 
       // save levels, limits, sync samples when running a number of steps
-      if( count_saves % num_saves == 0 )
+      if( ctx->thistask == ctx->root && ctx->count_saves % ctx->num_saves == 0 )
       {
-        if(size_levels <= options.max_num_levels)
+        if(ctx->size_levels <= ctx->options.max_num_levels)
         {
-          save_levels();
+          save_levels(ctx);
 
-          printf("# Save levels at N= %d.\n", count_saves);
+          printf("# Save levels at N= %d.\n", ctx->count_saves);
+        }
+        if(ctx->flag_limits == 1)
+          save_limits(ctx);
+        if(ctx->sync_policy != DNEST_SYNC_NONE)
+        {
+          if(ctx->flag_binary == 1)
+          {
+            dnest_update_bin_header(ctx->fsample_info, 4);
+            dnest_update_bin_header(ctx->fsample, ctx->particle_offset_double);
+          }
+          fflush(ctx->fsample_info);
+          fflush(ctx->fsample);
+          if(ctx->sync_policy == DNEST_SYNC_FSYNC)
+          {
+            fsync(fileno(ctx->fsample_info));
+            fsync(fileno(ctx->fsample));
+          }
+          printf("# Save limits, and sync samples at N= %d.\n", ctx->count_saves);
         }
-        if(dnest_flag_limits == 1)
-          save_limits();
-        fflush(fsample_info);
-        fsync(fileno(fsample_info));
-        fflush(fsample);
-        fsync(fileno(fsample));
-        printf("# Save limits, and sync samples at N= %d.\n", count_saves);
+
+        if(ctx->stop_ess > 0.0)
+        {
+          t_conv = dnest_wtime();
+          if(dnest_check_convergence(ctx))
+          {
+            printf("# Converged at N= %d.\n", ctx->count_saves);
+            flag_stop = 1;
+          }
+          t_conv = dnest_wtime() - t_conv;
+          ctx->time_convergence += t_conv;
+          t_io += t_conv; /* not counted as I/O */
+        }
+      }
+#ifdef USE_MPI
+      MPI_Bcast(&flag_stop, 1, MPI_INT, ctx->root, MPI_COMM_WORLD);
+#endif
+
+      // checkpoint, along with the periodic sync of samples or every num_saves_restart samples
+      if( (ctx->sync_policy != DNEST_SYNC_NONE && ctx->count_saves % ctx->num_saves == 0)
+         || ctx->count_saves % ctx->num_saves_restart == 0 )
+      {
+        flag_error = dnest_save_restart(ctx);
+        if(flag_error != 0)
+          break;
+      }
+      ctx->time_io += dnest_wtime() - t_io;
+
+      if(ctx->progress != NULL && ctx->thistask == ctx->root)
+      {
+        /* one likelihood evaluation per step */
+        ctx->progress(ctx->count_saves, ctx->size_levels, 
+                       (ctx->count_mcmc_steps - steps_start)/fmax(t_io - t_start, DBL_MIN), ctx->progress_arg);
       }
 
-      //if( count_saves % num_saves_restart == 0 )
-      //{
-      //  dnest_save_restart();
-      //}
+      if(flag_stop == 1)
+        break;
     }
   }
-  
-  //dnest_save_restart();
+
+  /* stopped before max_num_saves, a restart continues the sampling */
+  if(flag_stop == 1 && flag_error == 0)
+    flag_error = dnest_save_restart(ctx);
+
+  ctx->time_sampling = dnest_wtime() - t_start;
+  ctx->steps_sampling = ctx->count_mcmc_steps - steps_start;
+  if(ctx->thistask == ctx->root)
+  {
+    fseek(ctx->fsample, 0, SEEK_END);
+    fseek(ctx->fsample_info, 0, SEEK_END);
+    ctx->bytes_written += ftell(ctx->fsample) + ftell(ctx->fsample_info) - offset_start;
+    /* steps of all tasks, likelihood time of the root task */
+    printf("# Sampling: %llu steps in %.2f s, %.1f steps/s, %.1f%% of thread time in likelihood.\n", 
+           ctx->steps_sampling, ctx->time_sampling, ctx->steps_sampling/fmax(ctx->time_sampling, DBL_MIN),
+           100.0*ctx->time_likelihood/fmax(ctx->time_sampling*ctx->num_threads, DBL_MIN));
+  }
 
   //save levels
-  save_levels();
-  if(dnest_flag_limits == 1)
-    save_limits();
+  save_levels(ctx);
+  if(ctx->flag_limits == 1)
+    save_limits(ctx);
+
+  /* acceptance of levels, see dnest_get_level_stats() */
+  ctx->num_levels_stats = ctx->size_levels;
+  ctx->level_accepts = realloc(ctx->level_accepts, ctx->size_levels * sizeof(unsigned long long int));
+  ctx->level_tries = realloc(ctx->level_tries, ctx->size_levels * sizeof(unsigned long long int));
+  for(i=0; i<ctx->size_levels; i++)
+  {
+    ctx->level_accepts[i] = ctx->levels[i].accepts;
+    ctx->level_tries[i] = ctx->levels[i].tries;
+  }
 
   /* output state of sampler */
-  FILE *fp;
-  fp = fopen(options.sampler_state_file, "w");
-  fprintf(fp, "%d %d\n", size_levels, count_saves);
-  fclose(fp);
+  if(ctx->save_to_disk)
+  {
+    FILE *fp;
+    fp = fopen(ctx->options.sampler_state_file, "w");
+    fprintf(fp, "%d %d\n", ctx->size_levels, ctx->count_saves);
+    fclose(fp);
+  }
+  return flag_error;
 }
 
-void do_bookkeeping()
+/* 
+ * create a new level from the above buffer, 
+ * return true if lagging particles should be killed on all tasks.
+ */
+bool do_bookkeeping(DNestContext *ctx)
 {
   int i;
-  //bool created_level = false;
+  bool created_level = false;
 
-  if(!enough_levels(levels, size_levels) && size_above >= options.new_level_interval)
+  if(!enough_levels(ctx, ctx->levels, ctx->size_levels) && ctx->size_above >= ctx->options.new_level_interval)
   {
     // in descending order 
-    qsort(above, size_above, sizeof(LikelihoodType), dnest_cmp);
-    int index = (int)( (1.0/compression) * size_above);
+    qsort(ctx->above, ctx->size_above, sizeof(LikelihoodType), dnest_cmp);
+    int index = (int)( (1.0/ctx->compression) * ctx->size_above);
 
-    Level level_tmp = {above[index], 0.0, 0, 0, 0, 0};
-    levels[size_levels] = level_tmp;
-    size_levels++;
+    Level level_tmp = {ctx->above[index], 0.0, 0, 0, 0, 0};
+    ctx->levels[ctx->size_levels] = level_tmp;
+    ctx->size_levels++;
     
     printf("# Creating level %d with log likelihood = %e.\n", 
-               size_levels-1, levels[size_levels-1].log_likelihood.value);
+               ctx->size_levels-1, ctx->levels[ctx->size_levels-1].log_likelihood.value);
 
     // clear out the last index records
-    for(i=index; i<size_above; i++)
+    for(i=index; i<ctx->size_above; i++)
     {
-      above[i].value = 0.0;
-      above[i].tiebreaker = 0.0;
+      ctx->above[i].value = 0.0;
+      ctx->above[i].tiebreaker = 0.0;
     }
-    size_above = index;
+    ctx->size_above = index;
 
-    if(enough_levels(levels, size_levels))
+    if(enough_levels(ctx, ctx->levels, ctx->size_levels))
     {
-      renormalise_visits();
-      options.max_num_levels = size_levels;
+      renormalise_visits(ctx);
+      ctx->options.max_num_levels = ctx->size_levels;
       printf("# Done creating levles.\n");
     }
     else
     {
-      kill_lagging_particles();
+      created_level = true;
     }
   }
-  recalculate_log_X();
+  recalculate_log_X(ctx);
+  return created_level;
 }
 
-void recalculate_log_X()
+void recalculate_log_X(DNestContext *ctx)
 {
   int i;
 
-  levels[0].log_X = 0.0;
-  for(i=1; i<size_levels; i++)
+  ctx->levels[0].log_X = 0.0;
+  for(i=1; i<ctx->size_levels; i++)
   {
-    levels[i].log_X = levels[i-1].log_X 
-    + log( (double)( (levels[i-1].exceeds + 1.0/compression * regularisation)
-                    /(levels[i-1].visits + regularisation)  ) );
+    ctx->levels[i].log_X = ctx->levels[i-1].log_X 
+    + log( (double)( (ctx->levels[i-1].exceeds + 1.0/ctx->compression * ctx->regularisation)
+                    /(ctx->levels[i-1].visits + ctx->regularisation)  ) );
   }
 }
 
-void renormalise_visits()
+void renormalise_visits(DNestContext *ctx)
 {
   size_t i;
 
-  for(i=0; i<size_levels; i++)
+  for(i=0; i<ctx->size_levels; i++)
   {
-    if(levels[i].tries >= regularisation)
+    if(ctx->levels[i].tries >= ctx->regularisation)
     {
-      levels[i].accepts = ((double)(levels[i].accepts+1) / (double)(levels[i].tries+1)) * regularisation;
-      levels[i].tries = regularisation;
+      ctx->levels[i].accepts = ((double)(ctx->levels[i].accepts+1) / (double)(ctx->levels[i].tries+1)) 
+                               * ctx->regularisation;
+      ctx->levels[i].tries = ctx->regularisation;
     }
 
-    if(levels[i].visits >= regularisation)
+    if(ctx->levels[i].visits >= ctx->regularisation)
     {
-      levels[i].exceeds = ( (double) (levels[i].exceeds+1) / (double)(levels[i].visits + 1) ) * regularisation;
-      levels[i].visits = regularisation;
+      ctx->levels[i].exceeds = ( (double) (ctx->levels[i].exceeds+1) / (double)(ctx->levels[i].visits + 1) ) 
+                               * ctx->regularisation;
+      ctx->levels[i].visits = ctx->regularisation;
     }
   }
 }
 
-void kill_lagging_particles()
+void kill_lagging_particles(DNestContext *ctx)
 {
-  static unsigned int deletions = 0;
-
   bool *good;
-  good = (bool *)malloc(options.num_particles * sizeof(bool));
+  good = (bool *)malloc(ctx->options.num_particles * sizeof(bool));
 
   double max_log_push = -DBL_MAX;
 
@@ -299,14 +522,14 @@ void kill_lagging_particles()
   unsigned int num_bad = 0;
   size_t i;
 
-  for(i=0; i<options.num_particles; i++)good[i] = true;
+  for(i=0; i<ctx->options.num_particles; i++)good[i] = true;
 
-  for(i=0; i<options.num_particles; i++)
+  for(i=0; i<ctx->options.num_particles; i++)
   {
-    if( log_push(level_assignments[i]) > max_log_push)
-      max_log_push = log_push(level_assignments[i]);
+    if( log_push(ctx, ctx->level_assignments[i]) > max_log_push)
+      max_log_push = log_push(ctx, ctx->level_assignments[i]);
 
-    kill_probability = pow(1.0 - 1.0/(1.0 + exp(-log_push(level_assignments[i]) - 4.0)), 3);
+    kill_probability = pow(1.0 - 1.0/(1.0 + exp(-log_push(ctx, ctx->level_assignments[i]) - 4.0)), 3);
     if(gsl_rng_uniform(dnest_gsl_r) <= kill_probability)
     {
       good[i] = false;
@@ -314,28 +537,30 @@ void kill_lagging_particles()
     }
   }
 
-  if(num_bad < options.num_particles)
+  if(num_bad < ctx->options.num_particles)
   {
-    for(i=0; i< options.num_particles; i++)
+    for(i=0; i< ctx->options.num_particles; i++)
     {
       if(!good[i])
       {
         int i_copy;
         do
         {
-          i_copy = gsl_rng_uniform_int(dnest_gsl_r, options.num_particles);
-        }while(!good[i_copy] || gsl_rng_uniform(dnest_gsl_r) >= exp(log_push(level_assignments[i_copy]) - max_log_push));
-
-        memcpy(particles+i*particle_offset_size, particles + i_copy*particle_offset_size, dnest_size_of_modeltype);
-        log_likelihoods[i] = log_likelihoods[i_copy];
-        level_assignments[i] = level_assignments[i_copy];
+          i_copy = gsl_rng_uniform_int(dnest_gsl_r, ctx->options.num_particles);
+        }while(!good[i_copy] 
+               || gsl_rng_uniform(dnest_gsl_r) >= exp(log_push(ctx, ctx->level_assignments[i_copy]) - max_log_push));
+
+        memcpy(ctx->particles+i*ctx->particle_offset_size, ctx->particles + i_copy*ctx->particle_offset_size, 
+               ctx->size_of_modeltype);
+        ctx->log_likelihoods[i] = ctx->log_likelihoods[i_copy];
+        ctx->level_assignments[i] = ctx->level_assignments[i_copy];
          
-        kill_action(i, i_copy);
+        ctx->kill_action(i, i_copy);
 
-        deletions++;
+        ctx->deletions++;
 
         printf("# Replacing lagging particle.\n");
-        printf("# This has happened %d times.\n", deletions);
+        printf("# This has happened %d times.\n", ctx->deletions);
       }
     }
   }
@@ -346,81 +571,147 @@ void kill_lagging_particles()
 }
 
 /* save levels */
-void save_levels()
+void save_levels(DNestContext *ctx)
 {
-  if(!save_to_disk)
+  if(!ctx->save_to_disk)
     return;
   
   int i;
   FILE *fp;
 
-  fp = fopen(options.levels_file, "w");
-  fprintf(fp, "# log_X, log_likelihood, tiebreaker, accepts, tries, exceeds, visits\n");
-  for(i=0; i<size_levels; i++)
+  if(ctx->flag_binary == 1)
   {
-    fprintf(fp, "%14.12g %14.12g %f %llu %llu %llu %llu\n", levels[i].log_X, levels[i].log_likelihood.value, 
-      levels[i].log_likelihood.tiebreaker, levels[i].accepts,
-      levels[i].tries, levels[i].exceeds, levels[i].visits);
+    double row[7];
+    fp = fopen(ctx->options.levels_file, "wb");
+    dnest_write_bin_header(fp, 7, ctx->size_levels, ctx->bin_layout, DNEST_BIN_LAYOUT_MAX);
+    for(i=0; i<ctx->size_levels; i++)
+    {
+      row[0] = ctx->levels[i].log_X;
+      row[1] = ctx->levels[i].log_likelihood.value;
+      row[2] = ctx->levels[i].log_likelihood.tiebreaker;
+      row[3] = ctx->levels[i].accepts;
+      row[4] = ctx->levels[i].tries;
+      row[5] = ctx->levels[i].exceeds;
+      row[6] = ctx->levels[i].visits;
+      fwrite(row, sizeof(double), 7, fp);
+    }
+    ctx->bytes_written += ftell(fp);
+    fclose(fp);
+  }
+  else 
+  {
+    fp = fopen(ctx->options.levels_file, "w");
+    fprintf(fp, "# log_X, log_likelihood, tiebreaker, accepts, tries, exceeds, visits\n");
+    for(i=0; i<ctx->size_levels; i++)
+    {
+      fprintf(fp, "%14.12g %14.12g %f %llu %llu %llu %llu\n", ctx->levels[i].log_X, ctx->levels[i].log_likelihood.value, 
+        ctx->levels[i].log_likelihood.tiebreaker, ctx->levels[i].accepts,
+        ctx->levels[i].tries, ctx->levels[i].exceeds, ctx->levels[i].visits);
+    }
+    ctx->bytes_written += ftell(fp);
+    fclose(fp);
   }
-  fclose(fp);
 
   /* update state of sampler */
-  fp = fopen(options.sampler_state_file, "w");
-  fprintf(fp, "%d %d\n", size_levels, count_saves);
+  fp = fopen(ctx->options.sampler_state_file, "w");
+  fprintf(fp, "%d %d\n", ctx->size_levels, ctx->count_saves);
   fclose(fp);
 }
 
-void save_limits()
+void save_limits(DNestContext *ctx)
 {
+  if(!ctx->save_to_disk)
+    return;
+
   int i, j;
   FILE *fp;
 
-  fp = fopen(options.limits_file, "w");
-  for(i=0; i<size_levels; i++)
+  fp = fopen(ctx->options.limits_file, "w");
+  for(i=0; i<ctx->size_levels; i++)
   {
     fprintf(fp, "%d  ", i);
-    for(j=0; j<particle_offset_double; j++)
-      fprintf(fp, "%f  %f  ", limits[i*2*particle_offset_double+j*2], limits[i*2*particle_offset_double+j*2+1]);
+    for(j=0; j<ctx->particle_offset_double; j++)
+      fprintf(fp, "%f  %f  ", ctx->limits[i*2*ctx->particle_offset_double+j*2], 
+              ctx->limits[i*2*ctx->particle_offset_double+j*2+1]);
 
     fprintf(fp, "\n");
   }
   fclose(fp);
 }
 
-/* save particle */
-void save_particle()
+/* 
+ * save particle.
+ * with MPI, the root task picks a task, which picks one of its particles and 
+ * sends it to the root task for writing; the ID counts particles of all tasks.
+ */
+void save_particle(DNestContext *ctx)
 {
-  count_saves++;
+  ctx->count_saves++;
 
-  if(!save_to_disk)
-    return;
-  
-  int whichparticle, whichtask;
+  int whichparticle, whichtask = ctx->root;
   void *particle_message;
+  double *info;
+
+#ifdef USE_MPI
+  if(ctx->thistask == ctx->root)
+    whichtask = gsl_rng_uniform_int(dnest_gsl_r, ctx->totaltask);
+  MPI_Bcast(&whichtask, 1, MPI_INT, ctx->root, MPI_COMM_WORLD);
+#endif
+
+  if(ctx->thistask != whichtask && !ctx->save_to_disk)
+    return;
+
+  particle_message = ctx->save_message;
+  info = ctx->save_message + ctx->particle_offset_double;
+  if(ctx->thistask == whichtask)
+  {
+    whichparticle =  gsl_rng_uniform_int(dnest_gsl_r,ctx->options.num_particles);
+    memcpy(particle_message, ctx->particles + whichparticle * ctx->particle_offset_size, ctx->size_of_modeltype);
+    info[0] = ctx->level_assignments[whichparticle];
+    info[1] = ctx->log_likelihoods[whichparticle].value;
+    info[2] = ctx->log_likelihoods[whichparticle].tiebreaker;
+    info[3] = whichtask * ctx->options.num_particles + whichparticle;
+  }
+
+#ifdef USE_MPI
+  if(whichtask != ctx->root)
+  {
+    if(ctx->thistask == whichtask)
+      MPI_Send(ctx->save_message, ctx->particle_offset_double + 4, MPI_DOUBLE, ctx->root, 1, MPI_COMM_WORLD);
+    else
+      MPI_Recv(ctx->save_message, ctx->particle_offset_double + 4, MPI_DOUBLE, whichtask, 1, MPI_COMM_WORLD, 
+               MPI_STATUS_IGNORE);
+  }
+#endif
+
+  if(!ctx->save_to_disk)
+    return;
   
-  if(count_saves%10 == 0)
-    printf("#[%.1f%%] Saving sample N= %d.\n", 100.0*count_saves/options.max_num_saves, count_saves);
-    
-  whichparticle =  gsl_rng_uniform_int(dnest_gsl_r,options.num_particles);
+  if(ctx->count_saves%10 == 0)
+    printf("#[%.1f%%] Saving sample N= %d.\n", 100.0*ctx->count_saves/ctx->options.max_num_saves, ctx->count_saves);
+
+  if(ctx->flag_binary == 1)
+  {
+    fwrite(particle_message, sizeof(double), ctx->particle_offset_double, ctx->fsample);
+    fwrite(info, sizeof(double), 4, ctx->fsample_info);
+    return;
+  }
 
-  print_particle(fsample, particles + whichparticle * particle_offset_size, dnest_arg);
+  ctx->print_particle(ctx->fsample, particle_message, ctx->arg);
 
-  fprintf(fsample_info, "%d %e %f %d\n", level_assignments[whichparticle], 
-        log_likelihoods[whichparticle].value,
-        log_likelihoods[whichparticle].tiebreaker,
-        whichparticle);
+  fprintf(ctx->fsample_info, "%d %e %f %d\n", (int)info[0], info[1], info[2], (int)info[3]);
 }
 
-void dnest_mcmc_run()
+void dnest_mcmc_run(DNestContext *ctx)
 {
   unsigned int which;
   unsigned int i;
   
-  for(i = 0; i<options.thread_steps; i++)
+  for(i = 0; i<ctx->options.thread_steps; i++)
   {
 
     /* randomly select out one particle to update */
-    which = gsl_rng_uniform_int(dnest_gsl_r, options.num_particles);
+    which = gsl_rng_uniform_int(dnest_gsl_r, ctx->options.num_particles);
 
     dnest_which_particle_update = which;
 
@@ -432,112 +723,337 @@ void dnest_mcmc_run()
 
     if(gsl_rng_uniform(dnest_gsl_r) <= 0.5)
     {
-      update_particle(which);
-      update_level_assignment(which);
+      update_particle(ctx, which, ctx->levels);
+      update_level_assignment(ctx, which, ctx->levels, ctx->limits);
     }
     else
     {
-      update_level_assignment(which);
-      update_particle(which);
+      update_level_assignment(ctx, which, ctx->levels, ctx->limits);
+      update_particle(ctx, which, ctx->levels);
     }
         
-    if( !enough_levels(levels, size_levels)  && levels[size_levels-1].log_likelihood.value < log_likelihoods[which].value)
+    if( !enough_levels(ctx, ctx->levels, ctx->size_levels)  
+       && ctx->levels[ctx->size_levels-1].log_likelihood.value < ctx->log_likelihoods[which].value)
+    {
+      ctx->above[ctx->size_above] = ctx->log_likelihoods[which];
+      ctx->size_above++;
+    }
+  }
+}
+
+/*
+ * threaded version of dnest_mcmc_run.
+ * each thread updates its own particles with its own random number 
+ * generator, on its own copies of levels, limits and above buffer.
+ * the copies are merged back after all threads finish thread_steps.
+ */
+void dnest_mcmc_run_threads(DNestContext *ctx)
+{
+#ifdef _OPENMP
+  int i, j, k;
+  unsigned int num_particles_thread = ctx->options.num_particles/ctx->num_threads;
+
+  memcpy(ctx->levels_orig, ctx->levels, ctx->size_levels * sizeof(Level));
+  for(i=0; i<ctx->num_threads; i++)
+  {
+    memcpy(ctx->levels_copies[i], ctx->levels, ctx->size_levels * sizeof(Level));
+    ctx->size_above_copies[i] = 0;
+    if(ctx->flag_limits == 1)
+      memcpy(ctx->copies_of_limits + i * ctx->size_levels * ctx->particle_offset_double * 2, ctx->limits, 
+             ctx->size_levels * ctx->particle_offset_double * 2 * sizeof(double));
+  }
+
+  #pragma omp parallel num_threads(ctx->num_threads)
+  {
+    int thread = omp_get_thread_num();
+    unsigned int which, step;
+    Level *lvls = ctx->levels_copies[thread];
+    double *lmts = ctx->copies_of_limits + thread * ctx->size_levels * ctx->particle_offset_double * 2;
+    
+    dnest_ctx = ctx;
+    dnest_gsl_r = ctx->gsl_r_threads[thread];
+    dnest_time_likelihood_thread = 0.0;
+
+    for(step = 0; step<ctx->options.thread_steps; step++)
+    {
+      /* randomly select out one particle of this thread to update */
+      which = thread * num_particles_thread + gsl_rng_uniform_int(dnest_gsl_r, num_particles_thread);
+
+      dnest_which_particle_update = which;
+
+      if(gsl_rng_uniform(dnest_gsl_r) <= 0.5)
+      {
+        update_particle(ctx, which, lvls);
+        update_level_assignment(ctx, which, lvls, lmts);
+      }
+      else
+      {
+        update_level_assignment(ctx, which, lvls, lmts);
+        update_particle(ctx, which, lvls);
+      }
+      
+      if( !enough_levels(ctx, ctx->levels, ctx->size_levels)  
+         && ctx->levels[ctx->size_levels-1].log_likelihood.value < ctx->log_likelihoods[which].value)
+      {
+        ctx->above_copies[thread][ctx->size_above_copies[thread]] = ctx->log_likelihoods[which];
+        ctx->size_above_copies[thread]++;
+      }
+    }
+    #pragma omp atomic
+    ctx->time_likelihood += dnest_time_likelihood_thread;
+  }
+  
+  /* restore the main stream on the calling thread */
+  dnest_gsl_r = ctx->gsl_r_threads[0];
+
+  /* merge statistics of levels */
+  for(j=0; j<ctx->size_levels; j++)
+  {
+    for(i=0; i<ctx->num_threads; i++)
+    {
+      ctx->levels[j].accepts += ctx->levels_copies[i][j].accepts - ctx->levels_orig[j].accepts;
+      ctx->levels[j].tries   += ctx->levels_copies[i][j].tries   - ctx->levels_orig[j].tries;
+      ctx->levels[j].visits  += ctx->levels_copies[i][j].visits  - ctx->levels_orig[j].visits;
+      ctx->levels[j].exceeds += ctx->levels_copies[i][j].exceeds - ctx->levels_orig[j].exceeds;
+    }
+  }
+
+  /* merge above buffers */
+  for(i=0; i<ctx->num_threads; i++)
+  {
+    memcpy(ctx->above + ctx->size_above, ctx->above_copies[i], ctx->size_above_copies[i] * sizeof(LikelihoodType));
+    ctx->size_above += ctx->size_above_copies[i];
+  }
+
+  /* merge limits */
+  if(ctx->flag_limits == 1)
+  {
+    for(i=0; i<ctx->num_threads; i++)
     {
-      above[size_above] = log_likelihoods[which];
-      size_above++;
+      double *lmts = ctx->copies_of_limits + i * ctx->size_levels * ctx->particle_offset_double * 2;
+      for(j=0; j<ctx->size_levels; j++)
+        for(k=0; k<ctx->particle_offset_double; k++)
+        {
+          ctx->limits[j * ctx->particle_offset_double * 2 + k*2] = 
+              fmin(ctx->limits[j * ctx->particle_offset_double * 2 + k*2], lmts[j * ctx->particle_offset_double * 2 + k*2]);
+          ctx->limits[j * ctx->particle_offset_double * 2 + k*2 + 1] = 
+              fmax(ctx->limits[j * ctx->particle_offset_double * 2 + k*2 + 1], 
+                   lmts[j * ctx->particle_offset_double * 2 + k*2 + 1]);
+        }
     }
   }
+#else
+  dnest_mcmc_run(ctx);
+#endif
 }
 
+#ifdef USE_MPI
+/*
+ * merge the results of a round of all tasks on the root task: 
+ * statistics of levels accumulated since levels_task_orig, above buffers and limits.
+ * the above buffers of the other tasks are emptied.
+ */
+void dnest_mpi_merge_levels(DNestContext *ctx)
+{
+  int i, j, k, size_all_above_incr = 0;
+  int *buf_size_above = NULL, *buf_displs = NULL;
+  unsigned long long int *incr, *incr_all = NULL;
+  double *plimits = NULL;
+  int size_above_send;
+
+  if(ctx->totaltask == 1)
+    return;
+
+  /* statistics of levels */
+  incr = malloc(4 * ctx->size_levels * sizeof(unsigned long long int));
+  for(j=0; j<ctx->size_levels; j++)
+  {
+    incr[j*4 + 0] = ctx->levels[j].accepts - ctx->levels_task_orig[j].accepts;
+    incr[j*4 + 1] = ctx->levels[j].tries   - ctx->levels_task_orig[j].tries;
+    incr[j*4 + 2] = ctx->levels[j].visits  - ctx->levels_task_orig[j].visits;
+    incr[j*4 + 3] = ctx->levels[j].exceeds - ctx->levels_task_orig[j].exceeds;
+  }
+  if(ctx->thistask == ctx->root)
+    incr_all = malloc(4 * ctx->size_levels * sizeof(unsigned long long int));
+  MPI_Reduce(incr, incr_all, 4*ctx->size_levels, MPI_UNSIGNED_LONG_LONG, MPI_SUM, ctx->root, MPI_COMM_WORLD);
+  if(ctx->thistask == ctx->root)
+  {
+    for(j=0; j<ctx->size_levels; j++)
+    {
+      ctx->levels[j].accepts = ctx->levels_task_orig[j].accepts + incr_all[j*4 + 0];
+      ctx->levels[j].tries   = ctx->levels_task_orig[j].tries   + incr_all[j*4 + 1];
+      ctx->levels[j].visits  = ctx->levels_task_orig[j].visits  + incr_all[j*4 + 2];
+      ctx->levels[j].exceeds = ctx->levels_task_orig[j].exceeds + incr_all[j*4 + 3];
+    }
+    free(incr_all);
+  }
+  free(incr);
+
+  /* above buffers, those of the root task are already in place */
+  size_above_send = (ctx->thistask == ctx->root)?0:ctx->size_above*sizeof(LikelihoodType);
+  if(ctx->thistask == ctx->root)
+  {
+    buf_size_above = malloc(ctx->totaltask * sizeof(int));
+    buf_displs = malloc(ctx->totaltask * sizeof(int));
+  }
+  MPI_Gather(&size_above_send, 1, MPI_INT, buf_size_above, 1, MPI_INT, ctx->root, MPI_COMM_WORLD);
+  if(ctx->thistask == ctx->root)
+  {
+    size_all_above_incr = 0;
+    for(i=0; i<ctx->totaltask; i++)
+    {
+      buf_displs[i] = ctx->size_above*sizeof(LikelihoodType) + size_all_above_incr;
+      size_all_above_incr += buf_size_above[i];
+    }
+  }
+  MPI_Gatherv((ctx->thistask == ctx->root)?MPI_IN_PLACE:ctx->above, size_above_send, MPI_BYTE, 
+              ctx->above, buf_size_above, buf_displs, MPI_BYTE, ctx->root, MPI_COMM_WORLD);
+  if(ctx->thistask == ctx->root)
+  {
+    ctx->size_above += size_all_above_incr/sizeof(LikelihoodType);
+    free(buf_size_above);
+    free(buf_displs);
+  }
+  else
+  {
+    ctx->size_above = 0;
+  }
 
-void update_particle(unsigned int which)
+  /* limits, the minima are at even and the maxima at odd positions */
+  if(ctx->flag_limits == 1)
+  {
+    k = ctx->size_levels * ctx->particle_offset_double * 2;
+    if(ctx->thistask == ctx->root)
+      plimits = malloc(2 * k * sizeof(double));
+    MPI_Reduce(ctx->limits, plimits, k, MPI_DOUBLE, MPI_MIN, ctx->root, MPI_COMM_WORLD);
+    MPI_Reduce(ctx->limits, plimits + k, k, MPI_DOUBLE, MPI_MAX, ctx->root, MPI_COMM_WORLD);
+    if(ctx->thistask == ctx->root)
+    {
+      for(i=0; i<k; i+=2)
+      {
+        ctx->limits[i] = plimits[i];
+        ctx->limits[i+1] = plimits[k + i + 1];
+      }
+      free(plimits);
+    }
+  }
+}
+
+/*
+ * send levels, limits and the number of levels from the root task to the others, 
+ * along with the flag of killing lagging particles.
+ */
+void dnest_mpi_bcast_levels(DNestContext *ctx, bool *flag_kill)
+{
+  int flag;
+
+  if(ctx->totaltask == 1)
+    return;
+
+  flag = *flag_kill;
+  MPI_Bcast(&flag, 1, MPI_INT, ctx->root, MPI_COMM_WORLD);
+  *flag_kill = flag;
+  MPI_Bcast(&ctx->size_levels, 1, MPI_INT, ctx->root, MPI_COMM_WORLD);
+  MPI_Bcast(&ctx->options.max_num_levels, 1, MPI_UNSIGNED, ctx->root, MPI_COMM_WORLD);
+  MPI_Bcast(ctx->levels, ctx->size_levels * sizeof(Level), MPI_BYTE, ctx->root, MPI_COMM_WORLD);
+  if(ctx->flag_limits == 1)
+    MPI_Bcast(ctx->limits, ctx->size_levels * ctx->particle_offset_double * 2, MPI_DOUBLE, ctx->root, 
+              MPI_COMM_WORLD);
+}
+#endif
+
+
+void update_particle(DNestContext *ctx, unsigned int which, Level *lvls)
 {
-  void *particle = particles+ which*particle_offset_size;
-  LikelihoodType *logl = &(log_likelihoods[which]);
+  void *particle = ctx->particles+ which*ctx->particle_offset_size;
+  LikelihoodType *logl = &(ctx->log_likelihoods[which]);
   
-  Level *level = &(levels[level_assignments[which]]);
+  Level *level = &(lvls[ctx->level_assignments[which]]);
 
-  void *proposal = (void *)malloc(dnest_size_of_modeltype);
+  void *proposal = ctx->proposals + which*ctx->particle_offset_size;
   LikelihoodType logl_proposal;
-  double log_H;
+  double log_H, t0;
 
-  memcpy(proposal, particle, dnest_size_of_modeltype);
-  dnest_which_level_update = level_assignments[which];
+  memcpy(proposal, particle, ctx->size_of_modeltype);
+  dnest_which_level_update = ctx->level_assignments[which];
   
-  log_H = perturb(proposal, dnest_arg);
+  log_H = ctx->perturb(proposal, ctx->arg);
   
-  logl_proposal.value = log_likelihoods_cal(proposal, dnest_arg);
+  t0 = dnest_wtime();
+  logl_proposal.value = ctx->log_likelihoods_cal(proposal, ctx->arg);
+  dnest_time_likelihood_thread += dnest_wtime() - t0;
   logl_proposal.tiebreaker =  (*logl).tiebreaker + gsl_rng_uniform(dnest_gsl_r);
   dnest_wrap(&logl_proposal.tiebreaker, 0.0, 1.0);
   
   if(log_H > 0.0)
     log_H = 0.0;
 
-  dnest_perturb_accept[which] = 0;
+  ctx->perturb_accept[which] = 0;
   if( gsl_rng_uniform(dnest_gsl_r) <= exp(log_H) && level->log_likelihood.value < logl_proposal.value)
   {
-    memcpy(particle, proposal, dnest_size_of_modeltype);
+    memcpy(particle, proposal, ctx->size_of_modeltype);
     memcpy(logl, &logl_proposal, sizeof(LikelihoodType));
     level->accepts++;
 
-    dnest_perturb_accept[which] = 1;
-    accept_action();
-    account_unaccepts[which] = 0; /* reset the number of unaccepted perturb */
+    ctx->perturb_accept[which] = 1;
+    ctx->accept_action();
+    ctx->account_unaccepts[which] = 0; /* reset the number of unaccepted perturb */
   }
   else 
   {
-    account_unaccepts[which] += 1; /* number of unaccepted perturb */
+    ctx->account_unaccepts[which] += 1; /* number of unaccepted perturb */
   }
   level->tries++;
   
-  unsigned int current_level = level_assignments[which];
-  for(; current_level < size_levels-1; ++current_level)
+  unsigned int current_level = ctx->level_assignments[which];
+  for(; current_level < ctx->size_levels-1; ++current_level)
   {
-    levels[current_level].visits++;
-    if(levels[current_level+1].log_likelihood.value < log_likelihoods[which].value)
-      levels[current_level].exceeds++;
+    lvls[current_level].visits++;
+    if(lvls[current_level+1].log_likelihood.value < ctx->log_likelihoods[which].value)
+      lvls[current_level].exceeds++;
     else
       break; // exit the loop if it does not satify higher levels
   }
-  free(proposal);
 }
 
-void update_level_assignment(unsigned int which)
+void update_level_assignment(DNestContext *ctx, unsigned int which, Level *lvls, double *lmts)
 {
   int i;
 
-  int proposal = level_assignments[which] 
+  int proposal = ctx->level_assignments[which] 
                  + (int)( pow(10.0, 2*gsl_rng_uniform(dnest_gsl_r))*gsl_ran_ugaussian(dnest_gsl_r));
 
-  if(proposal == level_assignments[which])
+  if(proposal == ctx->level_assignments[which])
     proposal =  ((gsl_rng_uniform(dnest_gsl_r) < 0.5)?(proposal-1):(proposal+1));
 
-  proposal=mod_int(proposal, size_levels);
+  proposal=mod_int(proposal, ctx->size_levels);
 
-  double log_A = -levels[proposal].log_X + levels[level_assignments[which]].log_X;
+  double log_A = -lvls[proposal].log_X + lvls[ctx->level_assignments[which]].log_X;
 
-  log_A += log_push(proposal) - log_push(level_assignments[which]);
+  log_A += log_push(ctx, proposal) - log_push(ctx, ctx->level_assignments[which]);
 
-  if(size_levels == options.max_num_levels)
-    log_A += options.beta*log( (double)(levels[level_assignments[which]].tries +1)/ (levels[proposal].tries +1) );
+  if(ctx->size_levels == ctx->options.max_num_levels)
+    log_A += ctx->options.beta
+             *log( (double)(lvls[ctx->level_assignments[which]].tries +1)/ (lvls[proposal].tries +1) );
 
   if(log_A > 0.0)
     log_A = 0.0;
 
-  if( gsl_rng_uniform(dnest_gsl_r) <= exp(log_A) && levels[proposal].log_likelihood.value < log_likelihoods[which].value)
+  if( gsl_rng_uniform(dnest_gsl_r) <= exp(log_A) 
+     && lvls[proposal].log_likelihood.value < ctx->log_likelihoods[which].value)
   {
-    level_assignments[which] = proposal;
+    ctx->level_assignments[which] = proposal;
 
 // update the limits of the level
-    if(dnest_flag_limits == 1)
+    if(ctx->flag_limits == 1)
     {
-      double *particle = (double *) (particles+ which*particle_offset_size);
-      for(i=0; i<particle_offset_double; i++)
+      double *particle = (double *) (ctx->particles+ which*ctx->particle_offset_size);
+      for(i=0; i<ctx->particle_offset_double; i++)
       {
-        limits[proposal * 2 * particle_offset_double +  i*2] = 
-            fmin(limits[proposal * 2* particle_offset_double +  i*2], particle[i]);
-        limits[proposal * 2 * particle_offset_double +  i*2+1] = 
-            fmax(limits[proposal * 2 * particle_offset_double +  i*2+1], particle[i]);
+        lmts[proposal * 2 * ctx->particle_offset_double +  i*2] = 
+            fmin(lmts[proposal * 2* ctx->particle_offset_double +  i*2], particle[i]);
+        lmts[proposal * 2 * ctx->particle_offset_double +  i*2+1] = 
+            fmax(lmts[proposal * 2 * ctx->particle_offset_double +  i*2+1], particle[i]);
       }
     }
 
@@ -545,25 +1061,25 @@ void update_level_assignment(unsigned int which)
 
 }
 
-double log_push(unsigned int which_level)
+double log_push(DNestContext *ctx, unsigned int which_level)
 {
-  if(which_level > size_levels)
+  if(which_level > ctx->size_levels)
   {
-    printf("level overflow %d %d.\n", which_level, size_levels);
+    printf("level overflow %d %d.\n", which_level, ctx->size_levels);
     exit(0);
   }
-  if(enough_levels(levels, size_levels))
+  if(enough_levels(ctx, ctx->levels, ctx->size_levels))
     return 0.0;
 
-  int i = which_level - (size_levels - 1);
-  return ((double)i)/options.lambda;
+  int i = which_level - (ctx->size_levels - 1);
+  return ((double)i)/ctx->options.lambda;
 }
 
-bool enough_levels(Level *l, int size_l)
+bool enough_levels(DNestContext *ctx, Level *l, int size_l)
 {
   int i;
 
-  if(options.max_num_levels == 0)
+  if(ctx->options.max_num_levels == 0)
   {
     if(size_l >= LEVEL_NUM_MAX)
       return true;
@@ -592,168 +1108,278 @@ bool enough_levels(Level *l, int size_l)
       if( k < 1 )
         break;
     }
-    if(tot/kc < options.max_ptol && max < options.max_ptol*1.1)
+    if(tot/kc < ctx->options.max_ptol && max < ctx->options.max_ptol*1.1)
       return true;
     else
       return false;
   }
-  return (size_l >= options.max_num_levels);
+  return (size_l >= ctx->options.max_num_levels);
 }
 
-void initialize_output_file()
+void initialize_output_file(DNestContext *ctx)
 {
-  if(dnest_flag_restart !=1)
-    fsample = fopen(options.sample_file, "w");
+  if(ctx->flag_binary == 1)
+  {
+    /* for restart, append to the end and update the header later */
+    if(ctx->flag_restart != 1)
+    {
+      ctx->fsample = fopen(ctx->options.sample_file, "wb");
+      ctx->fsample_info = fopen(ctx->options.sample_info_file, "wb");
+    }
+    else
+    {
+      ctx->fsample = fopen(ctx->options.sample_file, "r+b");
+      ctx->fsample_info = fopen(ctx->options.sample_info_file, "r+b");
+    }
+    if(ctx->fsample == NULL || ctx->fsample_info == NULL)
+    {
+      fprintf(stderr, "# Cannot open file %s or %s.\n", ctx->options.sample_file, ctx->options.sample_info_file);
+      exit(0);
+    }
+    dnest_set_output_buffer(ctx);
+    if(ctx->flag_restart != 1)
+    {
+      dnest_write_bin_header(ctx->fsample, ctx->particle_offset_double, 0, ctx->bin_layout, DNEST_BIN_LAYOUT_MAX);
+      dnest_write_bin_header(ctx->fsample_info, 4, 0, ctx->bin_layout, DNEST_BIN_LAYOUT_MAX);
+    }
+    else 
+    {
+      fseek(ctx->fsample, 0, SEEK_END);
+      fseek(ctx->fsample_info, 0, SEEK_END);
+    }
+    return;
+  }
+
+  if(ctx->flag_restart !=1)
+    ctx->fsample = fopen(ctx->options.sample_file, "w");
   else
-    fsample = fopen(options.sample_file, "a");
+    ctx->fsample = fopen(ctx->options.sample_file, "a");
   
-  if(fsample==NULL)
+  if(ctx->fsample==NULL)
   {
     fprintf(stderr, "# Cannot open file sample.txt.\n");
     exit(0);
   }
-  if(dnest_flag_restart != 1)
-    fprintf(fsample, "# \n");
-
-  if(dnest_flag_restart != 1)
-    fsample_info = fopen(options.sample_info_file, "w");
+  if(ctx->flag_restart != 1)
+    ctx->fsample_info = fopen(ctx->options.sample_info_file, "w");
   else
-    fsample_info = fopen(options.sample_info_file, "a");
+    ctx->fsample_info = fopen(ctx->options.sample_info_file, "a");
 
-  if(fsample_info==NULL)
+  if(ctx->fsample_info==NULL)
   {
-    fprintf(stderr, "# Cannot open file %s.\n", options.sample_info_file);
+    fprintf(stderr, "# Cannot open file %s.\n", ctx->options.sample_info_file);
     exit(0);
   }
-  if(dnest_flag_restart != 1)
-    fprintf(fsample_info, "# level assignment, log likelihood, tiebreaker, ID.\n");
+  dnest_set_output_buffer(ctx);
+  if(ctx->flag_restart != 1)
+  {
+    fprintf(ctx->fsample, "# \n");
+    fprintf(ctx->fsample_info, "# level assignment, log likelihood, tiebreaker, ID.\n");
+  }
 }
 
-void close_output_file()
+/* large buffers for sample outputs, must be called before any I/O on the files */
+void dnest_set_output_buffer(DNestContext *ctx)
 {
-  fclose(fsample);
-  fclose(fsample_info);
+  ctx->output_buffer = (char *)malloc(2 * DNEST_OUTPUT_BUFFER_SIZE);
+  setvbuf(ctx->fsample, ctx->output_buffer, _IOFBF, DNEST_OUTPUT_BUFFER_SIZE);
+  setvbuf(ctx->fsample_info, ctx->output_buffer + DNEST_OUTPUT_BUFFER_SIZE, _IOFBF, DNEST_OUTPUT_BUFFER_SIZE);
 }
 
-void setup(int argc, char** argv, DNestFptrSet *fptrset, int num_params, char *sample_dir, int max_num_saves, double ptol)
+void close_output_file(DNestContext *ctx)
+{
+  if(ctx->flag_binary == 1)
+  {
+    dnest_update_bin_header(ctx->fsample, ctx->particle_offset_double);
+    dnest_update_bin_header(ctx->fsample_info, 4);
+  }
+  fclose(ctx->fsample);
+  fclose(ctx->fsample_info);
+  free(ctx->output_buffer);
+  ctx->output_buffer = NULL;
+}
+
+void setup(DNestContext *ctx, DNestFptrSet *fptrset, int num_params, char *sample_dir, 
+           int max_num_saves, double ptol)
 {
   int i, j;
 
   // root task.
-  dnest_root = 0;
+  ctx->root = 0;
+  ctx->thistask = dnest_get_thistask();
+  ctx->totaltask = dnest_get_totaltask();
 
   // setup function pointers
-  from_prior = fptrset->from_prior;
-  log_likelihoods_cal = fptrset->log_likelihoods_cal;
-  log_likelihoods_cal_initial = fptrset->log_likelihoods_cal_initial;
-  log_likelihoods_cal_restart = fptrset->log_likelihoods_cal_restart;
-  perturb = fptrset->perturb;
-  print_particle = fptrset->print_particle;
-  read_particle = fptrset->read_particle;
-  restart_action = fptrset->restart_action;
-  accept_action = fptrset->accept_action;
-  kill_action = fptrset->kill_action;
-  strcpy(dnest_sample_dir, sample_dir);
-
-  // random number generator
-  dnest_gsl_T = (gsl_rng_type *) gsl_rng_default;
-  dnest_gsl_r = gsl_rng_alloc (dnest_gsl_T);
+  ctx->from_prior = fptrset->from_prior;
+  ctx->log_likelihoods_cal = fptrset->log_likelihoods_cal;
+  ctx->log_likelihoods_cal_initial = fptrset->log_likelihoods_cal_initial;
+  ctx->log_likelihoods_cal_restart = fptrset->log_likelihoods_cal_restart;
+  ctx->perturb = fptrset->perturb;
+  ctx->print_particle = fptrset->print_particle;
+  ctx->read_particle = fptrset->read_particle;
+  ctx->restart_action = fptrset->restart_action;
+  ctx->accept_action = fptrset->accept_action;
+  ctx->kill_action = fptrset->kill_action;
+  strcpy(ctx->sample_dir, sample_dir);
+
+#ifndef _OPENMP
+  if(ctx->num_threads > 1)
+  {
+    printf("# Dnest is not compiled with OpenMP, use a single thread.\n");
+    ctx->num_threads = 1;
+  }
+#endif
+  if(ctx->num_threads < 1)
+    ctx->num_threads = 1;
+
+  // random number generators, one stream for each thread of each task
+  ctx->gsl_r_threads = (gsl_rng **)malloc(ctx->num_threads * sizeof(gsl_rng *));
+  for(i=0; i<ctx->num_threads; i++)
+  {
+    j = ctx->thistask * ctx->num_threads + i;
+    ctx->gsl_r_threads[i] = gsl_rng_alloc (gsl_rng_default);
 #ifndef Debug
-  gsl_rng_set(dnest_gsl_r, time(NULL));
+    if(ctx->seed != 0)
+      gsl_rng_set(ctx->gsl_r_threads[i], ctx->seed + j);
+    else
+      gsl_rng_set(ctx->gsl_r_threads[i], time(NULL) + j);
 #else
-  gsl_rng_set(dnest_gsl_r, 9999);
+    gsl_rng_set(ctx->gsl_r_threads[i], 9999 + j);
+#endif
+  }
+#ifdef Debug
   printf("# debugging, dnest random seed %d\n", 9999);
 #endif  
+  dnest_gsl_r = ctx->gsl_r_threads[0];
   
-  dnest_num_params = num_params;
-  dnest_size_of_modeltype = dnest_num_params * sizeof(double);
-
-  // read options
-  options_load(max_num_saves, ptol);
+  ctx->num_params = num_params;
+  ctx->size_of_modeltype = ctx->num_params * sizeof(double);
+
+  // read options, all tasks take those of the root task
+  options_load(ctx, max_num_saves, ptol);
+#ifdef USE_MPI
+  MPI_Bcast(&ctx->options, sizeof(Options), MPI_BYTE, ctx->root, MPI_COMM_WORLD);
+#endif
+  if(ctx->thistask == ctx->root)
+  {
+    printf("# Dnest options: %d particles, new level interval %d, save interval %d, thread steps %d,"
+           " max levels %d, lambda %.1f, beta %.1f.\n", ctx->options.num_particles, 
+           ctx->options.new_level_interval, ctx->options.save_interval, ctx->options.thread_steps, 
+           ctx->options.max_num_levels, ctx->options.lambda, ctx->options.beta);
+    if(ctx->totaltask > 1)
+      printf("# Dnest runs %d tasks, the number of particles is for each task.\n", ctx->totaltask);
+  }
 
   //dnest_post_temp = 1.0;
-  compression = exp(1.0);
-  regularisation = options.new_level_interval*sqrt(options.lambda);
-  save_to_disk = true;
+  ctx->compression = exp(1.0);
+  ctx->regularisation = ctx->options.new_level_interval*sqrt(ctx->options.lambda);
+  ctx->save_to_disk = (ctx->thistask == ctx->root);
 
   // particles
-  particle_offset_size = dnest_size_of_modeltype/sizeof(void);
-  particle_offset_double = dnest_size_of_modeltype/sizeof(double);
-  particles = (void *)malloc(options.num_particles*dnest_size_of_modeltype);
+  ctx->particle_offset_size = ctx->size_of_modeltype/sizeof(void);
+  ctx->particle_offset_double = ctx->size_of_modeltype/sizeof(double);
+  ctx->particles = (void *)malloc(ctx->options.num_particles*ctx->size_of_modeltype);
+  ctx->proposals = (void *)malloc(ctx->options.num_particles*ctx->size_of_modeltype);
   
   // initialise sampler
-  above = (LikelihoodType *)malloc(2*options.new_level_interval * sizeof(LikelihoodType));
+  ctx->above = (LikelihoodType *)malloc(2*ctx->options.new_level_interval * sizeof(LikelihoodType));
 
-  log_likelihoods = (LikelihoodType *)malloc(2*options.num_particles * sizeof(LikelihoodType));
-  level_assignments = (unsigned int*)malloc(options.num_particles * sizeof(unsigned int));
+  ctx->log_likelihoods = (LikelihoodType *)malloc(2*ctx->options.num_particles * sizeof(LikelihoodType));
+  ctx->level_assignments = (unsigned int*)malloc(ctx->options.num_particles * sizeof(unsigned int));
 
-  account_unaccepts = (unsigned int *)malloc(options.num_particles * sizeof(unsigned int));
-  for(i=0; i<options.num_particles; i++)
+  ctx->account_unaccepts = (unsigned int *)malloc(ctx->options.num_particles * sizeof(unsigned int));
+  for(i=0; i<ctx->options.num_particles; i++)
   {
-    account_unaccepts[i] = 0;
+    ctx->account_unaccepts[i] = 0;
   }
 
-  if(options.max_num_levels != 0)
+  if(ctx->options.max_num_levels != 0)
   {
-    levels = (Level *)malloc(options.max_num_levels * sizeof(Level));
-    if(dnest_flag_limits == 1)
+    ctx->levels = (Level *)malloc(ctx->options.max_num_levels * sizeof(Level));
+    if(ctx->flag_limits == 1)
     {
-      limits = malloc(options.max_num_levels * particle_offset_double * 2 * sizeof(double));
-      for(i=0; i<options.max_num_levels; i++)
+      ctx->limits = malloc(ctx->options.max_num_levels * ctx->particle_offset_double * 2 * sizeof(double));
+      for(i=0; i<ctx->options.max_num_levels; i++)
       {
-        for(j=0; j<particle_offset_double; j++)
+        for(j=0; j<ctx->particle_offset_double; j++)
         {
-          limits[i*2*particle_offset_double+ j*2] = DBL_MAX;
-          limits[i*2*particle_offset_double + j*2 + 1] = -DBL_MAX;
+          ctx->limits[i*2*ctx->particle_offset_double+ j*2] = DBL_MAX;
+          ctx->limits[i*2*ctx->particle_offset_double + j*2 + 1] = -DBL_MAX;
         }
       }
     }
   }
   else
   {
-    levels = (Level *)malloc(LEVEL_NUM_MAX * sizeof(Level));
+    ctx->levels = (Level *)malloc(LEVEL_NUM_MAX * sizeof(Level));
 
-    if(dnest_flag_limits == 1)
+    if(ctx->flag_limits == 1)
     {
-      limits = malloc(LEVEL_NUM_MAX * particle_offset_double * 2 * sizeof(double));
+      ctx->limits = malloc(LEVEL_NUM_MAX * ctx->particle_offset_double * 2 * sizeof(double));
       for(i=0; i<LEVEL_NUM_MAX; i++)
       {
-        for(j=0; j<particle_offset_double; j++)
+        for(j=0; j<ctx->particle_offset_double; j++)
         {
-          limits[i*2*particle_offset_double + j*2] = DBL_MAX;
-          limits[i*2*particle_offset_double + j*2 + 1] = -DBL_MAX;
+          ctx->limits[i*2*ctx->particle_offset_double + j*2] = DBL_MAX;
+          ctx->limits[i*2*ctx->particle_offset_double + j*2 + 1] = -DBL_MAX;
         }
       }
     }
   }
   
-  dnest_perturb_accept = malloc(options.num_particles * sizeof(int));
-  for(i=0; i<options.num_particles; i++)
+  ctx->perturb_accept = malloc(ctx->options.num_particles * sizeof(int));
+  for(i=0; i<ctx->options.num_particles; i++)
+  {
+    ctx->perturb_accept[i] = 0;
+  }
+
+  // copies of levels, limits and above for threads
+  if(ctx->num_threads > 1)
   {
-    dnest_perturb_accept[i] = 0;
+    j = (ctx->options.max_num_levels != 0)?ctx->options.max_num_levels:LEVEL_NUM_MAX;
+    ctx->levels_orig = (Level *)malloc(j * sizeof(Level));
+    ctx->levels_copies = (Level **)malloc(ctx->num_threads * sizeof(Level *));
+    ctx->above_copies = (LikelihoodType **)malloc(ctx->num_threads * sizeof(LikelihoodType *));
+    ctx->size_above_copies = (unsigned int *)malloc(ctx->num_threads * sizeof(unsigned int));
+    for(i=0; i<ctx->num_threads; i++)
+    {
+      ctx->levels_copies[i] = (Level *)malloc(j * sizeof(Level));
+      ctx->above_copies[i] = (LikelihoodType *)malloc(ctx->options.thread_steps * sizeof(LikelihoodType));
+      ctx->size_above_copies[i] = 0;
+    }
+    if(ctx->flag_limits == 1)
+      ctx->copies_of_limits = malloc(ctx->num_threads * j * ctx->particle_offset_double * 2 * sizeof(double));
   }
 
-  count_mcmc_steps = 0;
-  count_saves = 0;
-  num_saves = (int)fmax(0.02*options.max_num_saves, 1.0);
-  num_saves_restart = (int)fmax(0.2 * options.max_num_saves, 1.0);
+  j = (ctx->options.max_num_levels != 0)?ctx->options.max_num_levels:LEVEL_NUM_MAX;
+  ctx->levels_task_orig = (Level *)malloc(j * sizeof(Level));
+  ctx->save_message = (double *)malloc((ctx->particle_offset_double + 4) * sizeof(double));
+
+  ctx->count_mcmc_steps = 0;
+  ctx->count_saves = 0;
+  ctx->num_saves = (int)fmax(0.02*ctx->options.max_num_saves, 1.0);
+  ctx->num_saves_restart = (int)fmax(0.2 * ctx->options.max_num_saves, 1.0);
 
 // first level
-  size_levels = 0;
-  size_above = 0;
+  ctx->size_levels = 0;
+  ctx->size_above = 0;
   LikelihoodType like_tmp = {-DBL_MAX, gsl_rng_uniform(dnest_gsl_r)};
   Level level_tmp = {like_tmp, 0.0, 0, 0, 0, 0};
-  levels[size_levels] = level_tmp;
-  size_levels++;
+  ctx->levels[ctx->size_levels] = level_tmp;
+  ctx->size_levels++;
+#ifdef USE_MPI
+  MPI_Bcast(ctx->levels, sizeof(Level), MPI_BYTE, ctx->root, MPI_COMM_WORLD);
+#endif
   
-  for(i=0; i<options.num_particles; i++)
+  for(i=0; i<ctx->options.num_particles; i++)
   {
     dnest_which_particle_update = i;
     dnest_which_level_update = 0;
-    from_prior(particles+i*particle_offset_size, dnest_arg);
-    log_likelihoods[i].value = log_likelihoods_cal_initial(particles+i*particle_offset_size, dnest_arg);
-    log_likelihoods[i].tiebreaker = dnest_rand();
-    level_assignments[i] = 0;
+    ctx->from_prior(ctx->particles+i*ctx->particle_offset_size, ctx->arg);
+    ctx->log_likelihoods[i].value = ctx->log_likelihoods_cal_initial(ctx->particles+i*ctx->particle_offset_size, 
+                                                                     ctx->arg);
+    ctx->log_likelihoods[i].tiebreaker = dnest_rand();
+    ctx->level_assignments[i] = 0;
   }
 
   /*ModelType proposal;
@@ -762,125 +1388,178 @@ void setup(int argc, char** argv, DNestFptrSet *fptrset, int num_params, char *s
   printf("%f %f %f \n", proposal.param[0], proposal.param[1], proposal.param[2] );*/
 }
 
-void finalise()
+void finalise(DNestContext *ctx)
 {
-  free(particles);
-  free(above);
-  free(log_likelihoods);
-  free(level_assignments);
-  free(levels);
+  unsigned int i;
+
+  free(ctx->particles);
+  free(ctx->proposals);
+  free(ctx->above);
+  free(ctx->log_likelihoods);
+  free(ctx->level_assignments);
+  free(ctx->levels);
+
+  free(ctx->account_unaccepts);
 
-  free(account_unaccepts);
+  if(ctx->flag_limits == 1)
+    free(ctx->limits);
 
-  if(dnest_flag_limits == 1)
-    free(limits);
+  for(i=0; i<ctx->num_threads; i++)
+    gsl_rng_free(ctx->gsl_r_threads[i]);
+  free(ctx->gsl_r_threads);
 
-  gsl_rng_free(dnest_gsl_r);
+  free(ctx->perturb_accept);
+  free(ctx->levels_task_orig);
+  free(ctx->save_message);
 
-  free(dnest_perturb_accept);
+  if(ctx->num_threads > 1)
+  {
+    for(i=0; i<ctx->num_threads; i++)
+    {
+      free(ctx->levels_copies[i]);
+      free(ctx->above_copies[i]);
+    }
+    free(ctx->levels_orig);
+    free(ctx->levels_copies);
+    free(ctx->above_copies);
+    free(ctx->size_above_copies);
+    if(ctx->flag_limits == 1)
+      free(ctx->copies_of_limits);
+  }
 
-  printf("# Finalizing dnest.\n");
+  if(ctx->thistask == ctx->root)
+    printf("# Finalizing dnest.\n");
 }
 
 
-void options_load(int max_num_saves, double ptol)
+void options_load(DNestContext *ctx, int max_num_saves, double ptol)
 {
+  /* options not set by dnest_set_options() take the defaults */
   //sscanf(buf, "%d", &options.num_particles);
-  options.num_particles = 2;
+  if(ctx->opt_num_particles > 0)
+    ctx->options.num_particles = ctx->opt_num_particles;
+  else
+    ctx->options.num_particles = 2 * ctx->num_threads; /* two particles for each thread */
+  /* particles are evenly shared among threads */
+  if(ctx->options.num_particles % ctx->num_threads != 0)
+  {
+    ctx->options.num_particles = (ctx->options.num_particles/ctx->num_threads + 1) * ctx->num_threads;
+    printf("# Dnest rounds the number of particles up to %d, a multiple of threads.\n", 
+           ctx->options.num_particles);
+  }
 
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%d", &options.new_level_interval);
-  options.new_level_interval = options.num_particles * dnest_num_params*10;
+  if(ctx->opt_new_level_interval > 0)
+    ctx->options.new_level_interval = ctx->opt_new_level_interval;
+  else
+    ctx->options.new_level_interval = 2 * ctx->num_params*10;
 
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%d", &options.save_interval);
-  options.save_interval = options.new_level_interval;
+  if(ctx->opt_save_interval > 0)
+    ctx->options.save_interval = ctx->opt_save_interval;
+  else
+    ctx->options.save_interval = ctx->options.new_level_interval;
 
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%d", &options.thread_steps);
-  options.thread_steps = options.new_level_interval;
+  /* the steps of a sweep are shared among threads */
+  if(ctx->opt_thread_steps > 0)
+    ctx->options.thread_steps = ctx->opt_thread_steps;
+  else
+    ctx->options.thread_steps = 
+        (unsigned int)fmax(ctx->options.new_level_interval/(ctx->num_threads * ctx->totaltask), 1);
 
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%d", &options.max_num_levels);
-  options.max_num_levels = 0;
+  ctx->options.max_num_levels = ctx->opt_max_num_levels;
 
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%lf", &options.lambda);
-  options.lambda = 10.0;
+  ctx->options.lambda = ctx->opt_lambda;
 
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%lf", &options.beta);
-  options.beta = 100.0;
+  ctx->options.beta = ctx->opt_beta;
 
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%d", &options.max_num_saves);
-  options.max_num_saves = max_num_saves;
+  ctx->options.max_num_saves = max_num_saves;
 
-  options.max_ptol = ptol;
+  ctx->options.max_ptol = ptol;
 
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%s", options.sample_file);
-  strcpy(options.sample_file, dnest_sample_dir);
-  strcat(options.sample_file,"/sample");
-  strcat(options.sample_file, dnest_sample_tag);
-  strcat(options.sample_file, ".txt");
-  strcat(options.sample_file, dnest_sample_postfix);
+  strcpy(ctx->options.sample_file, ctx->sample_dir);
+  strcat(ctx->options.sample_file,"/sample");
+  strcat(ctx->options.sample_file, ctx->sample_tag);
+  strcat(ctx->options.sample_file, (ctx->flag_binary==1)?".bin":".txt");
+  strcat(ctx->options.sample_file, ctx->sample_postfix);
   
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%s", options.sample_info_file);
-  strcpy(options.sample_info_file, dnest_sample_dir);
-  strcat(options.sample_info_file,"/sample_info");
-  strcat(options.sample_info_file, dnest_sample_tag);
-  strcat(options.sample_info_file, ".txt");
-  strcat(options.sample_info_file, dnest_sample_postfix);
+  strcpy(ctx->options.sample_info_file, ctx->sample_dir);
+  strcat(ctx->options.sample_info_file,"/sample_info");
+  strcat(ctx->options.sample_info_file, ctx->sample_tag);
+  strcat(ctx->options.sample_info_file, (ctx->flag_binary==1)?".bin":".txt");
+  strcat(ctx->options.sample_info_file, ctx->sample_postfix);
   
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%s", options.levels_file);
-  strcpy(options.levels_file, dnest_sample_dir);
-  strcat(options.levels_file,"/levels");
-  strcat(options.levels_file, dnest_sample_tag);
-  strcat(options.levels_file, ".txt");
-  strcat(options.levels_file, dnest_sample_postfix);
+  strcpy(ctx->options.levels_file, ctx->sample_dir);
+  strcat(ctx->options.levels_file,"/levels");
+  strcat(ctx->options.levels_file, ctx->sample_tag);
+  strcat(ctx->options.levels_file, (ctx->flag_binary==1)?".bin":".txt");
+  strcat(ctx->options.levels_file, ctx->sample_postfix);
   
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%s", options.sampler_state_file);
-  strcpy(options.sampler_state_file, dnest_sample_dir);
-  strcat(options.sampler_state_file,"/sampler_state");
-  strcat(options.sampler_state_file, dnest_sample_tag);
-  strcat(options.sampler_state_file, ".txt");
-  strcat(options.sampler_state_file, dnest_sample_postfix);
+  strcpy(ctx->options.sampler_state_file, ctx->sample_dir);
+  strcat(ctx->options.sampler_state_file,"/sampler_state");
+  strcat(ctx->options.sampler_state_file, ctx->sample_tag);
+  strcat(ctx->options.sampler_state_file, ".txt");
+  strcat(ctx->options.sampler_state_file, ctx->sample_postfix);
   
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%s", options.posterior_sample_file);
-  strcpy(options.posterior_sample_file, dnest_sample_dir);
-  strcat(options.posterior_sample_file,"/posterior_sample");
-  strcat(options.posterior_sample_file, dnest_sample_tag);
-  strcat(options.posterior_sample_file, ".txt");
-  strcat(options.posterior_sample_file, dnest_sample_postfix);
+  strcpy(ctx->options.posterior_sample_file, ctx->sample_dir);
+  strcat(ctx->options.posterior_sample_file,"/posterior_sample");
+  strcat(ctx->options.posterior_sample_file, ctx->sample_tag);
+  strcat(ctx->options.posterior_sample_file, (ctx->flag_binary==1)?".bin":".txt");
+  strcat(ctx->options.posterior_sample_file, ctx->sample_postfix);
 
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%s", options.posterior_sample_info_file);
-  strcpy(options.posterior_sample_info_file, dnest_sample_dir);
-  strcat(options.posterior_sample_info_file,"/posterior_sample_info");
-  strcat(options.posterior_sample_info_file, dnest_sample_tag);
-  strcat(options.posterior_sample_info_file, ".txt");
-  strcat(options.posterior_sample_info_file, dnest_sample_postfix);
+  strcpy(ctx->options.posterior_sample_info_file, ctx->sample_dir);
+  strcat(ctx->options.posterior_sample_info_file,"/posterior_sample_info");
+  strcat(ctx->options.posterior_sample_info_file, ctx->sample_tag);
+  strcat(ctx->options.posterior_sample_info_file, (ctx->flag_binary==1)?".bin":".txt");
+  strcat(ctx->options.posterior_sample_info_file, ctx->sample_postfix);
 
   //fgets(buf, BUF_MAX_LENGTH, fp);
   //sscanf(buf, "%s", options.limits_file);
-  strcpy(options.limits_file, dnest_sample_dir);
-  strcat(options.limits_file,"/limits");
-  strcat(options.limits_file, dnest_sample_tag);
-  strcat(options.limits_file, ".txt");
-  strcat(options.limits_file, dnest_sample_postfix);
+  strcpy(ctx->options.limits_file, ctx->sample_dir);
+  strcat(ctx->options.limits_file,"/limits");
+  strcat(ctx->options.limits_file, ctx->sample_tag);
+  strcat(ctx->options.limits_file, ".txt");
+  strcat(ctx->options.limits_file, ctx->sample_postfix);
 
   // check options.
   
-  if(options.new_level_interval < options.thread_steps)
+  if(ctx->options.new_level_interval < ctx->options.thread_steps * ctx->num_threads * ctx->totaltask)
   {
     printf("# incorrect options:\n");
     printf("# new level interval should be equal to or larger than"); 
-    printf("  totaltask * thread step.\n");
+    printf("  threads * tasks * thread steps.\n");
+    exit(0);
+  }
+
+  if(ctx->options.max_num_levels > LEVEL_NUM_MAX || ctx->options.lambda <= 0.0 || ctx->options.beta < 0.0)
+  {
+    printf("# incorrect options:\n");
+    printf("# max number of levels should not exceed %d, lambda should be positive,", LEVEL_NUM_MAX);
+    printf(" and beta non-negative.\n");
     exit(0);
   }
 
@@ -963,9 +1642,18 @@ int dnest_cmp(const void *pa, const void *pb)
 }
 
 
+/* 
+ * dnest_get_arg() to dnest_get_num_particles() are called by the functions of users 
+ * during sampling, they work on the context run by the calling thread.
+ */
+const void * dnest_get_arg()
+{
+  return dnest_ctx->arg;
+}
+
 int dnest_get_size_levels()
 {
-  return size_levels;
+  return dnest_ctx->size_levels;
 }
 
 int dnest_get_which_level_update()
@@ -978,23 +1666,406 @@ int dnest_get_which_particle_update()
   return dnest_which_particle_update;
 }
 
+unsigned int dnest_get_num_particles()
+{
+  return dnest_ctx->options.num_particles;
+}
+
+unsigned int dnest_get_num_threads(DNestContext *ctx)
+{
+  return ctx->num_threads;
+}
+
+/* set the number of threads, must be called before dnest() */
+void dnest_set_num_threads(DNestContext *ctx, unsigned int n)
+{
+  ctx->num_threads = (n>0)?n:1;
+}
+
+/* index of the calling thread, 0 for the main thread */
+int dnest_get_thread_num()
+{
+#ifdef _OPENMP
+  return omp_get_thread_num();
+#else
+  return 0;
+#endif
+}
+
+/* rank of the calling task, 0 without MPI or before MPI_Init() */
+int dnest_get_thistask()
+{
+#ifdef USE_MPI
+  int flag, rank;
+  MPI_Initialized(&flag);
+  if(flag)
+  {
+    MPI_Comm_rank(MPI_COMM_WORLD, &rank);
+    return rank;
+  }
+#endif
+  return 0;
+}
+
+/* number of tasks, 1 without MPI or before MPI_Init() */
+int dnest_get_totaltask()
+{
+#ifdef USE_MPI
+  int flag, size;
+  MPI_Initialized(&flag);
+  if(flag)
+  {
+    MPI_Comm_size(MPI_COMM_WORLD, &size);
+    return size;
+  }
+#endif
+  return 1;
+}
+
 unsigned int dnest_get_which_num_saves()
 {
-  return num_saves;
+  return dnest_ctx->num_saves;
 }
 unsigned int dnest_get_count_saves()
 {
-  return count_saves;
+  return dnest_ctx->count_saves;
 }
 
 unsigned long long int dnest_get_count_mcmc_steps()
 {
-  return count_mcmc_steps;
+  return dnest_ctx->count_mcmc_steps;
+}
+
+/* policy of synchronizing sample files, see DNEST_SYNC_* */
+void dnest_set_sync_policy(DNestContext *ctx, int policy)
+{
+  if(policy < DNEST_SYNC_NONE || policy > DNEST_SYNC_FSYNC)
+  {
+    printf("# Dnest incorrect sync policy %d.\n", policy);
+    exit(0);
+  }
+  ctx->sync_policy = policy;
+}
+
+/* 
+ * set the seed of random number generators, must be called before dnest(), 
+ * thread i of task k uses seed+k*num_threads+i and postprocess uses 
+ * seed+tasks*num_threads; 0 for seeds from time.
+ */
+void dnest_set_seed(DNestContext *ctx, unsigned long int seed)
+{
+  ctx->seed = seed;
+}
+
+/*
+ * set early stopping of sampling.
+ * ess: target effective sample size, 0 for no convergence check;
+ * logz_tol: tolerance of log evidence between successive convergence checks;
+ * max_time: maximum wall-clock time (seconds) of sampling, 0 for no limit.
+ */
+void dnest_set_stopping(DNestContext *ctx, double ess, double logz_tol, double max_time)
+{
+  ctx->stop_ess = ess;
+  ctx->stop_logz_tol = logz_tol;
+  ctx->stop_time = max_time;
+}
+
+/*
+ * set options of sampling, must be called before dnest(); 0 for the defaults.
+ * num_particles: number of particles, 2 for each thread by default;
+ * new_level_interval: steps for creating a new level, 20*num_params by default;
+ * save_interval: steps between two saved particles, new_level_interval by default;
+ * thread_steps: steps of each thread between two synchronizations of threads, 
+ *               new_level_interval/(num_threads*tasks) by default;
+ * max_num_levels: maximum number of levels, 0 for determining it on the fly;
+ * lambda: backtracking scale length;
+ * beta: strength of enforcing the expected visits of levels.
+ */
+void dnest_set_options(DNestContext *ctx, unsigned int num_particles, unsigned int new_level_interval, 
+                       unsigned int save_interval, unsigned int thread_steps, 
+                       unsigned int max_num_levels, double lambda, double beta)
+{
+  ctx->opt_num_particles = num_particles;
+  ctx->opt_new_level_interval = new_level_interval;
+  ctx->opt_save_interval = save_interval;
+  ctx->opt_thread_steps = thread_steps;
+  ctx->opt_max_num_levels = max_num_levels;
+  ctx->opt_lambda = lambda;
+  ctx->opt_beta = beta;
+}
+
+/*
+ * set a function called after every save with the number of saves, the number of levels, 
+ * and the likelihood evaluations per second since the start of sampling; NULL for none.
+ */
+void dnest_set_progress(DNestContext *ctx, 
+                        void (*progress)(int count_saves, int num_levels, double rate, void *arg), void *arg)
+{
+  ctx->progress = progress;
+  ctx->progress_arg = arg;
+}
+
+/*
+ * request a stop of sampling (flag=1) from another thread or the progress function, 
+ * sampling stops at the start of the next round and saves a checkpoint for resume.
+ * if requested before the start, dnest() returns at once without touching any files.
+ * the flag is not cleared by dnest(), set it to 0 before the next run.
+ */
+void dnest_set_stop_request(DNestContext *ctx, int flag)
+{
+  ctx->stop_request = flag;
+}
+
+int dnest_get_stop_request(DNestContext *ctx)
+{
+  return ctx->stop_request;
+}
+
+/*
+ * estimate the evidence and effective sample size from samples so far, 
+ * converged if all levels are created, the effective sample size reaches dnest_stop_ess, 
+ * and the log evidence changes less than dnest_stop_logz_tol since the last check.
+ */
+bool dnest_check_convergence(DNestContext *ctx)
+{
+  int i;
+  double **levels_info, **sample_info, *logP_samples;
+  double logz, H, ess;
+  bool flag;
+
+  if(!enough_levels(ctx, ctx->levels, ctx->size_levels) || ctx->count_saves == 0)
+    return false;
+
+  if(ctx->flag_binary == 1)
+    dnest_update_bin_header(ctx->fsample_info, 4);
+  fflush(ctx->fsample_info);
+
+  levels_info = malloc(ctx->size_levels * sizeof(double *));
+  for(i=0; i<ctx->size_levels; i++)
+  {
+    levels_info[i] = malloc(3 * sizeof(double));
+    levels_info[i][0] = ctx->levels[i].log_X;
+    levels_info[i][1] = ctx->levels[i].log_likelihood.value;
+    levels_info[i][2] = ctx->levels[i].log_likelihood.tiebreaker;
+  }
+  sample_info = malloc(ctx->count_saves * sizeof(double *));
+  for(i=0; i<ctx->count_saves; i++)
+  {
+    sample_info[i] = malloc(3 * sizeof(double));
+  }
+  logP_samples = malloc(ctx->count_saves * sizeof(double));
+
+  dnest_read_sample_info(ctx, sample_info, ctx->count_saves, ctx->size_levels);
+  dnest_evidence(levels_info, ctx->size_levels, sample_info, ctx->count_saves, ctx->post_temp, 
+                 logP_samples, &logz, &H, &ess);
+  
+  printf("# Convergence check at N= %d: log(Z) = %f, ESS = %.1f.\n", ctx->count_saves, logz, ess);
+  flag = (ess >= ctx->stop_ess && fabs(logz - ctx->stop_logz_last) < ctx->stop_logz_tol);
+  ctx->stop_logz_last = logz;
+
+  for(i=0; i<ctx->size_levels; i++)
+    free(levels_info[i]);
+  free(levels_info);
+  for(i=0; i<ctx->count_saves; i++)
+    free(sample_info[i]);
+  free(sample_info);
+  free(logP_samples);
+
+  return flag;
+}
+
+/* wall-clock time in seconds */
+double dnest_wtime()
+{
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return ts.tv_sec + 1.0e-9*ts.tv_nsec;
+}
+
+/* 
+ * wall-clock time of the last sampling and the time spent in likelihood 
+ * summed over threads
+ */
+void dnest_get_timing(DNestContext *ctx, double *time_sampling, double *time_likelihood)
+{
+  *time_sampling = ctx->time_sampling;
+  *time_likelihood = ctx->time_likelihood;
+}
+
+/* 
+ * number of steps of the last sampling, excluding those before a restart
+ */
+unsigned long long int dnest_get_steps_sampling(DNestContext *ctx)
+{
+  return ctx->steps_sampling;
+}
+
+/* 
+ * nonzero if the last run failed, the outputs of the run are then not valid
+ */
+int dnest_get_error(DNestContext *ctx)
+{
+  return ctx->error;
+}
+
+/* 
+ * wall-clock time of writing outputs and of convergence checks during the last sampling, 
+ * wall-clock time of the last postprocess, and bytes written during the last sampling
+ */
+void dnest_get_io_stats(DNestContext *ctx, double *time_io, double *time_convergence, double *time_postprocess, 
+                        unsigned long long int *bytes_written)
+{
+  *time_io = ctx->time_io;
+  *time_convergence = ctx->time_convergence;
+  *time_postprocess = ctx->time_postprocess;
+  *bytes_written = ctx->bytes_written;
+}
+
+/* 
+ * accepts and tries of each level at the end of the last sampling, 
+ * return the number of levels
+ */
+int dnest_get_level_stats(DNestContext *ctx, unsigned long long int **accepts, unsigned long long int **tries)
+{
+  *accepts = ctx->level_accepts;
+  *tries = ctx->level_tries;
+  return ctx->num_levels_stats;
+}
+
+void dnest_get_posterior_sample_file(DNestContext *ctx, char *fname)
+{
+  strcpy(fname, ctx->options.posterior_sample_file);
+  return;
+}
+
+int dnest_get_num_posterior_sample(DNestContext *ctx)
+{
+  return ctx->num_posterior_sample;
+}
+
+/* 
+ * copy the posterior sample generated by the last postprocess,
+ * ps needs a size of num_ps * size_of_modeltype and ps_info a size of num_ps.
+ */
+void dnest_get_posterior_sample(DNestContext *ctx, void *ps, double *ps_info)
+{
+  if(ctx->posterior_sample == NULL)
+    return;
+
+  memcpy(ps, ctx->posterior_sample, ctx->num_posterior_sample * ctx->size_of_modeltype);
+  memcpy(ps_info, ctx->posterior_sample_info, ctx->num_posterior_sample * sizeof(double));
+  return;
+}
+
+/* 
+ * set the parameter layout stored in the header of binary files,
+ * e.g., numbers of parameters in each block.
+ */
+void dnest_set_bin_layout(DNestContext *ctx, int *layout, int n)
+{
+  int i;
+  for(i=0; i<DNEST_BIN_LAYOUT_MAX; i++)
+    ctx->bin_layout[i] = (i<n)?layout[i]:0;
+  return;
+}
+
+/* layout: n numbers of the parameter layout, the rest are set to 0 */
+void dnest_write_bin_header(FILE *fp, int num_cols, long long int num_rows, const int *layout, int n)
+{
+  int i;
+  DNestBinHeader header;
+
+  memset(&header, 0, sizeof(DNestBinHeader));
+  memcpy(header.magic, DNEST_BIN_MAGIC, 8);
+  header.version = DNEST_BIN_VERSION;
+  header.num_cols = num_cols;
+  header.num_rows = num_rows;
+  for(i=0; i<DNEST_BIN_LAYOUT_MAX; i++)
+    header.layout[i] = (i<n)?layout[i]:0;
+  fwrite(&header, sizeof(DNestBinHeader), 1, fp);
+  return;
+}
+
+/* 
+ * update the number of rows in the header according to the file size,
+ * fp should be positioned at the end of the file.
+ */
+void dnest_update_bin_header(FILE *fp, int num_cols)
+{
+  long int pos;
+  long long int num_rows;
+
+  fflush(fp);
+  pos = ftell(fp);
+  num_rows = (pos - sizeof(DNestBinHeader))/(num_cols * sizeof(double));
+  fseek(fp, offsetof(DNestBinHeader, num_rows), SEEK_SET);
+  fwrite(&num_rows, sizeof(long long int), 1, fp);
+  fseek(fp, pos, SEEK_SET);
+  return;
+}
+
+/*
+ * map a binary file into memory, return the pointer to the float64 array.
+ * the number of rows in the header is recalculated from the file size,
+ * so that files of an interrupted run are also readable.
+ * return NULL if the file cannot be mapped or is not a dnest binary file.
+ */
+double * dnest_mmap_bin(const char *fname, DNestBinHeader *header, size_t *map_size)
+{
+  int fd;
+  struct stat st;
+  void *map;
+
+  fd = open(fname, O_RDONLY);
+  if(fd < 0)
+  {
+    fprintf(stderr, "# Error: Cannot open file %s.\n", fname);
+    return NULL;
+  }
+  fstat(fd, &st);
+  if(st.st_size < (off_t)sizeof(DNestBinHeader))
+  {
+    fprintf(stderr, "# Error: Cannot read file %s.\n", fname);
+    close(fd);
+    return NULL;
+  }
+  map = mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+  close(fd);
+  if(map == MAP_FAILED)
+  {
+    fprintf(stderr, "# Error: Cannot map file %s.\n", fname);
+    return NULL;
+  }
+
+  memcpy(header, map, sizeof(DNestBinHeader));
+  if(memcmp(header->magic, DNEST_BIN_MAGIC, 8) != 0 || header->num_cols <= 0)
+  {
+    fprintf(stderr, "# Error: %s is not a dnest binary file.\n", fname);
+    munmap(map, st.st_size);
+    return NULL;
+  }
+  header->num_rows = (st.st_size - sizeof(DNestBinHeader))/(header->num_cols * sizeof(double));
+
+  *map_size = st.st_size;
+  return (double *)((char *)map + sizeof(DNestBinHeader));
+}
+
+void dnest_munmap_bin(double *data, size_t map_size)
+{
+  munmap((char *)data - sizeof(DNestBinHeader), map_size);
+  return;
 }
 
-void dnest_get_posterior_sample_file(char *fname)
+void dnest_free_posterior_sample(DNestContext *ctx)
 {
-  strcpy(fname, options.posterior_sample_file);
+  if(ctx->posterior_sample != NULL)
+  {
+    free(ctx->posterior_sample);
+    free(ctx->posterior_sample_info);
+  }
+  ctx->posterior_sample = NULL;
+  ctx->posterior_sample_info = NULL;
+  ctx->num_posterior_sample = 0;
   return;
 }
 /* 
@@ -1124,194 +2195,279 @@ void dnest_free_fptrset(DNestFptrSet * fptrset)
   return;
 }
 
+/* 
+ * a context with the default settings, each sampler running at the same time 
+ * needs its own context.
+ */
+DNestContext * dnest_malloc_context()
+{
+  DNestContext *ctx;
+  ctx = (DNestContext *)calloc(1, sizeof(DNestContext));
+
+  ctx->sync_policy = DNEST_SYNC_FLUSH;
+  ctx->seed = 0;
+  ctx->num_threads = 1;
+  ctx->stop_logz_tol = 0.1;
+  ctx->opt_lambda = 10.0;
+  ctx->opt_beta = 100.0;
+  ctx->post_temp = 1.0;
+  ctx->root = 0;
+  ctx->thistask = 0;
+  ctx->totaltask = 1;
+  return ctx;
+}
+
+/* free a context, along with the posterior sample and level statistics it keeps */
+void dnest_free_context(DNestContext *ctx)
+{
+  if(ctx == NULL)
+    return;
+
+  dnest_free_posterior_sample(ctx);
+  free(ctx->level_accepts);
+  free(ctx->level_tries);
+  free(ctx);
+  return;
+}
+
+
+/*!
+ *  name of the checkpoint of the calling task, the root task uses fname itself 
+ *  and task k uses fname.k.
+ */
+void dnest_restart_task_file(DNestContext *ctx, char *str, const char *fname)
+{
+  if(ctx->thistask == ctx->root)
+    strcpy(str, fname);
+  else
+    sprintf(str, "%s.%d", fname, ctx->thistask);
+}
 
 /*!
- *  Save sampler state for later restart. 
+ *  Save sampler state to a binary checkpoint for later restart.
+ *  the checkpoint holds levels, above buffer, particles, limits, states of the 
+ *  random number generators, and the sizes of sample files at the moment, 
+ *  so that a restart continues exactly where the checkpoint was made.
+ *  it is first written to a temporary file and then renamed, 
+ *  an interruption during writing leaves the previous checkpoint intact.
+ *  with MPI, each task writes its own checkpoint, see dnest_restart_task_file().
+ *  return nonzero if the checkpoint of any task cannot be written.
  */
-void dnest_save_restart()
+int dnest_save_restart(DNestContext *ctx)
 {
   FILE *fp;
-  int i, j;
-  void *particles_all;
-  LikelihoodType *log_likelihoods_all;
-  unsigned int *level_assignments_all;
-  char str[200];
+  int flag;
+  long long int offset[2] = {0, 0};
+  char str[STR_MAX_LENGTH+20], fname[STR_MAX_LENGTH+10];
 
+  /* sample files must be on disk up to the recorded sizes */
+  if(ctx->thistask == ctx->root)
+  {
+    if(ctx->flag_binary == 1)
+    {
+      dnest_update_bin_header(ctx->fsample_info, 4);
+      dnest_update_bin_header(ctx->fsample, ctx->particle_offset_double);
+    }
+    fflush(ctx->fsample);
+    fflush(ctx->fsample_info);
+    if(ctx->sync_policy == DNEST_SYNC_FSYNC)
+    {
+      fsync(fileno(ctx->fsample));
+      fsync(fileno(ctx->fsample_info));
+    }
+    offset[0] = ftell(ctx->fsample);
+    offset[1] = ftell(ctx->fsample_info);
+  }
   
-  sprintf(str, "%s_%d", file_save_restart, count_saves);
+  dnest_restart_task_file(ctx, fname, ctx->file_save_restart);
+  sprintf(str, "%s.tmp", fname);
   fp = fopen(str, "wb");
   if(fp == NULL)
   {
-    fprintf(stderr, "# Error: Cannot open file %s. \n", file_save_restart);
-    exit(0);
+    fprintf(stderr, "# Error: Cannot open file %s. \n", str);
+    flag = 1;
   }
+  else
+  {
+    /* the previous checkpoint is kept if writing fails */
+    flag = dnest_write_restart(ctx, fp, offset);
+    if(fclose(fp) != 0 || flag != 0 || rename(str, fname) != 0)
+    {
+      fprintf(stderr, "# Error: Cannot write file %s. \n", fname);
+      flag = 1;
+    }
+  }
+#ifdef USE_MPI
+  MPI_Allreduce(MPI_IN_PLACE, &flag, 1, MPI_INT, MPI_MAX, MPI_COMM_WORLD);
+#endif
+  if(flag != 0)
+    return flag;
 
-  
-  printf("# Save restart data to file %s.\n", str);
-
-    //fprintf(fp, "%d %d\n", count_saves, count_mcmc_steps);
-    //fprintf(fp, "%d\n", size_levels_combine);
+  if(ctx->thistask == ctx->root)
+    printf("# Save restart data to file %s at N= %d.\n", ctx->file_save_restart, ctx->count_saves);
 
-  fwrite(&count_saves, sizeof(int), 1, fp);
-  fwrite(&count_mcmc_steps, sizeof(int), 1, fp);
-  fwrite(&size_levels, sizeof(int), 1, fp);
+  ctx->restart_action(0);
+  return 0;
+}
 
-  for(i=0; i<size_levels; i++)
+/*
+ *  write the content of a checkpoint, see dnest_save_restart().
+ */
+int dnest_write_restart(DNestContext *ctx, FILE *fp, long long int *offset)
+{
+  int i, version = DNEST_RESTART_VERSION;
+
+  fwrite(DNEST_RESTART_MAGIC, 1, 8, fp);
+  fwrite(&version, sizeof(int), 1, fp);
+  fwrite(&ctx->num_params, sizeof(int), 1, fp);
+  fwrite(&ctx->options.num_particles, sizeof(unsigned int), 1, fp);
+  fwrite(&ctx->num_threads, sizeof(unsigned int), 1, fp);
+  fwrite(&ctx->totaltask, sizeof(int), 1, fp);
+  fwrite(&ctx->flag_limits, sizeof(int), 1, fp);
+  fwrite(&ctx->flag_binary, sizeof(int), 1, fp);
+
+  fwrite(&ctx->count_saves, sizeof(unsigned int), 1, fp);
+  fwrite(&ctx->count_mcmc_steps, sizeof(unsigned long long int), 1, fp);
+  fwrite(&ctx->options.max_num_levels, sizeof(unsigned int), 1, fp);
+  fwrite(&ctx->size_levels, sizeof(int), 1, fp);
+  fwrite(&ctx->size_above, sizeof(unsigned int), 1, fp);
+  fwrite(offset, sizeof(long long int), 2, fp);
+
+  fwrite(ctx->levels, sizeof(Level), ctx->size_levels, fp);
+  fwrite(ctx->above, sizeof(LikelihoodType), ctx->size_above, fp);
+  fwrite(ctx->level_assignments, sizeof(unsigned int), ctx->options.num_particles, fp);
+  fwrite(ctx->log_likelihoods, sizeof(LikelihoodType), ctx->options.num_particles, fp);
+  fwrite(ctx->account_unaccepts, sizeof(unsigned int), ctx->options.num_particles, fp);
+  if(ctx->flag_limits == 1)
   {
-    //fprintf(fp, "%14.12g %14.12g %f %llu %llu %llu %llu\n", levels_combine[i].log_X, levels_combine[i].log_likelihood.value, 
-    //  levels_combine[i].log_likelihood.tiebreaker, levels_combine[i].accepts,
-    //  levels_combine[i].tries, levels[i].exceeds, levels_combine[i].visits);
-
-    fwrite(&levels[i], sizeof(Level), 1, fp);
+    fwrite(ctx->limits, sizeof(double), ctx->size_levels * ctx->particle_offset_double * 2, fp);
   }
+  fwrite(ctx->particles, ctx->size_of_modeltype, ctx->options.num_particles, fp);
 
-  for(i=0; i<options.num_particles; i++)
-  {
-    //fprintf(fp, "%d %e %f\n", level_assignments_all[j*options.num_particles + i], 
-    //  log_likelihoods_all[j*options.num_particles + i].value,
-    //  log_likelihoods_all[j*options.num_particles + i].tiebreaker);  
-    fwrite(&level_assignments[j*options.num_particles + i], sizeof(int), 1, fp);
-    fwrite(&log_likelihoods[j*options.num_particles + i], sizeof(LikelihoodType), 1, fp);    
-  }
-    
-    
-  if(dnest_flag_limits == 1)
+  for(i=0; i<ctx->num_threads; i++)
   {
-    for(i=0; i<size_levels; i++)
-    {
-      //fprintf(fp, "%d  ", i);
-      for(j=0; j<particle_offset_double; j++)
-      {
-        //fprintf(fp, "%f  %f  ", limits[i*2*particle_offset_double+j*2], limits[i*2*particle_offset_double+j*2+1]);
-        fwrite(&limits[i*2*particle_offset_double+j*2], sizeof(double), 2, fp);
-      }
-
-        //fprintf(fp, "\n");
-    }
+    if(gsl_rng_fwrite(fp, ctx->gsl_r_threads[i]) != 0)
+      return 1;
   }
-    
-
-  for(i=0; i<options.num_particles; i++)
-  {
-    //print_particle(fp, particles_all + (j * options.num_particles + i) * particle_offset_size);
-    fwrite(particles + (j * options.num_particles + i) * particle_offset_size, dnest_size_of_modeltype, 1, fp);
-  } 
-    
-  fclose(fp);
-
-  restart_action(0);
+  ctx->bytes_written += ftell(fp);
+  return ferror(fp) ? 1 : 0;
 }
 
-void dnest_restart()
+/*!
+ *  Restore sampler state from a checkpoint written by dnest_save_restart(), 
+ *  and truncate sample files to their sizes at the checkpoint.
+ *  options and the numbers of threads and tasks must be the same as those of the checkpointed run.
+ *  return nonzero if the checkpoint cannot be read or does not match the present run.
+ */
+int dnest_restart(DNestContext *ctx)
 {
   FILE *fp;
-  int i, j;
-  void *particles_all;
-  unsigned int *level_assignments_all;
-  LikelihoodType *log_likelihoods_all;
-  void *particle;
-
-  fp = fopen(file_restart, "rb");
+  int i, flag, version, np, ntasks, flag_limits, flag_binary;
+  unsigned int npt, nthreads, size_levels_max;
+  long long int offset[2];
+  char magic[8], fname[STR_MAX_LENGTH+10];
+  struct stat st;
+
+  dnest_restart_task_file(ctx, fname, ctx->file_restart);
+  fp = fopen(fname, "rb");
   if(fp == NULL)
   {
-    fprintf(stderr, "# Error: Cannot open file %s. \n", file_restart);
-    exit(0);
+    fprintf(stderr, "# Error: Cannot open file %s. \n", fname);
+    return 1;
   }
 
-  printf("# Reading %s\n", file_restart);
+  printf("# Reading %s\n", fname);
 
-  fread(&count_saves, sizeof(int), 1, fp);
-  fread(&count_mcmc_steps, sizeof(int), 1, fp);
-  fread(&size_levels, sizeof(int), 1, fp);
-    
-  /* consider that the newly input max_num_levels may be different from the save one */
-  if(options.max_num_levels != 0)
+  flag = fread(magic, 1, 8, fp) == 8 && memcmp(magic, DNEST_RESTART_MAGIC, 8) == 0
+      && fread(&version, sizeof(int), 1, fp) == 1 && version == DNEST_RESTART_VERSION;
+  if(!flag)
   {
-    if(size_levels > options.max_num_levels)
-    {
-      printf("# input max_num_levels %d smaller than the one in restart data %d.\n", options.max_num_levels, size_levels);
-      size_levels = options.max_num_levels;
-    }   
-  }
-    // read levels
-  for(i=0; i<size_levels; i++)
-  {     
-    if(i<size_levels) // not read all the levels
-      fread(&levels[i], sizeof(Level), 1, fp);
-    else
-      fseek(fp, sizeof(Level), SEEK_CUR); /* offset the file point */
+    fprintf(stderr, "# Error: %s is not a restart file of this version.\n", fname);
+    fclose(fp);
+    return 1;
   }
-    memcpy(levels, levels, size_levels * sizeof(Level));
 
-    // read level assignment
-  for(i=0; i<options.num_particles; i++)
+  flag = fread(&np, sizeof(int), 1, fp) == 1
+      && fread(&npt, sizeof(unsigned int), 1, fp) == 1
+      && fread(&nthreads, sizeof(unsigned int), 1, fp) == 1
+      && fread(&ntasks, sizeof(int), 1, fp) == 1
+      && fread(&flag_limits, sizeof(int), 1, fp) == 1
+      && fread(&flag_binary, sizeof(int), 1, fp) == 1;
+  if(!flag || np != ctx->num_params || npt != ctx->options.num_particles || nthreads != ctx->num_threads
+     || ntasks != ctx->totaltask || flag_limits != ctx->flag_limits || flag_binary != ctx->flag_binary)
   {
-    fread(&level_assignments[j*options.num_particles + i], sizeof(int), 1, fp);
-    fread(&log_likelihoods[j*options.num_particles + i], sizeof(LikelihoodType), 1, fp); 
-    
-    /* reset the level assignment that exceeds the present maximum level */
-    if(level_assignments[j*options.num_particles + i] > size_levels -1)
-    {
-      level_assignments[j*options.num_particles + i] = size_levels - 1;
-    }
+    fprintf(stderr, "# Error: settings of %s (%d params, %d particles, %d threads, %d tasks, binary %d) "
+                    "do not match the present run.\n", fname, np, npt, nthreads, ntasks, flag_binary);
+    fclose(fp);
+    return 1;
   }
 
-  // read limits
-  if(dnest_flag_limits == 1)
+  /* size of allocated levels, see setup() */
+  size_levels_max = (ctx->options.max_num_levels != 0)?ctx->options.max_num_levels:LEVEL_NUM_MAX;
+  flag = fread(&ctx->count_saves, sizeof(unsigned int), 1, fp) == 1
+      && fread(&ctx->count_mcmc_steps, sizeof(unsigned long long int), 1, fp) == 1
+      && fread(&ctx->options.max_num_levels, sizeof(unsigned int), 1, fp) == 1
+      && fread(&ctx->size_levels, sizeof(int), 1, fp) == 1
+      && fread(&ctx->size_above, sizeof(unsigned int), 1, fp) == 1
+      && fread(offset, sizeof(long long int), 2, fp) == 2
+      && ctx->size_levels >= 1 && ctx->size_levels <= size_levels_max
+      && ctx->size_above <= 2*ctx->options.new_level_interval;
+
+  flag = flag 
+      && fread(ctx->levels, sizeof(Level), ctx->size_levels, fp) == ctx->size_levels
+      && fread(ctx->above, sizeof(LikelihoodType), ctx->size_above, fp) == ctx->size_above
+      && fread(ctx->level_assignments, sizeof(unsigned int), ctx->options.num_particles, fp) == ctx->options.num_particles
+      && fread(ctx->log_likelihoods, sizeof(LikelihoodType), ctx->options.num_particles, fp) == ctx->options.num_particles
+      && fread(ctx->account_unaccepts, sizeof(unsigned int), ctx->options.num_particles, fp) == ctx->options.num_particles;
+  if(flag && ctx->flag_limits == 1)
   {
-    for(i=0; i<size_levels; i++)
-    {
-      if(i < size_levels)
-      {
-        for(j=0; j<particle_offset_double; j++)
-        {
-          fread(&limits[i*2*particle_offset_double+j*2], sizeof(double), 2, fp);      
-        }
-      }
-      else 
-      {
-        fseek(fp, sizeof(double) * 2 * particle_offset_double, SEEK_CUR); /* offset the file point */
-      }
-    }
+    flag = fread(ctx->limits, sizeof(double), ctx->size_levels * ctx->particle_offset_double * 2, fp) 
+           == ctx->size_levels * ctx->particle_offset_double * 2;
   }
-
-  // read particles
-  for(i=0; i<options.num_particles; i++)
+  flag = flag 
+      && fread(ctx->particles, ctx->size_of_modeltype, ctx->options.num_particles, fp) == ctx->options.num_particles;
+  for(i=0; flag && i<ctx->num_threads; i++)
   {
-    particle = (particles + (j * options.num_particles + i) * dnest_size_of_modeltype);
-    fread(particle, dnest_size_of_modeltype, 1, fp);
+    flag = (gsl_rng_fread(fp, ctx->gsl_r_threads[i]) == 0);
   }
-
   fclose(fp);
+  if(!flag)
+  {
+    fprintf(stderr, "# Error: Incomplete or corrupted restart file %s.\n", fname);
+    return 1;
+  }
+  dnest_gsl_r = ctx->gsl_r_threads[0];
 
-  if(count_saves > options.max_num_saves)
+  /* drop samples saved after the checkpoint */
+  if(ctx->thistask == ctx->root && (stat(ctx->options.sample_file, &st) != 0 || st.st_size < offset[0] 
+     || truncate(ctx->options.sample_file, offset[0]) != 0
+     || stat(ctx->options.sample_info_file, &st) != 0 || st.st_size < offset[1] 
+     || truncate(ctx->options.sample_info_file, offset[1]) != 0))
   {
-    printf("# Number of samples already larger than the input number, exit!\n");
-    exit(0);
+    fprintf(stderr, "# Error: Sample files %s and %s do not match restart file %s.\n", 
+            ctx->options.sample_file, ctx->options.sample_info_file, fname);
+    return 1;
   }
-  
-  num_saves = (int)fmax(0.02*(options.max_num_saves-count_saves), 1.0); /* reset num_saves */
-  num_saves_restart = (int)fmax(0.2 * (options.max_num_saves-count_saves), 1.0); /* reset num_saves_restart */
 
-  restart_action(1);
+  printf("# Restart from N= %d.\n", ctx->count_saves);
+
+  ctx->restart_action(1);
 
-  for(i=0; i<options.num_particles; i++)
+  /* recalculate likelihoods so that caches of users are set up */
+  for(i=0; i<ctx->options.num_particles; i++)
   {
     dnest_which_particle_update = i;
-    dnest_which_level_update = level_assignments[i];
-    //printf("%d %d %f\n", thistask, i, log_likelihoods[i].value);
-    log_likelihoods[i].value = log_likelihoods_cal_restart(particles+i*particle_offset_size, dnest_arg);
-    //printf("%d %d %f\n", thistask, i, log_likelihoods[i].value);
-    //due to randomness, the original level assignment may be incorrect. re-asign the level
-    while(log_likelihoods[i].value < levels[level_assignments[i]].log_likelihood.value)
+    dnest_which_level_update = ctx->level_assignments[i];
+    ctx->log_likelihoods[i].value = ctx->log_likelihoods_cal_restart(ctx->particles+i*ctx->particle_offset_size, 
+                                                                     ctx->arg);
+    while(ctx->log_likelihoods[i].value < ctx->levels[ctx->level_assignments[i]].log_likelihood.value)
     {
-      printf("# level assignment decrease %d %f %f %d.\n", i, log_likelihoods[i].value, 
-        levels[level_assignments[i]].log_likelihood.value, level_assignments[i]);
-      level_assignments[i]--;
+      printf("# level assignment decrease %d %f %f %d.\n", i, ctx->log_likelihoods[i].value, 
+        ctx->levels[ctx->level_assignments[i]].log_likelihood.value, ctx->level_assignments[i]);
+      ctx->level_assignments[i]--;
     }
-    
   }
-  return;
+  return 0;
 }
 
 void dnest_print_particle(FILE *fp, const void *model, const void *arg)
@@ -1319,7 +2475,7 @@ void dnest_print_particle(FILE *fp, const void *model, const void *arg)
   int i;
   double *pm = (double *)model;
 
-  for(i=0; i<dnest_num_params; i++)
+  for(i=0; i<dnest_ctx->num_params; i++)
   {
     fprintf(fp, "%e ", pm[i] );
   }
@@ -1332,12 +2488,12 @@ void dnest_read_particle(FILE *fp, void *model)
   int j;
   double *psample = (double *)model;
 
-  for(j=0; j < dnest_num_params; j++)
+  for(j=0; j < dnest_ctx->num_params; j++)
   {
     if(fscanf(fp, "%lf", psample+j) < 1)
     {
       printf("%f\n", *psample);
-      fprintf(stderr, "#Error: Cannot read file %s.\n", options.sample_file);
+      fprintf(stderr, "#Error: Cannot read file %s.\n", dnest_ctx->options.sample_file);
       exit(0);
     }
   }
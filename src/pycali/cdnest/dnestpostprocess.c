@@ -58,24 +58,26 @@ double logsumexp(double *x, int n)
   return log(sum) + max;
 }
 
-void postprocess(double temperature)
+void postprocess(DNestContext *ctx, double temperature)
 {
   printf("# Starts postprocess.\n");
   FILE *fp, *fp_sample;
   
   double **levels_orig, **sample_info, *logl;
-  int *sandwhich;
   double *psample;
   int i, j;
   int num_levels, num_samples;
   char buf[BUF_MAX_LENGTH];
   int moreSample = 1;
+  DNestBinHeader header;
+  double *bin_data, *bin_sample;
+  size_t map_size, map_size_sample;
   
   // read number of levels and samples
-  fp = fopen(options.sampler_state_file, "r");
+  fp = fopen(ctx->options.sampler_state_file, "r");
   if(fp == NULL)
   {
-    fprintf(stderr, "# Error: Cannot open file %s.\n", options.sampler_state_file);
+    fprintf(stderr, "# Error: Cannot open file %s.\n", ctx->options.sampler_state_file);
     exit(0);
   }
   fscanf(fp, "%d %d\n", &num_levels, &num_samples);
@@ -97,92 +99,103 @@ void postprocess(double temperature)
   
   // allocate memory for samples
   logl = (void *)malloc(num_samples * sizeof(double));
-  sandwhich = malloc(num_samples * sizeof(int));
-  psample = (double *)malloc(dnest_size_of_modeltype);
+  psample = (double *)malloc(ctx->size_of_modeltype);
   
   // read levels
-  fp = fopen(options.levels_file, "r");
-  if(fp == NULL)
-  {
-    fprintf(stderr, "# Error: Cannot open file %s.\n", options.levels_file);
-    exit(0);
-  }
-  fgets(buf, BUF_MAX_LENGTH, fp);
-  for(i=0; i < num_levels; i++)
+  if(ctx->flag_binary == 1)
   {
-    if(feof(fp) != 0)
+    bin_data = dnest_mmap_bin(ctx->options.levels_file, &header, &map_size);
+    if(bin_data == NULL)
+      exit(0);
+    if(header.num_rows < num_levels)
     {
-      fprintf(stderr, "# Error: file %s ends at %d.\n", options.levels_file, i);
+      fprintf(stderr, "# Error: file %s ends at %lld.\n", ctx->options.levels_file, header.num_rows);
       exit(0);
     }
-
-    fgets(buf, BUF_MAX_LENGTH, fp);
-    
-    if(sscanf(buf, "%lf %lf %lf", &levels_orig[i][0], &levels_orig[i][1], &levels_orig[i][2]) < 3)
+    for(i=0; i < num_levels; i++)
     {
-      fprintf(stderr, "# Error: Cannot read file %s.\n", options.levels_file);
-      exit(0);
+      for(j=0; j<3; j++)
+        levels_orig[i][j] = bin_data[i*header.num_cols + j];
     }
-    buf[0]='\0';  // clear up buf
+    dnest_munmap_bin(bin_data, map_size);
   }
-  fclose(fp);
-  
-  // read sample_info
-  if(dnest_flag_sample_info == 0) //no need to recalculate
+  else 
   {
-    fp = fopen(options.sample_info_file, "r");
+    fp = fopen(ctx->options.levels_file, "r");
     if(fp == NULL)
     {
-      fprintf(stderr, "# Error: Cannot open file %s.\n", options.sample_info_file);
+      fprintf(stderr, "# Error: Cannot open file %s.\n", ctx->options.levels_file);
       exit(0);
     }
     fgets(buf, BUF_MAX_LENGTH, fp);
-    for(i=0; i < num_samples; i++)
+    for(i=0; i < num_levels; i++)
     {
       if(feof(fp) != 0)
       {
-        fprintf(stderr, "# Error: file %s ends at %d.\n", options.sample_info_file, i);
+        fprintf(stderr, "# Error: file %s ends at %d.\n", ctx->options.levels_file, i);
         exit(0);
       }
+
       fgets(buf, BUF_MAX_LENGTH, fp);
-      if(sscanf(buf, "%lf %lf %lf", &sample_info[i][0], &sample_info[i][1], &sample_info[i][2]) < 3)
+    
+      if(sscanf(buf, "%lf %lf %lf", &levels_orig[i][0], &levels_orig[i][1], &levels_orig[i][2]) < 3)
       {
-        fprintf(stderr, "# Error: Cannot read file %s.\n", options.sample_info_file);
+        fprintf(stderr, "# Error: Cannot read file %s.\n", ctx->options.levels_file);
         exit(0);
       }
-      buf[0]='\0';  // clear buf
-
-      /* reset level assignment for levels larger than the maximum level numbers */
-      if(sample_info[i][0] > num_levels -1)
-        sample_info[i][0] = num_levels - 1;
+      buf[0]='\0';  // clear up buf
     }
     fclose(fp);
   }
+  
+  // read sample_info
+  if(ctx->flag_sample_info == 0) //no need to recalculate
+  {
+    dnest_read_sample_info(ctx, sample_info, num_samples, num_levels);
+  }
   else   //sample_info file doest not exist, need to recalculate.
   {
-    fp = fopen(options.sample_info_file, "w");
+    fp = fopen(ctx->options.sample_info_file, (ctx->flag_binary==1)?"wb":"w");
     if(fp == NULL)
     {
-      fprintf(stderr, "# Error: Cannot open file %s.\n", options.sample_info_file);
+      fprintf(stderr, "# Error: Cannot open file %s.\n", ctx->options.sample_info_file);
       exit(0);
     }
     printf("# Dnest starts to recalculate the sample info.\n");
-    fprintf(fp, "# level assignment, log likelihood, tiebreaker, ID.\n");
 
     //read sample
-    fp_sample = fopen(options.sample_file, "r");
-    if(fp_sample == NULL)
+    if(ctx->flag_binary == 1)
     {
-      fprintf(stderr, "# Error: Cannot open file %s.\n", options.sample_file);
-      exit(0);
+      dnest_write_bin_header(fp, 4, num_samples, ctx->bin_layout, DNEST_BIN_LAYOUT_MAX);
+      bin_sample = dnest_mmap_bin(ctx->options.sample_file, &header, &map_size_sample);
+      if(bin_sample == NULL)
+        exit(0);
+      if(header.num_rows < num_samples)
+      {
+        fprintf(stderr, "# Error: file %s ends at %lld.\n", ctx->options.sample_file, header.num_rows);
+        exit(0);
+      }
+    }
+    else
+    {
+      fprintf(fp, "# level assignment, log likelihood, tiebreaker, ID.\n");
+      fp_sample = fopen(ctx->options.sample_file, "r");
+      if(fp_sample == NULL)
+      {
+        fprintf(stderr, "# Error: Cannot open file %s.\n", ctx->options.sample_file);
+        exit(0);
+      }
+      fgets(buf, BUF_MAX_LENGTH, fp_sample);
     }
-    fgets(buf, BUF_MAX_LENGTH, fp_sample);
 
     for(i=0; i < num_samples; i++)
     {
-      read_particle(fp_sample, (void *)psample);
+      if(ctx->flag_binary == 1)
+        memcpy(psample, bin_sample + i*header.num_cols, ctx->size_of_modeltype);
+      else
+        ctx->read_particle(fp_sample, (void *)psample);
 
-      sample_info[i][1] = log_likelihoods_cal_initial((void *)psample, dnest_arg);
+      sample_info[i][1] = ctx->log_likelihoods_cal_initial((void *)psample, ctx->arg);
       sample_info[i][2] = dnest_rand();
 
       for(j=0; j<num_levels; j++)
@@ -199,15 +212,288 @@ void postprocess(double temperature)
 
       sample_info[i][0] = (double)dnest_rand_int(j); // randomly assign a level [0, j-1]
 
-      fprintf(fp, "%d %e %f %d\n", (int)sample_info[i][0], sample_info[i][1], sample_info[i][2], 1);
+      if(ctx->flag_binary == 1)
+      {
+        double info[4] = {sample_info[i][0], sample_info[i][1], sample_info[i][2], 1.0};
+        fwrite(info, sizeof(double), 4, fp);
+      }
+      else
+        fprintf(fp, "%d %e %f %d\n", (int)sample_info[i][0], sample_info[i][1], sample_info[i][2], 1);
     }
     fclose(fp);
-    fclose(fp_sample);
+    if(ctx->flag_binary == 1)
+      dnest_munmap_bin(bin_sample, map_size_sample);
+    else
+      fclose(fp_sample);
   }
   //tempering with a temperature
   for(i=0; i<num_samples; i++)
     logl[i] = sample_info[i][1] / temperature;
 
+  double max, logz_estimates, H_estimates, ESS;
+  double *logP_samples;
+
+  logP_samples = malloc(num_samples * sizeof(double));
+  dnest_evidence(levels_orig, num_levels, sample_info, num_samples, temperature, 
+                 logP_samples, &logz_estimates, &H_estimates, &ESS);
+
+  printf("log(Z) = %f\n", logz_estimates);
+  printf("H = %f\n", H_estimates);
+  printf("Effective sample size = %f\n", ESS);
+  
+  ctx->post_logz = logz_estimates;
+
+  // resample to uniform weight
+  
+  int num_ps = moreSample*ESS;
+  void *posterior_sample;
+  double *posterior_sample_info;
+  int *posterior_sample_idx;
+  int which;
+
+  const gsl_rng_type * dnest_post_gsl_T;
+  gsl_rng * dnest_post_gsl_r;
+
+  dnest_post_gsl_T = (gsl_rng_type *) gsl_rng_default;
+  dnest_post_gsl_r = gsl_rng_alloc (dnest_post_gsl_T);
+#ifndef Debug
+  if(ctx->seed != 0)
+    gsl_rng_set(dnest_post_gsl_r, ctx->seed + ctx->totaltask * ctx->num_threads);
+  else
+    gsl_rng_set(dnest_post_gsl_r, time(NULL));
+#else
+  gsl_rng_set(dnest_post_gsl_r, 8888);
+  printf("# debugging, random seed %d\n", 8888);
+#endif  
+
+  posterior_sample = malloc(num_ps * ctx->size_of_modeltype);
+  posterior_sample_info = malloc(num_ps * sizeof(double));
+  posterior_sample_idx = malloc(num_ps * sizeof(int)); // flag for which particle to save
+
+  max = logP_samples[0];
+  for(j=0; j<num_samples; j++)
+    max = fmax(logP_samples[j], max);
+  for(j=0; j<num_samples; j++)
+    logP_samples[j] -= max;
+  
+  for(j=0; j<num_ps; j++)
+  {
+    while(true)
+    {
+      which =  gsl_rng_uniform_int(dnest_post_gsl_r, num_samples);
+      if(log(gsl_rng_uniform(dnest_post_gsl_r)) < logP_samples[which])
+      {
+        posterior_sample_info[j] = logl[which]; 
+        posterior_sample_idx[j]  = which;  // sample this particle
+        break;
+      }
+    }
+  }
+
+  // read sample and pick out selected particles
+  if(ctx->flag_binary == 1)
+  {
+    /* directly copy the selected rows of the mapped sample */
+    bin_sample = dnest_mmap_bin(ctx->options.sample_file, &header, &map_size_sample);
+    if(bin_sample == NULL)
+      exit(0);
+    if(header.num_rows < num_samples)
+    {
+      fprintf(stderr, "# Error: file %s ends at %lld.\n", ctx->options.sample_file, header.num_rows);
+      exit(0);
+    }
+    for(j=0; j < num_ps; j++)
+    {
+      memcpy(posterior_sample+j*ctx->size_of_modeltype, bin_sample + posterior_sample_idx[j]*header.num_cols, 
+             ctx->size_of_modeltype);
+    }
+    dnest_munmap_bin(bin_sample, map_size_sample);
+  }
+  else
+  {
+    fp_sample = fopen(ctx->options.sample_file, "r");
+    if(fp_sample == NULL)
+    {
+      fprintf(stderr, "# Error: Cannot open file %s.\n", ctx->options.sample_file);
+      exit(0);
+    }
+    fgets(buf, BUF_MAX_LENGTH, fp_sample);
+    for(i=0; i < num_samples; i++)
+    {
+    
+      ctx->read_particle(fp_sample, (void *)psample);
+
+      for(j=0; j < num_ps; j++)
+      {
+        if(posterior_sample_idx[j] == i)
+        {
+          memcpy(posterior_sample+j*ctx->size_of_modeltype, (void *)psample, ctx->size_of_modeltype);
+        }
+      }
+      //printf("%f %f %f\n", sample[i].params[0], sample[i].params[1], sample[i].params[2]);
+    }
+    fclose(fp_sample);
+  }
+
+  //save posterior sample
+  if(ctx->flag_binary == 1)
+  {
+    fp = fopen(ctx->options.posterior_sample_file, "wb");
+    if(fp == NULL)
+    {
+      fprintf(stderr, "# Error: Cannot open file %s.\n", ctx->options.posterior_sample_file);
+      exit(0);
+    }
+    dnest_write_bin_header(fp, ctx->size_of_modeltype/sizeof(double), num_ps, 
+                           ctx->bin_layout, DNEST_BIN_LAYOUT_MAX);
+    fwrite(posterior_sample, ctx->size_of_modeltype, num_ps, fp);
+    fclose(fp);
+
+    fp = fopen(ctx->options.posterior_sample_info_file, "wb");
+    if(fp == NULL)
+    {
+      fprintf(stderr, "# Error: Cannot open file %s.\n", ctx->options.posterior_sample_info_file);
+      exit(0);
+    }
+    dnest_write_bin_header(fp, 1, num_ps, ctx->bin_layout, DNEST_BIN_LAYOUT_MAX);
+    fwrite(posterior_sample_info, sizeof(double), num_ps, fp);
+    fclose(fp);
+  }
+  else
+  {
+    fp = fopen(ctx->options.posterior_sample_file, "w");
+    if(fp == NULL)
+    {
+      fprintf(stderr, "# Error: Cannot open file %s.\n", ctx->options.posterior_sample_file);
+      exit(0);
+    }
+    fprintf(fp, "# %d\n", num_ps);
+
+    for(i=0; i<num_ps; i++)
+    {
+      ctx->print_particle(fp, posterior_sample + i*ctx->size_of_modeltype, ctx->arg);
+    }
+    fclose(fp);
+
+    //save posterior sample information
+    fp = fopen(ctx->options.posterior_sample_info_file, "w");
+    if(fp == NULL)
+    {
+      fprintf(stderr, "# Error: Cannot open file %s.\n", ctx->options.posterior_sample_info_file);
+      exit(0);
+    }
+    fprintf(fp, "# %d\n", num_ps);
+    for(i=0; i<num_ps; i++)
+    {
+      fprintf(fp, "%e\n", posterior_sample_info[i]);
+    }
+    fclose(fp);
+  }
+  
+  for(i=0; i<num_levels; i++)
+   free(levels_orig[i]);
+  free(levels_orig);
+
+  for(i=0; i<num_samples; i++)
+    free(sample_info[i]);
+  free(sample_info);
+  free(logl);
+
+  free(logP_samples);
+  free(psample);
+  free(posterior_sample_idx);
+
+  /* keep posterior sample in memory, released by dnest_free_posterior_sample() */
+  dnest_free_posterior_sample(ctx);
+  ctx->posterior_sample = posterior_sample;
+  ctx->posterior_sample_info = posterior_sample_info;
+  ctx->num_posterior_sample = num_ps;
+
+  gsl_rng_free(dnest_post_gsl_r);
+
+  printf("# Ends dnest postprocess.\n");
+}
+
+/*
+ * read level assignments, log likelihoods, and tiebreakers of the first num_samples samples 
+ * from the sample information file.
+ */
+void dnest_read_sample_info(DNestContext *ctx, double **sample_info, int num_samples, int num_levels)
+{
+  FILE *fp;
+  int i, j;
+  char buf[BUF_MAX_LENGTH];
+  DNestBinHeader header;
+  double *bin_data;
+  size_t map_size;
+
+  if(ctx->flag_binary == 1)
+  {
+    bin_data = dnest_mmap_bin(ctx->options.sample_info_file, &header, &map_size);
+    if(bin_data == NULL)
+      exit(0);
+    if(header.num_rows < num_samples)
+    {
+      fprintf(stderr, "# Error: file %s ends at %lld.\n", ctx->options.sample_info_file, header.num_rows);
+      exit(0);
+    }
+    for(i=0; i < num_samples; i++)
+    {
+      for(j=0; j<3; j++)
+        sample_info[i][j] = bin_data[i*header.num_cols + j];
+
+      /* reset level assignment for levels larger than the maximum level numbers */
+      if(sample_info[i][0] > num_levels -1)
+        sample_info[i][0] = num_levels - 1;
+    }
+    dnest_munmap_bin(bin_data, map_size);
+  }
+  else
+  {
+    fp = fopen(ctx->options.sample_info_file, "r");
+    if(fp == NULL)
+    {
+      fprintf(stderr, "# Error: Cannot open file %s.\n", ctx->options.sample_info_file);
+      exit(0);
+    }
+    fgets(buf, BUF_MAX_LENGTH, fp);
+    for(i=0; i < num_samples; i++)
+    {
+      if(feof(fp) != 0)
+      {
+        fprintf(stderr, "# Error: file %s ends at %d.\n", ctx->options.sample_info_file, i);
+        exit(0);
+      }
+      fgets(buf, BUF_MAX_LENGTH, fp);
+      if(sscanf(buf, "%lf %lf %lf", &sample_info[i][0], &sample_info[i][1], &sample_info[i][2]) < 3)
+      {
+        fprintf(stderr, "# Error: Cannot read file %s.\n", ctx->options.sample_info_file);
+        exit(0);
+      }
+      buf[0]='\0';  // clear buf
+
+      /* reset level assignment for levels larger than the maximum level numbers */
+      if(sample_info[i][0] > num_levels -1)
+        sample_info[i][0] = num_levels - 1;
+    }
+    fclose(fp);
+  }
+}
+
+/*
+ * evidence, information, and effective sample size from levels and sample information.
+ * levels_orig: log_X, log likelihood, and tiebreaker of each level.
+ * sample_info: level assignment, log likelihood, and tiebreaker of each sample.
+ * logP_samples: output, normalized log posterior weights of samples.
+ */
+void dnest_evidence(double **levels_orig, int num_levels, double **sample_info, int num_samples, 
+                    double temperature, double *logP_samples, double *logz, double *H, double *ess)
+{
+  int i, j;
+  int *sandwhich;
+
+  sandwhich = malloc(num_samples * sizeof(int));
+
   // finding sandwhiching levels for each samples
   for(i=0; i<num_samples; i++)
   {
@@ -221,7 +507,7 @@ void postprocess(double temperature)
     //printf("%f %d\n", logl[i], sandwhich[i]);
   }
   
-  double *logx_samples, *logp_samples, *logP_samples;
+  double *logx_samples, *logp_samples;
   double logx_min, logx_max, Umin, U;
   int num_samples_thisLevel;
   double *logx_samples_thisLevel;
@@ -231,7 +517,6 @@ void postprocess(double temperature)
   
   logx_samples = malloc(num_samples * sizeof(double));
   logp_samples = malloc(num_samples * sizeof(double));
-  logP_samples = malloc(num_samples * sizeof(double));
   
   logx_samples_thisLevel = malloc(num_samples * sizeof(double));
   logl_samples_thisLevel = malloc(num_samples * sizeof(SampleType));
@@ -294,7 +579,7 @@ void postprocess(double temperature)
     }
   }
   
-  double sum, max, logz_estimates, H_estimates, ESS;
+  double sum, logz_estimates, H_estimates, ESS;
   
   
   sum = logsumexp(logp_samples, num_samples);
@@ -302,7 +587,7 @@ void postprocess(double temperature)
   {
     logp_samples[j] -= sum;
     //logP_samples[j] = logp_samples[j] + sample_info[j][1];
-    logP_samples[j] = logp_samples[j] + logl[j];
+    logP_samples[j] = logp_samples[j] + sample_info[j][1]/temperature;
   }
   
   logz_estimates = logsumexp(logP_samples, num_samples);
@@ -313,138 +598,21 @@ void postprocess(double temperature)
   {
     logP_samples[j] -= logz_estimates; 
     //H_estimates += exp(logP_samples[j]) * sample_info[j][1];
-    H_estimates += exp(logP_samples[j]) * logl[j];
+    H_estimates += exp(logP_samples[j]) * sample_info[j][1]/temperature;
     ESS += -logP_samples[j]*exp(logP_samples[j]);
   }
   ESS = exp(ESS);
     
-  printf("log(Z) = %f\n", logz_estimates);
-  printf("H = %f\n", H_estimates);
-  printf("Effective sample size = %f\n", ESS);
-  
-  post_logz = logz_estimates;
 
-  // resample to uniform weight
-  
-  int num_ps = moreSample*ESS;
-  void *posterior_sample;
-  double *posterior_sample_info;
-  int *posterior_sample_idx;
-  int which;
-
-  const gsl_rng_type * dnest_post_gsl_T;
-  gsl_rng * dnest_post_gsl_r;
-
-  dnest_post_gsl_T = (gsl_rng_type *) gsl_rng_default;
-  dnest_post_gsl_r = gsl_rng_alloc (dnest_post_gsl_T);
-#ifndef Debug
-  gsl_rng_set(dnest_post_gsl_r, time(NULL));
-#else
-  gsl_rng_set(dnest_post_gsl_r, 8888);
-  printf("# debugging, random seed %d\n", 8888);
-#endif  
-
-  posterior_sample = malloc(num_ps * dnest_size_of_modeltype);
-  posterior_sample_info = malloc(num_ps * sizeof(double));
-  posterior_sample_idx = malloc(num_ps * sizeof(int)); // flag for which particle to save
-
-  max = logP_samples[0];
-  for(j=0; j<num_samples; j++)
-    max = fmax(logP_samples[j], max);
-  for(j=0; j<num_samples; j++)
-    logP_samples[j] -= max;
-  
-  for(j=0; j<num_ps; j++)
-  {
-    while(true)
-    {
-      which =  gsl_rng_uniform_int(dnest_post_gsl_r, num_samples);
-      if(log(gsl_rng_uniform(dnest_post_gsl_r)) < logP_samples[which])
-      {
-        posterior_sample_info[j] = logl[which]; 
-        posterior_sample_idx[j]  = which;  // sample this particle
-        break;
-      }
-    }
-  }
-
-  // read sample and pick out selected particles
-  
-  fp_sample = fopen(options.sample_file, "r");
-  if(fp_sample == NULL)
-  {
-    fprintf(stderr, "# Error: Cannot open file %s.\n", options.sample_file);
-    exit(0);
-  }
-  fgets(buf, BUF_MAX_LENGTH, fp_sample);
-  for(i=0; i < num_samples; i++)
-  {
-    
-    read_particle(fp_sample, (void *)psample);
-
-    for(j=0; j < num_ps; j++)
-    {
-      if(posterior_sample_idx[j] == i)
-      {
-        memcpy(posterior_sample+j*dnest_size_of_modeltype, (void *)psample, dnest_size_of_modeltype);
-      }
-    }
-    //printf("%f %f %f\n", sample[i].params[0], sample[i].params[1], sample[i].params[2]);
-  }
-  fclose(fp_sample);
-
-  //save posterior sample
-  fp = fopen(options.posterior_sample_file, "w");
-  if(fp == NULL)
-  {
-    fprintf(stderr, "# Error: Cannot open file %s.\n", options.posterior_sample_file);
-    exit(0);
-  }
-  fprintf(fp, "# %d\n", num_ps);
-
-  for(i=0; i<num_ps; i++)
-  {
-    print_particle(fp, posterior_sample + i*dnest_size_of_modeltype, dnest_arg);
-  }
-  fclose(fp);
-
-  //save posterior sample information
-  fp = fopen(options.posterior_sample_info_file, "w");
-  if(fp == NULL)
-  {
-    fprintf(stderr, "# Error: Cannot open file %s.\n", options.posterior_sample_info_file);
-    exit(0);
-  }
-  fprintf(fp, "# %d\n", num_ps);
-  for(i=0; i<num_ps; i++)
-  {
-    fprintf(fp, "%e\n", posterior_sample_info[i]);
-  }
-  fclose(fp);
-  
-  for(i=0; i<num_levels; i++)
-   free(levels_orig[i]);
-  free(levels_orig);
-
-  for(i=0; i<num_samples; i++)
-    free(sample_info[i]);
-  free(sample_info);
-  free(logl);
+  *logz = logz_estimates;
+  *H = H_estimates;
+  *ess = ESS;
 
   free(logx_samples);
   free(logx_samples_thisLevel);
   free(logp_samples);
-  free(logP_samples);
   free(logl_samples_thisLevel);
   free(sandwhich);
-  free(psample);
-  free(posterior_sample);
-  free(posterior_sample_info);
-  free(posterior_sample_idx);
-
-  gsl_rng_free(dnest_post_gsl_r);
-
-  printf("# Ends dnest postprocess.\n");
 }
 
 int cmp_sample(const void *pa, const void *pb)
@@ -14,55 +14,13 @@
 #include <gsl/gsl_rng.h>
 
 #include "dnestvars.h"
- 
-/* output files */
-FILE *fsample, *fsample_info;
 
-/* random number generator */
-const gsl_rng_type * dnest_gsl_T;
-gsl_rng * dnest_gsl_r;
-
-Options options;
-char options_file[STR_MAX_LENGTH];
-
-// sampler
-bool save_to_disk;
-double compression;
-unsigned int regularisation;
-
-void *particles;
-int dnest_size_of_modeltype;
-int particle_offset_size, particle_offset_double;
-
-LikelihoodType *log_likelihoods;
-unsigned int *level_assignments;
-
-// number account of unaccepted times
-unsigned int *account_unaccepts;
-
-int size_levels;  
-Level *levels;
-unsigned int count_saves, num_saves, num_saves_restart;
-int dnest_which_particle_update; // which particle to be updated
-int dnest_which_level_update;    // which level to be updated;
-unsigned long long int count_mcmc_steps;
-LikelihoodType *above;
-unsigned int size_above;
-
-double post_logz;
-int dnest_num_params;
-char dnest_sample_postfix[STR_MAX_LENGTH], dnest_sample_tag[STR_MAX_LENGTH], dnest_sample_dir[STR_MAX_LENGTH];
-
-double *limits, *copies_of_limits;
-
-int *dnest_perturb_accept;
-int dnest_root;
-
-int dnest_flag_restart=0, dnest_flag_postprc=0, dnest_flag_sample_info=0, dnest_flag_limits=0;
-double dnest_post_temp=1.0;
-char file_restart[STR_MAX_LENGTH], file_save_restart[STR_MAX_LENGTH];
-
-void *dnest_arg;
+/* state of the calling thread, the rest of the sampler is in DNestContext */
+__thread DNestContext *dnest_ctx;
+__thread gsl_rng * dnest_gsl_r;
+__thread int dnest_which_particle_update; // which particle to be updated
+__thread int dnest_which_level_update;    // which level to be updated;
+__thread double dnest_time_likelihood_thread;
 
 //***********************************************
 /*                  functions                  */
@@ -72,61 +30,93 @@ void wrap_limit(double *x, double min, double max);
 int mod_int(int y, int x);
 int dnest_cmp(const void *pa, const void *pb);
 
-void options_load(int max_num_saves, double ptol);
-void setup(int argc, char** argv, DNestFptrSet *fptrset, int num_params, char *sample_dir, int max_num_saves, double ptol);
-void finalise();
-
-double dnest(int argc, char **argv, DNestFptrSet *fptrset,  int num_params, char *sample_dir, 
-             int max_num_saves, double pdff, const void *arg);
-void dnest_run();
-void dnest_mcmc_run();
-void update_particle(unsigned int which);
-void update_level_assignment(unsigned int which);
-double log_push(unsigned int which_level);
-bool enough_levels(Level *l, int size_l);
-void do_bookkeeping();
-void save_levels();
-void save_particle();
-void save_limits();
-void kill_lagging_particles();
-void renormalise_visits();
-void recalculate_log_X();
+void options_load(DNestContext *ctx, int max_num_saves, double ptol);
+void setup(DNestContext *ctx, DNestFptrSet *fptrset, int num_params, 
+           char *sample_dir, int max_num_saves, double ptol);
+void finalise(DNestContext *ctx);
+
+double dnest(DNestContext *ctx, int argc, char **argv, DNestFptrSet *fptrset,  int num_params, 
+             char *sample_dir, int max_num_saves, double pdff, const void *arg);
+int dnest_run(DNestContext *ctx);
+void dnest_mcmc_run(DNestContext *ctx);
+void dnest_mcmc_run_threads(DNestContext *ctx);
+void dnest_mpi_merge_levels(DNestContext *ctx);
+void dnest_mpi_bcast_levels(DNestContext *ctx, bool *flag_kill);
+void update_particle(DNestContext *ctx, unsigned int which, Level *lvls);
+void update_level_assignment(DNestContext *ctx, unsigned int which, Level *lvls, double *lmts);
+double log_push(DNestContext *ctx, unsigned int which_level);
+bool enough_levels(DNestContext *ctx, Level *l, int size_l);
+bool do_bookkeeping(DNestContext *ctx);
+void save_levels(DNestContext *ctx);
+void save_particle(DNestContext *ctx);
+void save_limits(DNestContext *ctx);
+void kill_lagging_particles(DNestContext *ctx);
+void renormalise_visits(DNestContext *ctx);
+void recalculate_log_X(DNestContext *ctx);
 double dnest_randh();
 double dnest_rand();
 double dnest_randn();
 int dnest_rand_int(int size);
-void dnest_postprocess(double temperature, int max_num_saves, double ptol);
-void postprocess(double temperature);
-void initialize_output_file();
-void close_output_file();
-void dnest_save_restart();
-void dnest_restart();
+void dnest_postprocess(DNestContext *ctx, double temperature, int max_num_saves, double ptol);
+void postprocess(DNestContext *ctx, double temperature);
+void dnest_read_sample_info(DNestContext *ctx, double **sample_info, int num_samples, int num_levels);
+void dnest_evidence(double **levels_orig, int num_levels, double **sample_info, int num_samples, 
+                    double temperature, double *logP_samples, double *logz, double *H, double *ess);
+bool dnest_check_convergence(DNestContext *ctx);
+void initialize_output_file(DNestContext *ctx);
+void close_output_file(DNestContext *ctx);
+void dnest_set_output_buffer(DNestContext *ctx);
+int dnest_save_restart(DNestContext *ctx);
+int dnest_write_restart(DNestContext *ctx, FILE *fp, long long int *offset);
+void dnest_restart_task_file(DNestContext *ctx, char *str, const char *fname);
+int dnest_restart(DNestContext *ctx);
 void dnest_restart_action(int iflag);
 void dnest_accept_action();
 void dnest_kill_action(int i, int i_copy);
 void dnest_print_particle(FILE *fp, const void *model, const void *arg);
 void dnest_read_particle(FILE *fp, void *model);
+const void * dnest_get_arg();
 int dnest_get_size_levels();
 int dnest_get_which_level_update();
 int dnest_get_which_particle_update();
-void dnest_get_posterior_sample_file(char *fname);
+unsigned int dnest_get_num_particles();
+unsigned int dnest_get_num_threads(DNestContext *ctx);
+void dnest_set_num_threads(DNestContext *ctx, unsigned int n);
+int dnest_get_thread_num();
+int dnest_get_thistask();
+int dnest_get_totaltask();
+void dnest_get_posterior_sample_file(DNestContext *ctx, char *fname);
+int dnest_get_num_posterior_sample(DNestContext *ctx);
+void dnest_get_posterior_sample(DNestContext *ctx, void *ps, double *ps_info);
+void dnest_free_posterior_sample(DNestContext *ctx);
+void dnest_set_bin_layout(DNestContext *ctx, int *layout, int n);
+void dnest_write_bin_header(FILE *fp, int num_cols, long long int num_rows, const int *layout, int n);
+void dnest_update_bin_header(FILE *fp, int num_cols);
+double * dnest_mmap_bin(const char *fname, DNestBinHeader *header, size_t *map_size);
+void dnest_munmap_bin(double *data, size_t map_size);
 int dnest_check_version(char *verion_str);
 unsigned int dnest_get_which_num_saves();
 unsigned int dnest_get_count_saves();
 unsigned long long int dnest_get_count_mcmc_steps();
+void dnest_set_sync_policy(DNestContext *ctx, int policy);
+void dnest_set_seed(DNestContext *ctx, unsigned long int seed);
+void dnest_set_stopping(DNestContext *ctx, double ess, double logz_tol, double max_time);
+void dnest_set_options(DNestContext *ctx, unsigned int num_particles, unsigned int new_level_interval, 
+                       unsigned int save_interval, unsigned int thread_steps, 
+                       unsigned int max_num_levels, double lambda, double beta);
+void dnest_set_progress(DNestContext *ctx, 
+                        void (*progress)(int count_saves, int num_levels, double rate, void *arg), void *arg);
+void dnest_set_stop_request(DNestContext *ctx, int flag);
+int dnest_get_stop_request(DNestContext *ctx);
+double dnest_wtime();
+void dnest_get_timing(DNestContext *ctx, double *time_sampling, double *time_likelihood);
+unsigned long long int dnest_get_steps_sampling(DNestContext *ctx);
+int dnest_get_error(DNestContext *ctx);
+void dnest_get_io_stats(DNestContext *ctx, double *time_io, double *time_convergence, 
+                        double *time_postprocess, unsigned long long int *bytes_written);
+int dnest_get_level_stats(DNestContext *ctx, unsigned long long int **accepts, unsigned long long int **tries);
 void dnest_check_fptrset(DNestFptrSet *fptrset);
 DNestFptrSet * dnest_malloc_fptrset();
 void dnest_free_fptrset(DNestFptrSet * fptrset);
-/*=====================================================*/
-// users responsible for following functions
-void (*print_particle)(FILE *fp, const void *model, const void *arg);
-void (*read_particle)(FILE *fp, void *model);
-void (*from_prior)(void *model, const void *arg);
-double (*log_likelihoods_cal)(const void *model, const void *arg);
-double (*log_likelihoods_cal_initial)(const void *model, const void *arg);
-double (*log_likelihoods_cal_restart)(const void *model, const void *arg);
-double (*perturb)(void *model, const void *arg);
-void (*restart_action)(int iflag);
-void (*accept_action)();
-void (*kill_action)(int i, int i_copy);
-/*=====================================================*/
\ No newline at end of file
+DNestContext * dnest_malloc_context();
+void dnest_free_context(DNestContext *ctx);
@@ -8,6 +8,11 @@
 #ifndef _DNESTVARS_H
 #define _DNESTVARS_H
 
+/* optional sampling across MPI tasks, see dnest_mpi_merge_levels() */
+#ifdef USE_MPI
+#include <mpi.h>
+#endif
+
 #ifdef __cplusplus
 extern "C" {
 #endif
@@ -27,12 +32,34 @@ extern "C" {
 #define BUF_MAX_LENGTH (200)
 #define LEVEL_NUM_MAX (2000)
 
-/* output files */
-extern FILE *fsample, *fsample_info;
+/* sample outputs are buffered in blocks of DNEST_OUTPUT_BUFFER_SIZE bytes,
+ * and synchronized to disk according to the sync policy */
+#define DNEST_OUTPUT_BUFFER_SIZE (1<<20)
+#define DNEST_SYNC_NONE  0   /* only at the end of sampling */
+#define DNEST_SYNC_FLUSH 1   /* flush every num_saves samples */
+#define DNEST_SYNC_FSYNC 2   /* flush and fsync every num_saves samples */
+
+/* binary output files: a fixed header followed by a contiguous float64 array */
+#define DNEST_BIN_MAGIC "DNESTBIN"
+#define DNEST_BIN_VERSION 1
+#define DNEST_BIN_LAYOUT_MAX 10
+typedef struct 
+{
+  char magic[8];
+  int version;
+  int num_cols;                         /* number of float64 columns in a row */
+  long long int num_rows;               /* number of rows */
+  int layout[DNEST_BIN_LAYOUT_MAX];     /* parameter layout, set by users */
+}DNestBinHeader;
+
+/* values of dnest_get_error() */
+#define DNEST_ERROR_CHECKPOINT 1  // a checkpoint cannot be read or written
+#define DNEST_ERROR_STOPPED    2  // a stop was requested before the start, nothing is done
+
+/* binary checkpoint for restart, see dnest_save_restart() */
+#define DNEST_RESTART_MAGIC "DNESTRST"
+#define DNEST_RESTART_VERSION 2
 
-/* random number generator */
-extern const gsl_rng_type * dnest_gsl_T;
-extern gsl_rng * dnest_gsl_r;
 
 typedef struct 
 {
@@ -68,8 +95,6 @@ typedef struct
   char posterior_sample_info_file[STR_MAX_LENGTH];
   char limits_file[STR_MAX_LENGTH];
 }Options;
-extern Options options;
-extern char options_file[STR_MAX_LENGTH];
 
 typedef struct
 {
@@ -85,47 +110,131 @@ typedef struct
   void (*kill_action)(int i, int i_copy);
 }DNestFptrSet;
 
-extern void *particles;
-extern int dnest_size_of_modeltype;
-extern int particle_offset_size, particle_offset_double;
+/* 
+ * state of a sampler, allocated by dnest_malloc_context() and passed to dnest().
+ * each run works on its own context only, so that several samplers 
+ * can run concurrently in different threads of a process.
+ */
+typedef struct
+{
+  /* output files */
+  FILE *fsample, *fsample_info;
+  int sync_policy;
+  // seed of random number generators, 0: seeded by time
+  unsigned long int seed;
+  char *output_buffer;
+
+  /* random number generators, one stream for each thread */
+  gsl_rng **gsl_r_threads;
+
+  Options options;
+
+  // sampler
+  bool save_to_disk;
+  unsigned int num_threads;
+  double compression;
+  unsigned int regularisation;
+
+  void *particles;
+  int size_of_modeltype;
+  int particle_offset_size, particle_offset_double;
+  LikelihoodType *log_likelihoods;
+  unsigned int *level_assignments;
+  // proposal buffers, one for each particle
+  void *proposals;
+  // number account of unaccepted times
+  unsigned int *account_unaccepts;
+  int *perturb_accept;
+  unsigned int deletions;
+
+  int size_levels;
+  Level *levels;
+  unsigned int count_saves, num_saves, num_saves_restart;
+  unsigned long long int count_mcmc_steps;
+  LikelihoodType *above;
+  unsigned int size_above;
+
+  // copies of levels and above buffers for each thread, merged at bookkeeping
+  Level *levels_orig, **levels_copies;
+  LikelihoodType **above_copies;
+  unsigned int *size_above_copies;
 
-// sampler
-extern bool save_to_disk;
-extern unsigned int num_threads;
-extern double compression;
-extern unsigned int regularisation;
+  //the limits of parameters for each level;
+  double *limits, *copies_of_limits;
 
-extern void *particles;
-extern LikelihoodType *log_likelihoods;
-extern unsigned int *level_assignments;
+  // rank of this task, number of tasks and the root task, 0, 1 and 0 without MPI
+  int root, thistask, totaltask;
+  // level statistics at the start of a round, merged across tasks, and the buffer of saved particles
+  Level *levels_task_orig;
+  double *save_message;
 
-// number account of unaccepted times
-extern unsigned int *account_unaccepts;
+  // wall-clock time of sampling and time spent in likelihood
+  double time_sampling, time_likelihood;
+  unsigned long long int steps_sampling;
 
-extern int size_levels;  
-extern Level *levels;
-extern unsigned int count_saves, num_saves, num_saves_restart;
-extern unsigned long long int count_mcmc_steps;
-extern LikelihoodType *above;
-extern unsigned int size_above;
+  // wall-clock time of writing outputs, of convergence checks, and of postprocess, 
+  // bytes written to sample, level, and restart files, and acceptance of levels in the last run
+  double time_io, time_convergence, time_postprocess;
+  unsigned long long int bytes_written;
+  int num_levels_stats;
+  unsigned long long int *level_accepts, *level_tries;
 
-extern int dnest_flag_restart, dnest_flag_postprc, dnest_flag_sample_info, dnest_flag_limits;
-extern double dnest_post_temp;
-extern char file_restart[STR_MAX_LENGTH], file_save_restart[STR_MAX_LENGTH];
+  // early stopping: target effective sample size, tolerance of log evidence between 
+  // successive checks, and the maximum wall-clock time of sampling (0: no limit)
+  double stop_ess, stop_logz_tol, stop_time;
+  double stop_logz_last;
 
-extern double post_logz;
-extern int dnest_num_params;
-extern char dnest_sample_postfix[STR_MAX_LENGTH], dnest_sample_tag[STR_MAX_LENGTH], dnest_sample_dir[STR_MAX_LENGTH];
+  // sampling options set through dnest_set_options(), 0 for the defaults, see options_load()
+  unsigned int opt_num_particles, opt_new_level_interval, opt_save_interval;
+  unsigned int opt_thread_steps, opt_max_num_levels;
+  double opt_lambda, opt_beta;
 
-//the limits of parameters for each level;
-extern double *limits, *copies_of_limits;
+  // progress function at every save and flag of a stop requested by the caller
+  void (*progress)(int count_saves, int num_levels, double rate, void *arg);
+  void *progress_arg;
+  volatile int stop_request;
+  // nonzero if the last run did not complete, see DNEST_ERROR_*
+  int error;
 
-extern int dnest_which_particle_update; // which particle to be updated
-extern int dnest_which_level_update;    // which level to be updated;
-extern int *dnest_perturb_accept;
-extern int dnest_root;
+  int flag_restart, flag_postprc, flag_sample_info, flag_limits;
+  int flag_binary;
+  int bin_layout[DNEST_BIN_LAYOUT_MAX];
+  double post_temp;
+  char file_restart[STR_MAX_LENGTH], file_save_restart[STR_MAX_LENGTH];
+
+  double post_logz;
+  int num_posterior_sample;
+  void *posterior_sample;
+  double *posterior_sample_info;
+  int num_params;
+  char sample_postfix[STR_MAX_LENGTH], sample_tag[STR_MAX_LENGTH], sample_dir[STR_MAX_LENGTH];
+
+  // functions of users, see DNestFptrSet, and their argument
+  void (*print_particle)(FILE *fp, const void *model, const void *arg);
+  void (*read_particle)(FILE *fp, void *model);
+  void (*from_prior)(void *model, const void *arg);
+  double (*log_likelihoods_cal)(const void *model, const void *arg);
+  double (*log_likelihoods_cal_initial)(const void *model, const void *arg);
+  double (*log_likelihoods_cal_restart)(const void *model, const void *arg);
+  double (*perturb)(void *model, const void *arg);
+  void (*restart_action)(int iflag);
+  void (*accept_action)();
+  void (*kill_action)(int i, int i_copy);
+  const void *arg;
+}DNestContext;
+
+/* 
+ * state of the calling thread: the context it runs, its stream of random numbers, 
+ * the particle and level being updated, and its time spent in likelihood.
+ * set by dnest() and by the sampling threads, read by the functions called from 
+ * the functions of users, e.g., dnest_rand() and dnest_get_which_particle_update().
+ */
+extern __thread DNestContext *dnest_ctx;
+extern __thread gsl_rng * dnest_gsl_r;
+extern __thread int dnest_which_particle_update; // which particle to be updated
+extern __thread int dnest_which_level_update;    // which level to be updated;
+extern __thread double dnest_time_likelihood_thread;
 
-extern void *dnest_arg;
 //***********************************************
 /*                  functions                  */
 extern double mod(double y, double x);
@@ -134,64 +243,96 @@ extern void wrap_limit(double *x, double min, double max);
 extern int mod_int(int y, int x);
 extern int dnest_cmp(const void *pa, const void *pb);
 
-extern void options_load(int max_num_saves, double ptol);
-extern void setup(int argc, char** argv, DNestFptrSet *fptrset, int num_params, char *sample_dir, int max_num_saves, double ptol);
-extern void finalise();
-
-extern double dnest(int argc, char **argv, DNestFptrSet *fptrset,  int num_params, char *sample_dir, 
-             int max_num_saves, double pdff, const void *arg);
-extern void dnest_run();
-extern void dnest_mcmc_run();
-extern void update_particle(unsigned int which);
-extern void update_level_assignment(unsigned int which);
-extern double log_push(unsigned int which_level);
-extern bool enough_levels(Level *l, int size_l);
-extern void do_bookkeeping();
-extern void save_levels();
-extern void save_particle();
-extern void save_limits();
-extern void kill_lagging_particles();
-extern void renormalise_visits();
-extern void recalculate_log_X();
+extern void options_load(DNestContext *ctx, int max_num_saves, double ptol);
+extern void setup(DNestContext *ctx, DNestFptrSet *fptrset, int num_params, 
+                  char *sample_dir, int max_num_saves, double ptol);
+extern void finalise(DNestContext *ctx);
+
+extern double dnest(DNestContext *ctx, int argc, char **argv, DNestFptrSet *fptrset,  int num_params, 
+                    char *sample_dir, int max_num_saves, double pdff, const void *arg);
+extern int dnest_run(DNestContext *ctx);
+extern void dnest_mcmc_run(DNestContext *ctx);
+extern void dnest_mcmc_run_threads(DNestContext *ctx);
+extern void dnest_mpi_merge_levels(DNestContext *ctx);
+extern void dnest_mpi_bcast_levels(DNestContext *ctx, bool *flag_kill);
+extern void update_particle(DNestContext *ctx, unsigned int which, Level *lvls);
+extern void update_level_assignment(DNestContext *ctx, unsigned int which, Level *lvls, double *lmts);
+extern double log_push(DNestContext *ctx, unsigned int which_level);
+extern bool enough_levels(DNestContext *ctx, Level *l, int size_l);
+extern bool do_bookkeeping(DNestContext *ctx);
+extern void save_levels(DNestContext *ctx);
+extern void save_particle(DNestContext *ctx);
+extern void save_limits(DNestContext *ctx);
+extern void kill_lagging_particles(DNestContext *ctx);
+extern void renormalise_visits(DNestContext *ctx);
+extern void recalculate_log_X(DNestContext *ctx);
 extern double dnest_randh();
 extern double dnest_rand();
 extern double dnest_randn();
 extern int dnest_rand_int(int size);
-extern void dnest_postprocess(double temperature, int max_num_saves, double ptol);
-extern void postprocess(double temperature);
-extern void initialize_output_file();
-extern void close_output_file();
-extern void dnest_save_restart();
-extern void dnest_restart();
+extern void dnest_postprocess(DNestContext *ctx, double temperature, int max_num_saves, double ptol);
+extern void postprocess(DNestContext *ctx, double temperature);
+extern void dnest_read_sample_info(DNestContext *ctx, double **sample_info, int num_samples, int num_levels);
+extern void dnest_evidence(double **levels_orig, int num_levels, double **sample_info, int num_samples, 
+                           double temperature, double *logP_samples, double *logz, double *H, double *ess);
+extern bool dnest_check_convergence(DNestContext *ctx);
+extern void initialize_output_file(DNestContext *ctx);
+extern void close_output_file(DNestContext *ctx);
+extern void dnest_set_output_buffer(DNestContext *ctx);
+extern int dnest_save_restart(DNestContext *ctx);
+extern int dnest_write_restart(DNestContext *ctx, FILE *fp, long long int *offset);
+extern void dnest_restart_task_file(DNestContext *ctx, char *str, const char *fname);
+extern int dnest_restart(DNestContext *ctx);
 extern void dnest_restart_action(int iflag);
 extern void dnest_accept_action();
 extern void dnest_kill_action(int i, int i_copy);
 extern void dnest_print_particle(FILE *fp, const void *model, const void *arg);
 extern void dnest_read_particle(FILE *fp, void *model);
+extern const void * dnest_get_arg();
 extern int dnest_get_size_levels();
 extern int dnest_get_which_level_update();
 extern int dnest_get_which_particle_update();
-extern void dnest_get_posterior_sample_file(char *fname);
+extern unsigned int dnest_get_num_particles();
+extern unsigned int dnest_get_num_threads(DNestContext *ctx);
+extern void dnest_set_num_threads(DNestContext *ctx, unsigned int n);
+extern int dnest_get_thread_num();
+extern int dnest_get_thistask();
+extern int dnest_get_totaltask();
+extern void dnest_get_posterior_sample_file(DNestContext *ctx, char *fname);
+extern int dnest_get_num_posterior_sample(DNestContext *ctx);
+extern void dnest_get_posterior_sample(DNestContext *ctx, void *ps, double *ps_info);
+extern void dnest_free_posterior_sample(DNestContext *ctx);
+extern void dnest_set_bin_layout(DNestContext *ctx, int *layout, int n);
+extern void dnest_write_bin_header(FILE *fp, int num_cols, long long int num_rows, const int *layout, int n);
+extern void dnest_update_bin_header(FILE *fp, int num_cols);
+extern double * dnest_mmap_bin(const char *fname, DNestBinHeader *header, size_t *map_size);
+extern void dnest_munmap_bin(double *data, size_t map_size);
 extern int dnest_check_version(char *verion_str);
 extern unsigned int dnest_get_which_num_saves();
 extern unsigned int dnest_get_count_saves();
 extern unsigned long long int dnest_get_count_mcmc_steps();
+extern void dnest_set_sync_policy(DNestContext *ctx, int policy);
+extern void dnest_set_seed(DNestContext *ctx, unsigned long int seed);
+extern void dnest_set_stopping(DNestContext *ctx, double ess, double logz_tol, double max_time);
+extern void dnest_set_options(DNestContext *ctx, unsigned int num_particles, unsigned int new_level_interval, 
+                              unsigned int save_interval, unsigned int thread_steps, 
+                              unsigned int max_num_levels, double lambda, double beta);
+extern void dnest_set_progress(DNestContext *ctx, 
+                               void (*progress)(int count_saves, int num_levels, double rate, void *arg), void *arg);
+extern void dnest_set_stop_request(DNestContext *ctx, int flag);
+extern int dnest_get_stop_request(DNestContext *ctx);
+extern double dnest_wtime();
+extern void dnest_get_timing(DNestContext *ctx, double *time_sampling, double *time_likelihood);
+extern unsigned long long int dnest_get_steps_sampling(DNestContext *ctx);
+extern int dnest_get_error(DNestContext *ctx);
+extern void dnest_get_io_stats(DNestContext *ctx, double *time_io, double *time_convergence, 
+                               double *time_postprocess, unsigned long long int *bytes_written);
+extern int dnest_get_level_stats(DNestContext *ctx, unsigned long long int **accepts, unsigned long long int **tries);
 extern void dnest_check_fptrset(DNestFptrSet *fptrset);
 extern DNestFptrSet * dnest_malloc_fptrset();
 extern void dnest_free_fptrset(DNestFptrSet * fptrset);
-/*=====================================================*/
-// users responsible for following functions
-extern void (*print_particle)(FILE *fp, const void *model, const void *arg);
-extern void (*read_particle)(FILE *fp, void *model);
-extern void (*from_prior)(void *model, const void *arg);
-extern double (*log_likelihoods_cal)(const void *model, const void *arg);
-extern double (*log_likelihoods_cal_initial)(const void *model, const void *arg);
-extern double (*log_likelihoods_cal_restart)(const void *model, const void *arg);
-extern double (*perturb)(void *model, const void *arg);
-extern void (*restart_action)(int iflag);
-extern void (*accept_action)();
-extern void (*kill_action)(int i, int i_copy);
-/*=====================================================*/
+extern DNestContext * dnest_malloc_context();
+extern void dnest_free_context(DNestContext *ctx);
 
 #ifdef __cplusplus
 }
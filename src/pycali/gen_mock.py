@@ -1,6 +1,7 @@
 #
 # generate mock data for PyCALI.
 #
+import os
 import numpy as np
 from numpy import fft 
 import pycali
@@ -19,146 +20,185 @@ def convolve_fft(con, resp):
   conv = fft.irfft(conv_fft, n = con.shape[0])
   return conv
 
-def generate_mock_data():
+def simulate_drw(t, sigma, tau, rng):
   """
-  generate mock data
+  damped random walk (Ornstein-Uhlenbeck process) with zero mean at sorted times t,
+  using the exact recursion x[i] = a[i]*x[i-1] + sigma*sqrt(1-a[i]^2)*n[i], a[i] = exp(-(t[i]-t[i-1])/tau).
+
+  the recursion is unrolled with cumulative sums in blocks spanning 50*tau, so that the cost
+  is O(N) and the exponentials do not overflow.
+  """
+  n = t.shape[0]
+  e = sigma * rng.standard_normal(n)
+  e[1:] *= np.sqrt(-np.expm1(-2.0*np.diff(t)/tau))
+
+  x = np.empty(n)
+  start = 0
+  while start < n:
+    end = max(np.searchsorted(t, t[start] + 50.0*tau, side="right"), start+1)
+    s = (t[start:end] - t[start])/tau
+    # contribution of the previous block
+    carry = x[start-1] * np.exp(-(t[start] - t[start-1])/tau) if start > 0 else 0.0
+    x[start:end] = np.exp(-s) * (carry + np.cumsum(e[start:end] * np.exp(s)))
+    start = end
+  return x
+
+def _code_names(num_codes):
+  """
+  names of codes, A, B, ..., Z, then C26, C27, ...
+  """
+  return [chr(ord("A")+i) if i < 26 else "C%d"%i for i in range(num_codes)]
+
+def _resample(rng, lc, num, scale, shift, syserr, error_scale):
+  """
+  draw num[i] points of code i from lc without replacement, and apply
+  scale, shift, measurement noise, and systematic error to all codes at once.
+  """
+  idx = np.concatenate([np.sort(rng.choice(lc.shape[0], size=k, replace=False)) for k in num])
+  code = np.repeat(np.arange(len(num)), num)
+  lc_set = lc[idx, :]
+  noise = rng.standard_normal((2, idx.shape[0]))
+  lc_set[:, 1] = (lc_set[:, 1] + shift[code])/scale[code] + noise[0] * lc_set[:, 2] + noise[1] * syserr[code]
+  lc_set[:, 2] = lc_set[:, 2]/error_scale[code]
+  return lc_set, code
+
+def _write_lc(fname, lc_set, code, codes):
+  """
+  write light curves in the format of PyCALI
+  """
+  bounds = np.searchsorted(code, np.arange(len(codes)+1))
+  fp = open(fname, "w")
+  for i in range(len(codes)):
+    fp.write("# %s %d\n"%(codes[i], bounds[i+1]-bounds[i]))
+    np.savetxt(fp, lc_set[bounds[i]:bounds[i+1], :], fmt="%15.5f")
+  fp.close()
+
+def _mock_object(rng, num_codes, num_points, num_lines, data_dir, plot):
+  """
+  generate mock light curves of one object in data_dir
   """
   # DRW parameters
   sigma = 0.3
   tau = 50.0
-  
-  # time nodes for continuum
-  tg = np.linspace(-200.0, 600.0, 2000)
-  tmx, tmy = np.meshgrid(tg, tg)
-  # covariance
-  Cov = sigma * sigma * np.exp(-np.abs(tmx-tmy)/tau)
-  Mat = np.linalg.cholesky(Cov)
-  u = np.random.randn(tg.shape[0])
-  fs = np.matmul(Mat, u) + 1.0
-  # errors, around 0.015
-  fe = np.random.randn(tg.shape[0])*0.005+0.015
+
+  # time nodes for continuum, the section 0-360 day should have enough points for each dataset
+  nmax = 1000 if num_points is None else max(1000, num_points)
+  tg = np.linspace(-200.0, 600.0, max(2000, int(nmax*800.0/360.0)+1))
+  fs = simulate_drw(tg, sigma, tau, rng) + 1.0
+  # errors, around 0.015, kept positive
+  fe = np.maximum(rng.standard_normal(tg.shape[0])*0.005+0.015, 0.001)
   con = np.stack((tg, fs, fe), axis=-1)
-  
-  # now emission line 
-  # first transfer function, Gaussian
+
+  # now emission lines with Gaussian transfer functions, lags 30, 20, 16.7, 15... days
   dt = con[1, 0] - con[0, 0]
-  ntau = 200
-  resp = np.zeros(ntau)
-  resp2 = np.zeros(ntau)
+  ntau = int(200.0/dt)
   tau = np.array(np.arange(ntau))*dt
-  resp[:] = np.exp(-0.5 * (tau-30.0)**2/(10.0)**2)
-  resp[:] /= np.sum(resp[:]) * dt
-  resp2[:] = np.exp(-0.5 * (tau-20.0)**2/(5.0)**2)
-  resp2[:] /= np.sum(resp[:]) * dt
-  
-  # get emission line
-  nline = 1000
-  conv = convolve_fft(con[:, 1], resp) * dt
-  line = np.zeros((nline, 3))
-  line[:, 0] = np.linspace(0.0, 360.0, nline)
-  line[:, 2] = np.random.randn(line.shape[0])*0.005+0.015
-  line[:, 1] = np.interp(line[:, 0], con[:, 0], conv) 
-
-  conv2 = convolve_fft(con[:, 1], resp2) * dt
-  line2 = np.zeros((nline, 3))
-  line2[:, 0] = np.linspace(0.0, 360.0, nline)
-  line2[:, 2] = np.random.randn(line2.shape[0])*0.005+0.015
-  line2[:, 1] = np.interp(line2[:, 0], con[:, 0], conv) 
+  nline = nmax
+  lines = []
+  for j in range(num_lines):
+    lag = 10.0 + 20.0/(j+1)
+    resp = np.exp(-0.5 * (tau-lag)**2/(lag/3.0)**2)
+    resp /= np.sum(resp) * dt
+    conv = convolve_fft(con[:, 1], resp) * dt
+    line = np.zeros((nline, 3))
+    line[:, 0] = np.linspace(0.0, 360.0, nline)
+    line[:, 2] = np.maximum(rng.standard_normal(line.shape[0])*0.005+0.015, 0.001)
+    line[:, 1] = np.interp(line[:, 0], con[:, 0], conv)
+    lines.append(line)
 
   # section between 0-360day
   idx = np.where((con[:, 0]>=0.0) & (con[:, 0]<=360.0))
   con = con[idx[0], :]
-  
-  # code, N, scale, shift etc
-  codes=["A", "B", "C", "D", "E"]
-  num_cont = [150, 120, 100, 82, 180]
-  num_line = [160, 90, 120, 80, 100]
-  num_line2 = [100, 80, 100, 90, 150]
-  scale = [1.0, 0.9, 1.1, 0.94, 1.05]
-  shift = [0.0, -0.2, 0.15, 0.05, -0.11]
-  syserr_cont = [0.0, 0.01, 0.09, 0.015, 0.02]
-  syserr_line = [0.0, 0.01, 0.09, 0.015, 0.02]
-  syserr_line2 = [0.15, 0.01, 0.09, 0.015, 0.02]
-  error_scale_cont = np.array([1.0, 0.7, 0.9, 1.2, 0.8])*0.0 + 1.0
-  error_scale_line = np.array([1.0, 1.3, 0.8, 1.3, 1.1])*0.0 + 1.0
-  error_scale_line2 = np.array([1.0, 1.3, 0.8, 1.3, 1.1])*0.0 + 1.0
-  
+
+  # code, N, scale, shift etc, the first five codes take fixed values
+  codes = _code_names(num_codes)
+  scale = np.concatenate(([1.0, 0.9, 1.1, 0.94, 1.05], rng.uniform(0.9, 1.1, max(num_codes-5, 0))))[:num_codes]
+  shift = np.concatenate(([0.0, -0.2, 0.15, 0.05, -0.11], rng.uniform(-0.2, 0.2, max(num_codes-5, 0))))[:num_codes]
+  syserr_cont = np.concatenate(([0.0, 0.01, 0.09, 0.015, 0.02], rng.uniform(0.0, 0.02, max(num_codes-5, 0))))[:num_codes]
+  syserr_line = [np.concatenate(([0.15 if j==1 else 0.0, 0.01, 0.09, 0.015, 0.02],
+                                 rng.uniform(0.0, 0.02, max(num_codes-5, 0))))[:num_codes] for j in range(num_lines)]
+  error_scale_cont = np.ones(num_codes)
+  error_scale_line = [np.ones(num_codes) for j in range(num_lines)]
+  if num_points is None:
+    num_cont = [[150, 120, 100, 82, 180][i%5] for i in range(num_codes)]
+    num_line = [[[160, 90, 120, 80, 100], [100, 80, 100, 90, 150]][j%2][i%5] for j in range(num_lines) for i in range(num_codes)]
+    num_line = np.reshape(num_line, (num_lines, num_codes))
+  else:
+    num_cont = [min(num_points, con.shape[0])] * num_codes
+    num_line = np.full((num_lines, num_codes), min(num_points, nline))
+
   print("code:", codes)
   print("scale:", scale)
   print("shift:", shift)
   print("syserr cont:", syserr_cont)
-  print("syserr line:", syserr_line)
-  print("syserr line2:", syserr_line2)
+  for j in range(num_lines):
+    print("syserr line%d:"%(j+1), syserr_line[j])
   print("error scale cont:", error_scale_cont)
-  print("error scale line:", error_scale_line)
-  print("error scale line2:", error_scale_line2)
-  
-  fig = plt.figure()
-  ax1 = fig.add_subplot(311)
-  ax2 = fig.add_subplot(312)
-  ax3 = fig.add_subplot(313)
-
-  # save full continuum 
-  np.savetxt("data/sim_cont_full.txt", con, fmt="%15.5f")
-  fp=open("data/sim_cont.txt", "w")
-  ax1.errorbar(con[:, 0], con[:, 1], yerr=con[:, 2], ls='none')
-  for i in range(len(codes)):
-    idx = np.unique(np.random.randint(con.shape[0],size=num_cont[i]))
-    con_set = con[idx, :]
-    # flux + noise + systematic error
-    con_set[:, 1] = (con_set[:, 1] + shift[i])/scale[i] + np.random.randn(con_set.shape[0]) * con_set[:, 2] \
-                  + np.random.randn(con_set.shape[0])*syserr_cont[i]
-    con_set[:, 2] = con_set[:, 2]/error_scale_cont[i]
-    ax1.errorbar(con_set[:, 0], con_set[:, 1], yerr=con_set[:, 2], ls='none')
-    
-    fp.write("# %s %d\n"%(codes[i], con_set.shape[0]))
-    np.savetxt(fp, con_set, fmt="%15.5f")
+  for j in range(num_lines):
+    print("error scale line%d:"%(j+1), error_scale_line[j])
 
-  fp.close()
-  ax1.set_ylabel('Continuum')
-  ax1.minorticks_on()
+  os.makedirs(data_dir, exist_ok=True)
 
-  np.savetxt("data/sim_line_full.txt", line, fmt="%15.5f")
-  fp=open("data/sim_line.txt", "w")
-  ax2.errorbar(line[:, 0], line[:, 1], yerr=line[:, 2], ls='none')
-  for i in range(len(codes)):
-    idx = np.unique(np.random.randint(line.shape[0],size=num_line[i]))
-    line_set = line[idx, :]
-    line_set[:, 1] = (line_set[:, 1])/scale[i] + np.random.randn(line_set.shape[0]) * line_set[:, 2] \
-                   + np.random.randn(line_set.shape[0])*syserr_line[i]
-    line_set[:, 2] = line_set[:, 2]/error_scale_line[i]
-    ax2.errorbar(line_set[:, 0], line_set[:, 1], yerr=line_set[:, 2], ls='none')
-    
-    fp.write("# %s %d\n"%(codes[i], line_set.shape[0]))
-    np.savetxt(fp, line_set, fmt="%15.5f")
-  
-  fp.close()
+  # save full continuum
+  np.savetxt(os.path.join(data_dir, "sim_cont_full.txt"), con, fmt="%15.5f")
+  con_set, con_code = _resample(rng, con, num_cont, scale, shift, syserr_cont, error_scale_cont)
+  _write_lc(os.path.join(data_dir, "sim_cont.txt"), con_set, con_code, codes)
 
-  np.savetxt("data/sim_line2_full.txt", line, fmt="%15.5f")
-  fp=open("data/sim_line2.txt", "w")
-  ax3.errorbar(line2[:, 0], line2[:, 1], yerr=line2[:, 2], ls='none')
-  for i in range(len(codes)):
-    idx = np.unique(np.random.randint(line2.shape[0],size=num_line2[i]))
-    line_set = line2[idx, :]
-    line_set[:, 1] = (line_set[:, 1])/scale[i] + np.random.randn(line_set.shape[0]) * line_set[:, 2] \
-                   + np.random.randn(line_set.shape[0])*syserr_line2[i]
-    line_set[:, 2] = line_set[:, 2]/error_scale_line2[i]
-    ax3.errorbar(line_set[:, 0], line_set[:, 1], yerr=line_set[:, 2], ls='none')
-    
-    fp.write("# %s %d\n"%(codes[i], line_set.shape[0]))
-    np.savetxt(fp, line_set, fmt="%15.5f")
-  
-  fp.close()
+  line_sets = []
+  for j in range(num_lines):
+    # sim_line.txt, sim_line2.txt, ...
+    postfix = "" if j == 0 else "%d"%(j+1)
+    np.savetxt(os.path.join(data_dir, "sim_line%s_full.txt"%postfix), lines[j], fmt="%15.5f")
+    line_set, line_code = _resample(rng, lines[j], num_line[j], scale, np.zeros(num_codes),
+                                    syserr_line[j], error_scale_line[j])
+    _write_lc(os.path.join(data_dir, "sim_line%s.txt"%postfix), line_set, line_code, codes)
+    line_sets.append((line_set, line_code))
+
+  if plot:
+    fig = plt.figure()
+    axes = [fig.add_subplot(num_lines+1, 1, j+1) for j in range(num_lines+1)]
+    for ax, full, (lc_set, code) in zip(axes, [con]+lines, [(con_set, con_code)]+line_sets):
+      ax.errorbar(full[:, 0], full[:, 1], yerr=full[:, 2], ls='none')
+      for i in range(num_codes):
+        ax.errorbar(lc_set[code==i, 0], lc_set[code==i, 1], yerr=lc_set[code==i, 2], ls='none')
+      ax.minorticks_on()
+    axes[0].set_ylabel('Continuum')
+    for j in range(num_lines):
+      axes[j+1].set_ylabel('Line' if j==0 else 'Line%d'%(j+1))
+    axes[-1].set_xlabel('Time (day)')
+    fig.suptitle("Mock Data")
+    plt.show()
+
+  return {"code": codes, "scale": scale, "shift": shift,
+          "syserr_cont": syserr_cont, "syserr_line": syserr_line,
+          "error_scale_cont": error_scale_cont, "error_scale_line": error_scale_line}
+
+def generate_mock_data(num_codes=5, num_points=None, num_lines=2, num_objects=1, seed=None,
+                       data_dir="data", plot=False):
+  """
+  generate mock data
 
-  ax2.set_xlabel('Time (day)')
-  ax2.set_ylabel('Line')
-  ax2.minorticks_on()
-  ax3.set_xlabel('Time (day)')
-  ax3.set_ylabel('Line2')
-  ax3.minorticks_on()
-  fig.suptitle("Mock Data")
-  plt.show()
+  num_codes: number of datasets (codes).
+  num_points: number of points of each dataset, if None, use 80-180 points.
+  num_lines: number of emission lines.
+  num_objects: number of objects, each object is placed in data_dir/obj0000/, data_dir/obj0001/...
+               if larger than 1.
+  seed: seed of random numbers, for reproducible mocks.
+  data_dir: directory of output files, data_dir/sim_cont.txt, data_dir/sim_line.txt,
+            data_dir/sim_line2.txt, ...
+  plot: whether show the mock light curves.
+
+  return a dict of the input code, scale, shift, syserr, and error scale,
+  or a list of such dicts if num_objects > 1.
+  """
+  rng = np.random.default_rng(seed)
+  if num_objects == 1:
+    return _mock_object(rng, num_codes, num_points, num_lines, data_dir, plot)
 
+  res = []
+  for k in range(num_objects):
+    res.append(_mock_object(rng, num_codes, num_points, num_lines, os.path.join(data_dir, "obj%04d"%k), plot))
+  return res
 
 if __name__ == "__main__":
-  generate_mock_data()
\ No newline at end of file
+  generate_mock_data(plot=True)
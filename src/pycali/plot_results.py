@@ -8,6 +8,7 @@ import configparser as cfgpars
 from matplotlib.backends.backend_pdf import PdfPages
 from os.path import basename
 from matplotlib.ticker import MultipleLocator, FormatStrFormatter
+from .binary import read_binary
 
 def simple_plot(cfg):
   """
@@ -49,7 +50,7 @@ def plot_results(cfg):
   """
   pdf = PdfPages("PyCALI_results.pdf")
   
-  file_dir = "data"
+  file_dir = cfg.work_dir + "/data"
   file_dir += "/"
   #===================================================================
   # load params
@@ -104,7 +105,11 @@ def plot_results(cfg):
     line_mean_code = np.zeros(ncode)
     lines_mean_code["%d"%j] = lines_mean_code
   
-  sample = np.loadtxt(file_dir + "/posterior_sample.txt")
+  if cfg.binary_output:
+    # map the binary file, copy on write as sample is modified below
+    sample, _ = read_binary(file_dir + "/posterior_sample.bin", mode="c")
+  else:
+    sample = np.loadtxt(file_dir + "/posterior_sample.txt")
   # take into account continuum normalization
   sample[:, 0] += np.log(cont_mean[i]) 
   sample[:, 0] /= np.log(10.0)
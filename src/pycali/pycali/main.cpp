@@ -1,6 +1,8 @@
 #include <iostream>
 #include <fstream>
 #include <cstdlib>
+#include <cstring>
+#include <stdexcept>
 
 #include "utilities.hpp"
 
@@ -8,6 +10,9 @@ using namespace std;
 
 int main(int argc, char *argv[])
 {
+#ifdef USE_MPI
+  MPI_Init(&argc, &argv);
+#endif
   
   try
   {
@@ -22,14 +27,48 @@ int main(int argc, char *argv[])
     exit(1);
   }
 
+  /* "-r": resume from the checkpoint of a previous run */
+  bool resume = (argc >= 3 && strcmp(argv[2], "-r") == 0);
+
+  /* with MPI, each task samples its own particles on its own copy of Cali, 
+   * the root task writes the outputs */
+  bool root = (dnest_get_thistask() == 0);
+
   Config cfg(argv[1]);
-  cfg.print_cfg();
+  if(root)
+    cfg.print_cfg();
 
   Cali cali(cfg);
-  cali.mcmc();
-  cali.get_best_params();
-  cali.output();
-  cali.recon();
+  try
+  {
+    cali.mcmc(resume);
+  }
+  catch(const runtime_error& e)
+  {
+    cout<<e.what()<<endl;
+#ifdef USE_MPI
+    MPI_Finalize();
+#endif
+    exit(-1);
+  }
+  if(root)
+  {
+    try
+    {
+      cali.get_best_params();
+    }
+    catch(const runtime_error& e)
+    {
+      cout<<e.what()<<endl;
+      exit(-1);
+    }
+    cali.output();
+    cali.recon();
+    cali.save_profile();
+  }
 
+#ifdef USE_MPI
+  MPI_Finalize();
+#endif
   return EXIT_SUCCESS;
 }
\ No newline at end of file
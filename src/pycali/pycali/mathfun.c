@@ -370,13 +370,53 @@ void Chol_decomp_L(double *a, int n, int *info)
 void compute_semiseparable_drw(double *t, int n, double a1, double c1, double *sigma, double syserr, double *W, double *D, double *phi)
 {
   int i;
-  double S, A;
   phi[0] = 0.0;
   for(i=1; i<n; i++)
   {
     phi[i] = exp(-c1 * (t[i] - t[i-1]));
   }
 
+  compute_semiseparable_drw_phi(phi, n, a1, sigma, syserr, W, D);
+}
+/*
+ * phi of nk DRW models with damping rates c1[0..nk-1] at the same times t,
+ * phi[k*n + i] = exp(-c1[k] * (t[i] - t[i-1])).
+ *
+ * the time differences are computed once, and the exponentials of all models 
+ * run in one flat loop, which the compiler can vectorize.
+ */
+void compute_semiseparable_drw_phi_batch(double *t, int n, double *c1, int nk, double *phi)
+{
+  int i, k;
+  double *dt = phi + (size_t)(nk-1)*n; /* the last model's segment as a buffer */
+
+  for(i=1; i<n; i++)
+  {
+    dt[i] = t[i] - t[i-1];
+  }
+  for(k=0; k<nk; k++)
+  {
+    double *pk = phi + (size_t)k*n;
+    double ck = -c1[k];
+    pk[0] = 0.0;
+#ifdef _OPENMP
+    #pragma omp simd
+#endif
+    for(i=1; i<n; i++)
+    {
+      pk[i] = exp(ck * dt[i]);
+    }
+  }
+}
+/*
+ * W and D of the semiseparable DRW covariance with phi given, 
+ * see compute_semiseparable_drw().
+ */
+void compute_semiseparable_drw_phi(double *phi, int n, double a1, double *sigma, double syserr, double *W, double *D)
+{
+  int i;
+  double S, A;
+
   S = 0.0;
   A = sigma[0]*sigma[0] + syserr*syserr + a1;
   D[0] = A;
@@ -489,6 +529,166 @@ void multiply_mat_transposeB_semiseparable_drw(double *Y, double  *W, double *D,
   }
 }
 
+/*
+ * forward Kalman filter of a DRW process over the merged grid of data and query times.
+ *
+ * t, y, sigma: times, fluxes, and errors of data, n points, sorted in time.
+ * tq: query times, nq points, sorted in time; query points have no observations.
+ * a1: variance of DRW; c1: inverse of timescale.
+ * work: a buffer with a size at least 5*(n+nq), stores the predicted means and variances,
+ *       the filtered means and variances, and the transition factors at the merged grid.
+ *       on ties of times, the data point comes first.
+ */
+void filter_kalman_drw(double *t, double *y, double *sigma, int n, double syserr, double a1, double c1, 
+                       double *tq, int nq, double *work)
+{
+  int i, j, k, ntot = n + nq;
+  double *mp, *Pp, *mf, *Pf, *phi, tk, tprev, K;
+
+  mp = work;
+  Pp = mp + ntot;
+  mf = Pp + ntot;
+  Pf = mf + ntot;
+  phi = Pf + ntot;
+
+  i = j = 0;
+  tprev = 0.0;
+  for(k=0; k<ntot; k++)
+  {
+    if(j >= nq || (i < n && t[i] <= tq[j]))
+      tk = t[i];
+    else
+      tk = tq[j];
+
+    if(k == 0)
+    {
+      phi[k] = 0.0;
+      mp[k] = 0.0;
+      Pp[k] = a1;
+    }
+    else
+    {
+      phi[k] = exp(-c1 * (tk - tprev));
+      mp[k] = phi[k] * mf[k-1];
+      Pp[k] = phi[k]*phi[k] * Pf[k-1] + a1 * (1.0 - phi[k]*phi[k]);
+    }
+
+    if(j >= nq || (i < n && t[i] <= tq[j]))
+    {
+      K = Pp[k]/(Pp[k] + sigma[i]*sigma[i] + syserr*syserr);
+      mf[k] = mp[k] + K * (y[i] - mp[k]);
+      Pf[k] = (1.0 - K) * Pp[k];
+      i++;
+    }
+    else
+    {
+      mf[k] = mp[k];
+      Pf[k] = Pp[k];
+      j++;
+    }
+    tprev = tk;
+  }
+}
+
+/*
+ * reconstruction of a DRW process with a Kalman filter and a Rauch-Tung-Striebel smoother.
+ *
+ * t, y, sigma: times, fluxes, and errors of data, n points, sorted in time.
+ * tq: query times, nq points, sorted in time.
+ * a1: variance of DRW; c1: inverse of timescale.
+ * yq, vq: outputs, the conditional mean and variance at the query times.
+ * work: a buffer with a size at least 5*(n+nq).
+ *
+ * the data and query times are merged into a single grid, so the cost is O(n+nq).
+ * the results are the same as S x C^-1 x y and a1 - diag(S x C^-1 x S^T).
+ */
+void recon_kalman_drw(double *t, double *y, double *sigma, int n, double syserr, double a1, double c1, 
+                      double *tq, int nq, double *yq, double *vq, double *work)
+{
+  int i, j, k, ntot = n + nq;
+  double *mp, *Pp, *mf, *Pf, *phi, G, ms, Ps;
+
+  mp = work;
+  Pp = mp + ntot;
+  mf = Pp + ntot;
+  Pf = mf + ntot;
+  phi = Pf + ntot;
+
+  filter_kalman_drw(t, y, sigma, n, syserr, a1, c1, tq, nq, work);
+
+  /* backward smoother, on ties the query point comes later in the merged grid */
+  i = n-1;
+  j = nq-1;
+  ms = mf[ntot-1];
+  Ps = Pf[ntot-1];
+  for(k=ntot-1; k>=0; k--)
+  {
+    if(k < ntot-1)
+    {
+      G = Pf[k] * phi[k+1]/Pp[k+1];
+      ms = mf[k] + G * (ms - mp[k+1]);
+      Ps = Pf[k] + G*G * (Ps - Pp[k+1]);
+    }
+
+    if(j >= 0 && (i < 0 || tq[j] >= t[i]))
+    {
+      yq[j] = ms;
+      vq[j] = Ps;
+      j--;
+    }
+    else
+    {
+      i--;
+    }
+  }
+}
+
+/*
+ * draw a realization of a DRW process conditioned on data, by forward filtering 
+ * and backward sampling.
+ *
+ * arguments are the same as recon_kalman_drw(), except that 
+ * gauss: n+nq independent standard Gaussian random numbers.
+ * yq: output, the realization at the query times.
+ */
+void sample_kalman_drw(double *t, double *y, double *sigma, int n, double syserr, double a1, double c1, 
+                       double *tq, int nq, double *gauss, double *yq, double *work)
+{
+  int i, j, k, ntot = n + nq;
+  double *mp, *Pp, *mf, *Pf, *phi, G, x;
+
+  mp = work;
+  Pp = mp + ntot;
+  mf = Pp + ntot;
+  Pf = mf + ntot;
+  phi = Pf + ntot;
+
+  filter_kalman_drw(t, y, sigma, n, syserr, a1, c1, tq, nq, work);
+
+  /* backward sampling, on ties the query point comes later in the merged grid */
+  i = n-1;
+  j = nq-1;
+  x = mf[ntot-1] + sqrt(Pf[ntot-1]) * gauss[ntot-1];
+  for(k=ntot-1; k>=0; k--)
+  {
+    if(k < ntot-1)
+    {
+      G = Pf[k] * phi[k+1]/Pp[k+1];
+      x = mf[k] + G * (x - mp[k+1]) + sqrt(fmax(Pf[k] * (1.0 - G*phi[k+1]), 0.0)) * gauss[k];
+    }
+
+    if(j >= 0 && (i < 0 || tq[j] >= t[i]))
+    {
+      yq[j] = x;
+      j--;
+    }
+    else
+    {
+      i--;
+    }
+  }
+}
+
 /**
  *  calculate A^-1.
  * 
@@ -46,9 +46,17 @@ double ** matrix_malloc(int n1, int n2);
 double * array_malloc(int n);
 void test_mathfun();
 void compute_semiseparable_drw(double *t, int n, double a1, double c1, double *sigma, double syserr,  double *W, double *D, double *phi);
+void compute_semiseparable_drw_phi_batch(double *t, int n, double *c1, int nk, double *phi);
+void compute_semiseparable_drw_phi(double *phi, int n, double a1, double *sigma, double syserr, double *W, double *D);
 void multiply_matvec_semiseparable_drw(double *y, double  *W, double *D, double *phi, int n, double a1, double *z);
 void multiply_mat_semiseparable_drw(double *Y, double  *W, double *D, double *phi, int n, int m, double a1, double *Z);
 void multiply_mat_transposeB_semiseparable_drw(double *Y, double  *W, double *D, double *phi, int n, int m, double a1, double *Z);
+void filter_kalman_drw(double *t, double *y, double *sigma, int n, double syserr, double a1, double c1, 
+                       double *tq, int nq, double *work);
+void recon_kalman_drw(double *t, double *y, double *sigma, int n, double syserr, double a1, double c1, 
+                      double *tq, int nq, double *yq, double *vq, double *work);
+void sample_kalman_drw(double *t, double *y, double *sigma, int n, double syserr, double a1, double c1, 
+                       double *tq, int nq, double *gauss, double *yq, double *work);
 
 void inverse_semiseparable_uv(double *t, int n, double a1, double c1, double *A);
 
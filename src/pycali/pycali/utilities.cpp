@@ -6,10 +6,13 @@
 #include <string>
 #include <algorithm>
 #include <numeric>
+#include <stdexcept>
 #include <cblas.h>
 #include <float.h>
 #include <sys/stat.h>
-#include <gsl/gsl_histogram.h>
+#include <unistd.h>
+#include <gsl/gsl_rng.h>
+#include <gsl/gsl_randist.h>
 
 #include "utilities.hpp"
 #include "mathfun.h"
@@ -19,6 +22,7 @@ Config::Config()
 {
   nmcmc = 10000;
   ptol = 0.1;
+  num_threads = 1;
   scale_range_low = 0.5;
   scale_range_up = 1.5;
   shift_range_low = -1.0;
@@ -40,12 +44,28 @@ Config::Config()
   fcont = new char [256];
   strcpy(fcont, "\0");
   fline.clear();
+  work_dir = ".";
+  cache_dir = "";
+  binary_output = false;
+  sync_policy = 1;
+  stop_ess = 0.0;
+  stop_logz_tol = 0.1;
+  max_wall_time = 0.0;
+  seed = 0;
+  marg_shift = 0;
+  num_particles = new_level_interval = save_interval = thread_steps = max_num_levels = 0;
+  lambda = 10.0;
+  beta = 100.0;
+  auto_tune = 0;
+  recon_cadence = 0.0;
+  recon_time_low = recon_time_up = 0.0;
 }
 Config::Config(const string& fname)
       :fname(fname)
 {
   nmcmc = 10000;
   ptol = 0.1;
+  num_threads = 1;
   scale_range_low = 0.5;
   scale_range_up = 1.5;
   shift_range_low = -1.0;
@@ -67,6 +87,21 @@ Config::Config(const string& fname)
   fcont = new char [256];
   strcpy(fcont, "\0");
   fline.clear();
+  work_dir = ".";
+  cache_dir = "";
+  binary_output = false;
+  sync_policy = 1;
+  stop_ess = 0.0;
+  stop_logz_tol = 0.1;
+  max_wall_time = 0.0;
+  seed = 0;
+  marg_shift = 0;
+  num_particles = new_level_interval = save_interval = thread_steps = max_num_levels = 0;
+  lambda = 10.0;
+  beta = 100.0;
+  auto_tune = 0;
+  recon_cadence = 0.0;
+  recon_time_low = recon_time_up = 0.0;
 
   load(fname);
 }
@@ -78,7 +113,8 @@ Config::~Config()
 void Config::load(const string& fname)
 {
   ifstream fin;
-  char fbuf[256];
+  char fbuf[256], wbuf[256], cbuf[256];
+  int flag_binary;
 
   fin.open(fname);
   if(fin.fail())
@@ -87,7 +123,7 @@ void Config::load(const string& fname)
     exit(-1);
   }
 
-  #define MAXTAGS 30
+  #define MAXTAGS 50
   #define DOUBLE 1
   #define STRING 2
   #define INT 3
@@ -107,6 +143,14 @@ void Config::load(const string& fname)
   addr[nt] = fbuf;
   id[nt++] = STRING;
 
+  strcpy(tag[nt], "WorkDir");
+  addr[nt] = wbuf;
+  id[nt++] = STRING;
+
+  strcpy(tag[nt], "CacheDir");
+  addr[nt] = cbuf;
+  id[nt++] = STRING;
+
   strcpy(tag[nt], "NMcmc");
   addr[nt] = &nmcmc;
   id[nt++] = INT;
@@ -115,6 +159,74 @@ void Config::load(const string& fname)
   addr[nt] = &ptol;
   id[nt++] = DOUBLE;
 
+  strcpy(tag[nt], "NumThreads");
+  addr[nt] = &num_threads;
+  id[nt++] = INT;
+
+  strcpy(tag[nt], "SyncPolicy");
+  addr[nt] = &sync_policy;
+  id[nt++] = INT;
+
+  strcpy(tag[nt], "StopESS");
+  addr[nt] = &stop_ess;
+  id[nt++] = DOUBLE;
+
+  strcpy(tag[nt], "StopLogZTol");
+  addr[nt] = &stop_logz_tol;
+  id[nt++] = DOUBLE;
+
+  strcpy(tag[nt], "MaxWallTime");
+  addr[nt] = &max_wall_time;
+  id[nt++] = DOUBLE;
+
+  strcpy(tag[nt], "Seed");
+  addr[nt] = &seed;
+  id[nt++] = INT;
+
+  strcpy(tag[nt], "NumParticles");
+  addr[nt] = &num_particles;
+  id[nt++] = INT;
+
+  strcpy(tag[nt], "NewLevelInterval");
+  addr[nt] = &new_level_interval;
+  id[nt++] = INT;
+
+  strcpy(tag[nt], "SaveInterval");
+  addr[nt] = &save_interval;
+  id[nt++] = INT;
+
+  strcpy(tag[nt], "ThreadSteps");
+  addr[nt] = &thread_steps;
+  id[nt++] = INT;
+
+  strcpy(tag[nt], "MaxNumLevels");
+  addr[nt] = &max_num_levels;
+  id[nt++] = INT;
+
+  strcpy(tag[nt], "Lambda");
+  addr[nt] = &lambda;
+  id[nt++] = DOUBLE;
+
+  strcpy(tag[nt], "Beta");
+  addr[nt] = &beta;
+  id[nt++] = DOUBLE;
+
+  strcpy(tag[nt], "AutoTune");
+  addr[nt] = &auto_tune;
+  id[nt++] = INT;
+
+  strcpy(tag[nt], "ReconCadence");
+  addr[nt] = &recon_cadence;
+  id[nt++] = DOUBLE;
+
+  strcpy(tag[nt], "ReconTimeLow");
+  addr[nt] = &recon_time_low;
+  id[nt++] = DOUBLE;
+
+  strcpy(tag[nt], "ReconTimeUp");
+  addr[nt] = &recon_time_up;
+  id[nt++] = DOUBLE;
+
   strcpy(tag[nt], "ScaleRangeLow");
   addr[nt] = &scale_range_low;
   id[nt++] = DOUBLE;
@@ -171,6 +283,10 @@ void Config::load(const string& fname)
   addr[nt] = &fixed_shift;
   id[nt++] = INT;
 
+  strcpy(tag[nt], "MargShift");
+  addr[nt] = &marg_shift;
+  id[nt++] = INT;
+
   strcpy(tag[nt], "FixedSyserr");
   addr[nt] = &fixed_syserr;
   id[nt++] = INT;
@@ -179,8 +295,15 @@ void Config::load(const string& fname)
   addr[nt] = &fixed_error_scale;
   id[nt++] = INT;
 
+  strcpy(tag[nt], "BinaryOutput");
+  addr[nt] = &flag_binary;
+  id[nt++] = INT;
+
   // default values 
   strcpy(fbuf,"\0");
+  strcpy(wbuf, work_dir.c_str());
+  strcpy(cbuf, cache_dir.c_str());
+  flag_binary = binary_output;
 
   while(!fin.eof())
   {
@@ -269,10 +392,51 @@ void Config::load(const string& fname)
     cout<<"Better not to fix both Scale and Shift parameters."<<endl;
     exit(-1);
   }
+
+  if(sync_policy < 0 || sync_policy > 2)
+  {
+    cout<<"Incorrect settings in SyncPolicy."<<endl;
+    exit(-1);
+  }
+
+  if(seed < 0)
+  {
+    cout<<"Incorrect settings in Seed."<<endl;
+    exit(-1);
+  }
+
+  if(stop_ess < 0.0 || stop_logz_tol <= 0.0 || max_wall_time < 0.0)
+  {
+    cout<<"Incorrect settings in StopESS, StopLogZTol, and MaxWallTime."<<endl;
+    exit(-1);
+  }
+
+  if(stop_ess > 0.0 && stop_ess < POSTERIOR_SAMPLE_MIN)
+  {
+    cout<<"StopESS should be 0 or not less than "<<POSTERIOR_SAMPLE_MIN<<"."<<endl;
+    exit(-1);
+  }
+
+  if(num_particles < 0 || new_level_interval < 0 || save_interval < 0 || thread_steps < 0 
+     || max_num_levels < 0 || max_num_levels > LEVEL_NUM_MAX || lambda <= 0.0 || beta < 0.0)
+  {
+    cout<<"Incorrect settings in NumParticles, NewLevelInterval, SaveInterval, ThreadSteps, "
+        <<"MaxNumLevels, Lambda, and Beta."<<endl;
+    exit(-1);
+  }
+
+  if(recon_cadence < 0.0 || recon_time_low > recon_time_up)
+  {
+    cout<<"Incorrect settings in ReconCadence, ReconTimeLow, and ReconTimeUp."<<endl;
+    exit(-1);
+  }
   fin.close();
 
   /* parse fline string */
   parse_fline_str(fbuf);
+  work_dir = wbuf;
+  cache_dir = cbuf;
+  binary_output = (flag_binary != 0);
 }
 
 void Config::parse_fline_str(const string& fline_str)
@@ -327,9 +491,11 @@ void Config::setup(const string& fcont_in, const list<string>& fline_in,
              double sigma_range_low_in, double sigma_range_up_in,
              double tau_range_low_in, double tau_range_up_in,
              bool fixed_scale_in, bool fixed_shift_in,
-             bool fixed_syserr_in, bool fixed_error_scale_in)
+             bool fixed_syserr_in, bool fixed_error_scale_in,
+             const string& work_dir_in)
 {
   strcpy(fcont, fcont_in.c_str());
+  work_dir = work_dir_in;
   fline=fline_in;
   nmcmc = nmcmc_in;
   ptol = ptol_in;
@@ -351,11 +517,7 @@ void Config::setup(const string& fcont_in, const list<string>& fline_in,
   fixed_syserr = fixed_syserr_in;
   fixed_error_scale = fixed_error_scale_in;
 
-  if(strlen(fcont) == 0)
-  {
-    cout<<"fcont is empty."<<endl;
-    exit(-1);
-  }
+  /* fcont can be empty if light curves are given as arrays */
 
   if(scale_range_low >= scale_range_up)
   {
@@ -387,6 +549,12 @@ void Config::setup(const string& fcont_in, const list<string>& fline_in,
     exit(-1);
   }
 
+  if(stop_ess > 0.0 && stop_ess < POSTERIOR_SAMPLE_MIN)
+  {
+    cout<<"StopESS should be 0 or not less than "<<POSTERIOR_SAMPLE_MIN<<"."<<endl;
+    exit(-1);
+  }
+
   fname.clear();
 }
 
@@ -415,7 +583,10 @@ void Config::print_cfg()
       cout<<","<<*it;
     cout<<endl;
   }
+  cout<<setw(20)<<"work_dir: "<<work_dir<<endl;
+  cout<<setw(20)<<"cache_dir: "<<cache_dir<<endl;
   cout<<setw(20)<<"nmcmc: "<<nmcmc<<endl;
+  cout<<setw(20)<<"num_threads: "<<num_threads<<endl;
   cout<<setw(20)<<"scale_range_low: "<<scale_range_low<<endl;
   cout<<setw(20)<<"scale_range_up: "<<scale_range_up<<endl;
   cout<<setw(20)<<"shift_range_low: "<<shift_range_low<<endl;
@@ -430,12 +601,31 @@ void Config::print_cfg()
   cout<<setw(20)<<"tau_range_up: "<<tau_range_up<<endl;
   cout<<setw(20)<<"fixed_scale: "<<fixed_scale<<endl;
   cout<<setw(20)<<"fixed_shift: "<<fixed_shift<<endl;
+  cout<<setw(20)<<"marg_shift: "<<marg_shift<<endl;
   cout<<setw(20)<<"fixed_syserr: "<<fixed_syserr<<endl;
   cout<<setw(20)<<"fixed_error_scale: "<<fixed_error_scale<<endl;
+  cout<<setw(20)<<"binary_output: "<<binary_output<<endl;
+  cout<<setw(20)<<"sync_policy: "<<sync_policy<<endl;
+  cout<<setw(20)<<"stop_ess: "<<stop_ess<<endl;
+  cout<<setw(20)<<"stop_logz_tol: "<<stop_logz_tol<<endl;
+  cout<<setw(20)<<"max_wall_time: "<<max_wall_time<<endl;
+  cout<<setw(20)<<"seed: "<<seed<<endl;
+  cout<<setw(20)<<"num_particles: "<<num_particles<<endl;
+  cout<<setw(20)<<"new_level_interval: "<<new_level_interval<<endl;
+  cout<<setw(20)<<"save_interval: "<<save_interval<<endl;
+  cout<<setw(20)<<"thread_steps: "<<thread_steps<<endl;
+  cout<<setw(20)<<"max_num_levels: "<<max_num_levels<<endl;
+  cout<<setw(20)<<"lambda: "<<lambda<<endl;
+  cout<<setw(20)<<"beta: "<<beta<<endl;
+  cout<<setw(20)<<"auto_tune: "<<auto_tune<<endl;
+  cout<<setw(20)<<"recon_cadence: "<<recon_cadence<<endl;
+  cout<<setw(20)<<"recon_time_low: "<<recon_time_low<<endl;
+  cout<<setw(20)<<"recon_time_up: "<<recon_time_up<<endl;
   cout<<"================================"<<endl;
 
   ofstream fout;
-  fout.open("data/param_input");
+  check_work_dir(work_dir);
+  fout.open(work_dir + "/data/param_input");
   fout<<setw(20)<<left<<"fname"<<" = "<<fname<<endl;
   fout<<setw(20)<<left<<"fcont"<<" = "<<fcont<<endl;
   if(fline.empty())
@@ -451,7 +641,10 @@ void Config::print_cfg()
       fout<<","<<*it;
     fout<<endl;
   }
+  fout<<setw(20)<<left<<"work_dir"<<" = "<<work_dir<<endl;
+  fout<<setw(20)<<left<<"cache_dir"<<" = "<<cache_dir<<endl;
   fout<<setw(20)<<left<<"nmcmc"<<" = "<<nmcmc<<endl;
+  fout<<setw(20)<<left<<"num_threads"<<" = "<<num_threads<<endl;
   fout<<setw(20)<<left<<"scale_range_low"<<" = "<<scale_range_low<<endl;
   fout<<setw(20)<<left<<"scale_range_up"<<" = "<<scale_range_up<<endl;
   fout<<setw(20)<<left<<"shift_range_low"<<" = "<<shift_range_low<<endl;
@@ -466,8 +659,26 @@ void Config::print_cfg()
   fout<<setw(20)<<left<<"tau_range_up"<<" = "<<tau_range_up<<endl;
   fout<<setw(20)<<left<<"fixed_scale"<<" = "<<fixed_scale<<endl;
   fout<<setw(20)<<left<<"fixed_shift"<<" = "<<fixed_shift<<endl;
+  fout<<setw(20)<<left<<"marg_shift"<<" = "<<marg_shift<<endl;
   fout<<setw(20)<<left<<"fixed_syserr"<<" = "<<fixed_syserr<<endl;
   fout<<setw(20)<<left<<"fixed_error_scale"<<" = "<<fixed_error_scale<<endl;
+  fout<<setw(20)<<left<<"binary_output"<<" = "<<binary_output<<endl;
+  fout<<setw(20)<<left<<"sync_policy"<<" = "<<sync_policy<<endl;
+  fout<<setw(20)<<left<<"stop_ess"<<" = "<<stop_ess<<endl;
+  fout<<setw(20)<<left<<"stop_logz_tol"<<" = "<<stop_logz_tol<<endl;
+  fout<<setw(20)<<left<<"max_wall_time"<<" = "<<max_wall_time<<endl;
+  fout<<setw(20)<<left<<"seed"<<" = "<<seed<<endl;
+  fout<<setw(20)<<left<<"num_particles"<<" = "<<num_particles<<endl;
+  fout<<setw(20)<<left<<"new_level_interval"<<" = "<<new_level_interval<<endl;
+  fout<<setw(20)<<left<<"save_interval"<<" = "<<save_interval<<endl;
+  fout<<setw(20)<<left<<"thread_steps"<<" = "<<thread_steps<<endl;
+  fout<<setw(20)<<left<<"max_num_levels"<<" = "<<max_num_levels<<endl;
+  fout<<setw(20)<<left<<"lambda"<<" = "<<lambda<<endl;
+  fout<<setw(20)<<left<<"beta"<<" = "<<beta<<endl;
+  fout<<setw(20)<<left<<"auto_tune"<<" = "<<auto_tune<<endl;
+  fout<<setw(20)<<left<<"recon_cadence"<<" = "<<recon_cadence<<endl;
+  fout<<setw(20)<<left<<"recon_time_low"<<" = "<<recon_time_low<<endl;
+  fout<<setw(20)<<left<<"recon_time_up"<<" = "<<recon_time_up<<endl;
   fout.close();
 }
 
@@ -503,9 +714,15 @@ Data::Data()
 {
 }
 
-Data::Data(const string& fname)
+Data::Data(const string& fname, const string& cache_dir)
 {
-  load(fname);
+  load(fname, cache_dir);
+}
+
+Data::Data(const double *t, const double *f, const double *e, const int *c, size_t n, 
+           const vector<string>& code_list_in)
+{
+  load(t, f, e, c, n, code_list_in);
 }
 
 Data::~Data()
@@ -522,7 +739,14 @@ Data::~Data()
   code_list.clear();
 }
 
-void Data::load(const string& fname)
+/* 
+ * load data from a text file. 
+ * the whole file is read at once and parsed in place with strtod.
+ * if cache_dir is not empty, the normalized and sorted data are cached in a binary file 
+ * named after the hash of the file content, so that the next loading of the same file 
+ * skips the parsing and sorting.
+ */
+void Data::load(const string& fname, const string& cache_dir)
 {
   /* first clear all vectors */
   flux_org.clear();
@@ -537,88 +761,360 @@ void Data::load(const string& fname)
   code_list.clear();
 
   /* now read data */
-  fstream fin;
-  string line;
-  stringstream ss;
+  FILE *fp;
+  char *buf;
+  size_t size;
 
-  fin.open(fname);
-  if(fin.fail())
+  fp = fopen(fname.c_str(), "rb");
+  if(fp == NULL)
   {
     cout<<"cannot open file "<<fname<<endl;
     exit(-1);
   }
   cout<<fname<<endl;
 
+  fseek(fp, 0, SEEK_END);
+  size = ftell(fp);
+  fseek(fp, 0, SEEK_SET);
+  buf = new char[size+1];
+  if(fread(buf, 1, size, fp) != size)
+  {
+    cout<<"# Wrong in reading "<<fname<<endl;
+    exit(-1);
+  }
+  buf[size] = '\0';
+  fclose(fp);
+
+  unsigned long long int hash = 0;
+  string fcache;
+  if(!cache_dir.empty())
+  {
+    char str[64];
+    hash = hash_content(buf, size);
+    sprintf(str, "/lc_%016llx.bin", hash);
+    fcache = cache_dir + str;
+    if(load_cache(fcache, hash))
+    {
+      delete[] buf;
+      cout<<"  loaded from cache "<<fcache<<endl;
+      print_info();
+      return;
+    }
+  }
+
+  parse(buf, size, fname);
+  delete[] buf;
+  print_info();
+
+  normalize();
+  sort_data();
+
+  if(!cache_dir.empty())
+  {
+    save_cache(fcache, hash);
+  }
+  return;
+}
+
+/* 
+ * parse the content of a data file, each dataset starts with a line "# code num", 
+ * followed by num lines of "time flux error". a blank line ends the parsing.
+ */
+void Data::parse(char *buf, size_t size, const string& fname)
+{
+  char *p, *q, *eol, *end = buf + size;
   int j, num;
-  int idx, idx_str;
-  double t, f, e, mean;
-  string cstr;
-  
-  idx = 0;
-  while(1)
+  double mean;
+
+  p = buf;
+  while(p < end)
   {
-    getline(fin, line);
-    if(fin.fail())
-      break;
-    idx_str = line.find_first_not_of(WhiteSpace);
-    if(idx_str>=line.size())
+    eol = (char *)memchr(p, '\n', end-p);
+    if(eol == NULL)
+      eol = end;
+
+    q = p + strspn(p, WhiteSpace);
+    if(q >= eol)
       break;
-    if(line[0]!='#')
+    if(p[0] != '#')
     {
       cout<<"Incorrect line format in "<<fname<<endl;
       exit(-1);
     }
 
-    line.erase(0, 1);  /* skip the first charactor '#' */
-    idx_str = line.find_first_not_of(WhiteSpace);
-    line.erase(0, idx_str);  /* skip the left white spaces */
-
-    idx_str = line.find_first_of(WhiteSpace); /* extract the code string */
-    cstr = line.substr(0, idx_str);
-    code_list.push_back(cstr);
-
-    line.erase(0, idx_str); /* extract the number */
-    num = stoi(line);
+    /* extract the code string and the number */
+    q = p + 1;
+    q += strspn(q, WhiteSpace);
+    p = q + strcspn(q, WhiteSpace "\n");
+    code_list.push_back(string(q, p));
+    num = strtol(p, &q, 10);
+    if(q == p || q > eol || num < 0)
+    {
+      cout<<"# Wrong in reading "<<fname<<endl;
+      exit(-1);
+    }
     num_code.push_back(num);
-    cout<<"  "<<code_list[idx]<<"   "<<num_code[idx]<<endl;
+
     mean = 0.0;
-    for(j=0; j<num_code[idx]; j++)
+    for(j=0; j<num; j++)
     {
-      getline(fin, line);
-      if(fin.fail())
+      p = eol + 1;
+      if(p >= end)
       {
         cout<<"# Wrong in reading "<<fname<<endl;
         exit(-1);
       }
+      eol = (char *)memchr(p, '\n', end-p);
+      if(eol == NULL)
+        eol = end;
 
-      ss.str(line);
-      ss>>t>>f>>e;
-      if(ss.fail())
+      /* strtod skips leading white spaces, make sure not to go beyond the line */
+      time.push_back(strtod(p, &q));
+      if(q == p || q > eol)
+      {
+        cout<<"# Wrong in reading "<<fname<<endl;
+        exit(-1);
+      }
+      flux_org.push_back(strtod(q, &p));
+      if(p == q || p > eol)
+      {
+        cout<<"# Wrong in reading "<<fname<<endl;
+        exit(-1);
+      }
+      error_org.push_back(strtod(p, &q));
+      if(q == p || q > eol)
       {
         cout<<"# Wrong in reading "<<fname<<endl;
         exit(-1);
       }
-        
-      time.push_back(t);
-      flux_org.push_back(f);
-      error_org.push_back(e);
-      code.push_back(idx);
-      ss.clear();
+      code.push_back(code_list.size()-1);
 
-      mean += f;
+      mean += flux_org.back();
     }
     mean /= num;
     mean_code.push_back(mean);
-    idx++;
+    p = eol + 1;
   }
-  if(idx==0)
+  if(code_list.size()==0)
   {
     cout<<"Error: an empty file "<<fname<<endl;
     exit(-1);
   }
+}
+
+void Data::print_info()
+{
+  int i;
+  for(i=0; i<code_list.size(); i++)
+  {
+    cout<<"  "<<code_list[i]<<"   "<<num_code[i]<<endl;
+  }
+  cout<<"  "<<time.size()<<" points, "<<code_list.size()<<" codes."<<endl;
+  cout<<"================================"<<endl;
+}
+
+/* 
+ * 64-bit FNV-1a hash of the file content, used as the key of the cache.
+ */
+unsigned long long int Data::hash_content(const char *buf, size_t size)
+{
+  unsigned long long int hash = 14695981039346656037ULL;
+  size_t i;
+  for(i=0; i<size; i++)
+  {
+    hash ^= (unsigned char)buf[i];
+    hash *= 1099511628211ULL;
+  }
+  return hash;
+}
+
+/*
+ * binary cache of normalized and sorted data, the layout is
+ * magic (8 bytes), version, number of points, number of codes, hash, norm, 
+ * time, flux_org, error_org, code, index, num_code, mean_code, and code_list 
+ * (length followed by characters of each code).
+ */
+bool Data::load_cache(const string& fcache, unsigned long long int hash)
+{
+  FILE *fp;
+  char magic[8];
+  int version, ncode, len, i;
+  long long int n;
+  unsigned long long int hash_file;
+  char str[256];
+  bool flag;
+
+  fp = fopen(fcache.c_str(), "rb");
+  if(fp == NULL)
+    return false;
+  
+  flag = (fread(magic, 1, 8, fp) == 8 && memcmp(magic, DATA_CACHE_MAGIC, 8) == 0)
+      && (fread(&version, sizeof(int), 1, fp) == 1 && version == DATA_CACHE_VERSION)
+      && (fread(&n, sizeof(long long int), 1, fp) == 1 && n > 0)
+      && (fread(&ncode, sizeof(int), 1, fp) == 1 && ncode > 0)
+      && (fread(&hash_file, sizeof(unsigned long long int), 1, fp) == 1 && hash_file == hash)
+      && (fread(&norm, sizeof(double), 1, fp) == 1);
+  if(flag)
+  {
+    time.resize(n);
+    flux_org.resize(n);
+    error_org.resize(n);
+    code.resize(n);
+    index.resize(n);
+    num_code.resize(ncode);
+    mean_code.resize(ncode);
+    flag = fread(time.data(), sizeof(double), n, fp) == n
+        && fread(flux_org.data(), sizeof(double), n, fp) == n
+        && fread(error_org.data(), sizeof(double), n, fp) == n
+        && fread(code.data(), sizeof(int), n, fp) == n
+        && fread(index.data(), sizeof(int), n, fp) == n
+        && fread(num_code.data(), sizeof(int), ncode, fp) == ncode
+        && fread(mean_code.data(), sizeof(double), ncode, fp) == ncode;
+  }
+  for(i=0; flag && i<ncode; i++)
+  {
+    flag = fread(&len, sizeof(int), 1, fp) == 1 && len >= 0 && len < 256
+        && fread(str, 1, len, fp) == len;
+    if(flag)
+      code_list.push_back(string(str, len));
+  }
+  fclose(fp);
+
+  if(!flag)
+  {
+    cout<<"# Invalid cache "<<fcache<<", ignored."<<endl;
+    time.clear();
+    flux_org.clear();
+    error_org.clear();
+    code.clear();
+    index.clear();
+    num_code.clear();
+    mean_code.clear();
+    code_list.clear();
+    return false;
+  }
+
+  /* flux and error as left by sort_data() */
+  flux.resize(n);
+  error.resize(n);
+  for(i=0; i<n; i++)
+  {
+    flux[index[i]] = flux_org[i];
+    error[index[i]] = error_org[i];
+  }
+  return true;
+}
+
+void Data::save_cache(const string& fcache, unsigned long long int hash)
+{
+  FILE *fp;
+  int version = DATA_CACHE_VERSION, ncode = code_list.size(), len, i;
+  long long int n = time.size();
+  string ftmp = fcache + ".tmp" + to_string(getpid()); /* unique for processes loading the same data */
+  
+  mkdir(fcache.substr(0, fcache.find_last_of('/')).c_str(), 0755);
+  fp = fopen(ftmp.c_str(), "wb");
+  if(fp == NULL)
+  {
+    cout<<"# Cannot write cache "<<fcache<<", ignored."<<endl;
+    return;
+  }
+  fwrite(DATA_CACHE_MAGIC, 1, 8, fp);
+  fwrite(&version, sizeof(int), 1, fp);
+  fwrite(&n, sizeof(long long int), 1, fp);
+  fwrite(&ncode, sizeof(int), 1, fp);
+  fwrite(&hash, sizeof(unsigned long long int), 1, fp);
+  fwrite(&norm, sizeof(double), 1, fp);
+  fwrite(time.data(), sizeof(double), n, fp);
+  fwrite(flux_org.data(), sizeof(double), n, fp);
+  fwrite(error_org.data(), sizeof(double), n, fp);
+  fwrite(code.data(), sizeof(int), n, fp);
+  fwrite(index.data(), sizeof(int), n, fp);
+  fwrite(num_code.data(), sizeof(int), ncode, fp);
+  fwrite(mean_code.data(), sizeof(double), ncode, fp);
+  for(i=0; i<ncode; i++)
+  {
+    len = code_list[i].size();
+    fwrite(&len, sizeof(int), 1, fp);
+    fwrite(code_list[i].data(), 1, len, fp);
+  }
+  
+  /* write to a temporary file first so that an interrupted writing leaves no broken cache */
+  if(fclose(fp) != 0 || rename(ftmp.c_str(), fcache.c_str()) != 0)
+  {
+    cout<<"# Cannot write cache "<<fcache<<", ignored."<<endl;
+    remove(ftmp.c_str());
+  }
+}
+
+/* 
+ * load data from arrays, c are the indices of codes (0, 1, 2...) and code 0 is the reference.
+ * code_list_in are the names of codes, if empty, "0", "1", "2"... are used.
+ */
+void Data::load(const double *t, const double *f, const double *e, const int *c, size_t n, 
+                const vector<string>& code_list_in)
+{
+  size_t i;
+  int nc;
+  char str[32];
+
+  if(n == 0)
+  {
+    cout<<"Error: empty data."<<endl;
+    exit(-1);
+  }
+
+  nc = 0;
+  for(i=0; i<n; i++)
+  {
+    if(c[i] < 0)
+    {
+      cout<<"Error: negative code index "<<c[i]<<"."<<endl;
+      exit(-1);
+    }
+    nc = max(nc, c[i]+1);
+  }
+  if(!code_list_in.empty())
+  {
+    if((int)code_list_in.size() < nc)
+    {
+      cout<<"Error: code index "<<nc-1<<" exceeds the number of codes "<<code_list_in.size()<<"."<<endl;
+      exit(-1);
+    }
+    nc = code_list_in.size();
+  }
+
+  time.assign(t, t+n);
+  flux_org.assign(f, f+n);
+  error_org.assign(e, e+n);
+  code.assign(c, c+n);
+  flux.clear();
+  error.clear();
+
+  num_code.assign(nc, 0);
+  mean_code.assign(nc, 0.0);
+  for(i=0; i<n; i++)
+  {
+    num_code[code[i]]++;
+    mean_code[code[i]] += flux_org[i];
+  }
+  code_list.clear();
+  for(i=0; i<nc; i++)
+  {
+    mean_code[i] /= num_code[i];
+    if(code_list_in.empty())
+    {
+      sprintf(str, "%d", (int)i);
+      code_list.push_back(str);
+    }
+    else 
+    {
+      code_list.push_back(code_list_in[i]);
+    }
+    cout<<"  "<<code_list[i]<<"   "<<num_code[i]<<endl;
+  }
   cout<<"  "<<time.size()<<" points, "<<code_list.size()<<" codes."<<endl;
   cout<<"================================"<<endl;
-  fin.close();
 
   normalize();
   sort_data();
@@ -644,6 +1140,12 @@ void Data::sort_data()
 
   index.resize(time.size());
   iota(index.begin(), index.end(), 0);
+  if(is_sorted(time.begin(), time.end()))
+  {
+    flux = flux_org;
+    error = error_org;
+    return;
+  }
   stable_sort(index.begin(), index.end(), [&](size_t i1, size_t i2) {return time[i1] < time[i2];});
   
   time_tmp = time;
@@ -683,6 +1185,10 @@ void Data::check_code(Data& data)
 /*=====================================================*/
 /* class for calibration */
 Cali::Cali()
+     :work_dir("."), binary_output(false), sync_policy(1),
+      stop_ess(0.0), stop_logz_tol(0.1), max_wall_time(0.0), seed(0), marg_shift(0),
+      num_particles_opt(0), new_level_interval(0), save_interval(0), thread_steps(0), max_num_levels(0),
+      lambda(10.0), beta(100.0), auto_tune(0)
 {
   check_directory();
 
@@ -700,14 +1206,101 @@ Cali::Cali()
 
   workspace = NULL;
   Larr_data = NULL;
+  Larr_cont = NULL;
+  code_marg = NULL;
+  nq_cont = 1;
+  num_params_free = 0;
+  idx_free = pos_free = NULL;
+  model_full = NULL;
+  step_last = NULL;
+  step_pair = NULL;
+  step_covar = NULL;
+  num_threads = 1;
+
+  num_ps = 0;
+  posterior_sample = NULL;
+  posterior_sample_info = NULL;
+
+  num_particles = 0;
+  prob_cont_particles = prob_cont_particles_perturb = NULL;
+  prob_line_particles = prob_line_particles_perturb = NULL;
+  update_cont = update_line = NULL;
+
+  prof_time = NULL;
+  prof_count = NULL;
+
+  fptrset = NULL;
+  sampler = dnest_malloc_context();
 }
 
 Cali::Cali(Config& cfg)
-     :fcont(cfg.fcont), fline(cfg.fline), cont(cfg.fcont),
-      nmcmc(cfg.nmcmc), ptol(cfg.ptol)
+     :fcont(cfg.fcont), fline(cfg.fline), cont(cfg.fcont, cfg.cache_dir),
+      nmcmc(cfg.nmcmc), ptol(cfg.ptol), num_threads(cfg.num_threads), work_dir(cfg.work_dir),
+      binary_output(cfg.binary_output), sync_policy(cfg.sync_policy),
+      stop_ess(cfg.stop_ess), stop_logz_tol(cfg.stop_logz_tol), max_wall_time(cfg.max_wall_time), 
+      seed(cfg.seed), marg_shift(cfg.marg_shift),
+      num_particles_opt(cfg.num_particles), new_level_interval(cfg.new_level_interval), 
+      save_interval(cfg.save_interval), thread_steps(cfg.thread_steps), max_num_levels(cfg.max_num_levels),
+      lambda(cfg.lambda), beta(cfg.beta), auto_tune(cfg.auto_tune)
+{
+  if(!fline.empty())
+  {
+    list<string>::iterator it; 
+    for(it=fline.begin(); it!=fline.end(); ++it)
+    {
+      lines.push_back(Data());
+      lines.back().load(*it, cfg.cache_dir);
+    }
+  }
+  initialize(cfg);
+}
+
+/* 
+ * calibration of light curves given in memory (e.g., numpy arrays from python).
+ * cfg.fcont and cfg.fline are only used as the names of output files, 
+ * if not set, work_dir/data/cont.txt and work_dir/data/line0.txt, line1.txt... are used.
+ */
+Cali::Cali(Config& cfg, const Data& cont_in, const list<Data>& lines_in)
+     :fcont(cfg.fcont), fline(cfg.fline), cont(cont_in), lines(lines_in),
+      nmcmc(cfg.nmcmc), ptol(cfg.ptol), num_threads(cfg.num_threads), work_dir(cfg.work_dir),
+      binary_output(cfg.binary_output), sync_policy(cfg.sync_policy),
+      stop_ess(cfg.stop_ess), stop_logz_tol(cfg.stop_logz_tol), max_wall_time(cfg.max_wall_time), 
+      seed(cfg.seed), marg_shift(cfg.marg_shift),
+      num_particles_opt(cfg.num_particles), new_level_interval(cfg.new_level_interval), 
+      save_interval(cfg.save_interval), thread_steps(cfg.thread_steps), max_num_levels(cfg.max_num_levels),
+      lambda(cfg.lambda), beta(cfg.beta), auto_tune(cfg.auto_tune)
+{
+  if(cont.time.empty())
+  {
+    cout<<"Error: empty continuum data."<<endl;
+    exit(-1);
+  }
+
+  if(fcont.empty())
+  {
+    fcont = work_dir + "/data/cont.txt";
+  }
+
+  if(fline.size() != lines.size())
+  {
+    int il;
+    char str[32];
+    fline.clear();
+    for(il=0; il<lines.size(); il++)
+    {
+      sprintf(str, "/data/line%d.txt", il);
+      fline.push_back(work_dir + str);
+    }
+  }
+  initialize(cfg);
+}
+
+/*
+ * set up parameters, priors, and workspaces once cont and lines are loaded.
+ */
+void Cali::initialize(Config& cfg)
 {
   int i, j, m;
-  bool isfixed;
   
   check_directory();
 
@@ -716,11 +1309,10 @@ Cali::Cali(Config& cfg)
   ncode = cont.code_list.size();
   if(!fline.empty())
   {
-    Data line;
-    list<string>::iterator it; 
-    for(it=fline.begin(); it!=fline.end(); ++it)
+    list<Data>::iterator it; 
+    for(it=lines.begin(); it!=lines.end(); ++it)
     {
-      line.load(*it);
+      Data& line = *it;
       size_max = fmax(size_max, line.time.size());
       ncode = fmax(ncode, line.code_list.size());
       num_params_var += 2;
@@ -738,7 +1330,6 @@ Cali::Cali(Config& cfg)
       {
         line.mean_code[i] *= (line.mean_code[i]/line.mean_code[0]) * (cont.mean_code[0]/cont.mean_code[i]);
       }
-      lines.push_back(line);
     }
   }
   /* variability, scale, shift, syserr, error scale */
@@ -990,43 +1581,127 @@ Cali::Cali(Config& cfg)
     }
   }
 
-  workspace = new double[10*size_max];
-  Larr_data = new double[size_max];
-  for(i=0; i<size_max; i++)
-    Larr_data[i] = 1.0;
-  
-  fptrset = dnest_malloc_fptrset();
-  fptrset->from_prior = from_prior_cali;
-  fptrset->perturb = perturb_cali;
-  fptrset->print_particle = print_particle_cali;
-  fptrset->log_likelihoods_cal = prob_cali;
+  /* shifts of the continuum marginalized analytically as offsets of the mean, see prob_drw(). 
+   * column 0 of Larr_cont is the mean, column k the offset of code code_marg[k] */
+  code_marg = new int [ncode];
+  code_marg[0] = -1;
+  nq_cont = 1;
+  if(marg_shift)
+  {
+    int nfix = cont.num_code[0];
+    for(i=1; i<ncode; i++)
+    {
+      if(par_fix[num_params_var+i+ncode] == NOFIXED && cont.num_code[i] > 0)
+        code_marg[nq_cont++] = i;
+      else 
+        nfix += cont.num_code[i];
+    }
+    /* the mean and offsets are degenerate if all points have an offset */
+    if(nfix == 0 && nq_cont > 1)
+      nq_cont--;
 
+    for(m=1; m<nq_cont; m++)
+    {
+      par_fix[num_params_var+code_marg[m]+ncode] = FIXED;
+      par_fix_val[num_params_var+code_marg[m]+ncode] = 0.0;
+    }
+    cout<<"# Marginalize shifts of "<<nq_cont-1<<" codes analytically."<<endl;
+  }
+  Larr_cont = new double[cont.time.size()*nq_cont];
+  for(i=0; i<cont.time.size(); i++)
+  {
+    Larr_cont[i*nq_cont] = 1.0;
+    for(m=1; m<nq_cont; m++)
+      Larr_cont[i*nq_cont + m] = (cont.code[i] == code_marg[m]) ? 1.0 : 0.0;
+  }
+
+  /* the sampler works on the free parameters only, see expand_model() */
+  idx_free = new int [num_params];
+  pos_free = new int [num_params];
+  num_params_free = 0;
+  for(i=0; i<num_params; i++)
+  {
+    if(par_fix[i] == NOFIXED)
+    {
+      pos_free[i] = num_params_free;
+      idx_free[num_params_free++] = i;
+    }
+    else
+    {
+      pos_free[i] = -1;
+    }
+  }
+
+  if(num_threads < 1)
+    num_threads = 1;
+  /* full parameters of each thread, the fixed ones are set once here */
+  model_full = new double[num_params*num_threads];
+  for(j=0; j<num_threads; j++)
+    for(i=0; i<num_params; i++)
+      model_full[j*num_params + i] = (par_fix[i] == FIXED) ? par_fix_val[i] : 0.0;
+  step_width.resize(num_threads);
+  step_tries.resize(num_threads);
+  step_accepts.resize(num_threads);
+  step_rounds.resize(num_threads);
+  step_last = new int[3*num_threads];
+  step_pair = new double[2*num_threads];
+  step_covar = new double[num_threads*ncode*6];
+  reset_step_width();
+  /* one segment for each thread, see prob_drw() for its layout */
+  size_work = (9 + nq_cont)*size_max + nq_cont*(nq_cont + 1);
+  workspace = new double[size_work*num_threads];
+  prof_time = new double[PROF_STRIDE*num_threads];
+  prof_count = new unsigned long long int[PROF_STRIDE*num_threads];
+  reset_profile();
+
+  num_ps = 0;
+  posterior_sample = NULL;
+  posterior_sample_info = NULL;
+  Larr_data = new double[size_max];
+  for(i=0; i<size_max; i++)
+    Larr_data[i] = 1.0;
+  
+  fptrset = dnest_malloc_fptrset();
+  fptrset->from_prior = from_prior_cali;
+  fptrset->perturb = perturb_cali;
+  fptrset->print_particle = print_particle_cali;
+  fptrset->log_likelihoods_cal = prob_cali;
+  fptrset->log_likelihoods_cal_initial = prob_initial_cali;
+  fptrset->log_likelihoods_cal_restart = prob_initial_cali;
+  fptrset->accept_action = accept_action_cali;
+  fptrset->kill_action = kill_action_cali;
+  fptrset->restart_action = restart_action_cali;
+  sampler = dnest_malloc_context();
+
+  num_particles = 0;
+  prob_cont_particles = prob_cont_particles_perturb = NULL;
+  prob_line_particles = prob_line_particles_perturb = NULL;
+  update_cont = update_line = NULL;
 
   /* reconstruction */
-  double t1, t2, tspan;
-  tspan = cont.time[cont.time.size()-1] - cont.time[0];
-  t1 = cont.time[0] - 0.05*tspan;
-  t2 = cont.time[cont.time.size()-1] + 0.05*tspan;
-  cont_recon.resize(cont.time.size()*2);
-  size_recon_max = cont_recon.time.size();
-  for(i=0; i<cont_recon.time.size(); i++)
+  if(!cfg.recon_time_line.empty() && cfg.recon_time_line.size() != lines.size())
   {
-    cont_recon.time[i] = t1 + (t2 - t1)/(cont_recon.time.size()-1.0) * i;
+    cout<<"The number of recon_time_line does not match the number of lines."<<endl;
+    exit(-1);
   }
+  set_recon_time(cont, cont_recon, cfg.recon_time_cont, cfg);
+  size_recon_max = cont_recon.time.size();
   if(!fline.empty())
   {
     list<Data>::iterator it;
+    list< vector<double> >::iterator itt = cfg.recon_time_line.begin();
     DataLC line_recon;
     for(it=lines.begin(); it!=lines.end(); ++it)
     {
       Data& line = *(it);
-      line_recon.resize(line.time.size()*2);
-      tspan = line.time[line.time.size()-1] - line.time[0];
-      t1 = line.time[0] - 0.05*tspan;
-      t2 = line.time[line.time.size()-1] + 0.05*tspan;
-      for(i=0; i<line_recon.time.size(); i++)
+      if(cfg.recon_time_line.empty())
+      {
+        set_recon_time(line, line_recon, vector<double>(), cfg);
+      }
+      else 
       {
-        line_recon.time[i] = t1 + (t2 - t1)/(line_recon.time.size()-1.0) * i;
+        set_recon_time(line, line_recon, *itt, cfg);
+        ++itt;
       }
       size_recon_max = fmax(size_recon_max, line_recon.time.size());
 
@@ -1035,6 +1710,61 @@ Cali::Cali(Config& cfg)
   }
 }
 
+/*
+ * set the time grid of reconstruction. 
+ * time_recon: if not empty, use the given times;
+ * otherwise, an even grid over [recon_time_low, recon_time_up] (default: time span of data 
+ * padded by 5% on both sides) with a cadence of recon_cadence (default: 2 x number of data points).
+ */
+void Cali::set_recon_time(Data& data, DataLC& data_recon, const vector<double>& time_recon, Config& cfg)
+{
+  int i, n;
+  double t1, t2, tspan;
+
+  if(!time_recon.empty())
+  {
+    data_recon.resize(time_recon.size());
+    data_recon.time = time_recon;
+    sort(data_recon.time.begin(), data_recon.time.end());
+    return;
+  }
+
+  if(cfg.recon_time_low < cfg.recon_time_up)
+  {
+    t1 = cfg.recon_time_low;
+    t2 = cfg.recon_time_up;
+  }
+  else
+  {
+    tspan = data.time[data.time.size()-1] - data.time[0];
+    t1 = data.time[0] - 0.05*tspan;
+    t2 = data.time[data.time.size()-1] + 0.05*tspan;
+  }
+
+  if(cfg.recon_cadence > 0.0)
+  {
+    n = (int)((t2 - t1)/cfg.recon_cadence) + 1;
+    if(n < 2)
+    {
+      cout<<"ReconCadence is larger than the span of reconstruction."<<endl;
+      exit(-1);
+    }
+    data_recon.resize(n);
+    for(i=0; i<n; i++)
+    {
+      data_recon.time[i] = t1 + cfg.recon_cadence * i;
+    }
+  }
+  else
+  {
+    data_recon.resize(data.time.size()*2);
+    for(i=0; i<data_recon.time.size(); i++)
+    {
+      data_recon.time[i] = t1 + (t2 - t1)/(data_recon.time.size()-1.0) * i;
+    }
+  }
+}
+
 Cali::~Cali()
 {
   int i;
@@ -1054,46 +1784,81 @@ Cali::~Cali()
   delete[] best_params_covar;
 
   delete[] workspace;
+  delete[] prof_time;
+  delete[] prof_count;
   delete[] Larr_data;
+  delete[] Larr_cont;
+  delete[] code_marg;
+  delete[] idx_free;
+  delete[] pos_free;
+  delete[] model_full;
+  delete[] step_last;
+  delete[] step_pair;
+  delete[] step_covar;
+  delete[] posterior_sample;
+  delete[] posterior_sample_info;
   dnest_free_fptrset(fptrset);
+  dnest_free_context(sampler);
+  free_particle_cache();
 
   lines.clear();
   lines_recon.clear();
 }
 
-void Cali::check_directory()
+void check_work_dir(const string& work_dir)
 {
-  /* check if ./data exists
-   * if not, create it;
-   * if exists, check if it is a directory;
+  /* check if work_dir (including its parents) and work_dir/data exist
+   * if not, create them;
+   * if exist, check if they are directories;
    * if not, throw an error.*/
+  vector<string> dirs;
   struct stat st;
   int status;
-  status = stat("./data", &st);
-  if(status != 0)
+  size_t i, pos;
+  
+  pos = work_dir.find('/', 1);
+  while(pos != string::npos)
   {
-    cout<<"================================"<<endl
-        <<"Directory './data' not exist! PyCALI create it."<<endl;
-    status = mkdir("./data", S_IRWXU | S_IRWXG | S_IROTH | S_IXOTH);
-    if(status!=0)
-    {
-      cout<<"Cannot create './data'"<<endl
-          <<"================================"<<endl;
-    }
+    dirs.push_back(work_dir.substr(0, pos));
+    pos = work_dir.find('/', pos+1);
   }
-  else
+  dirs.push_back(work_dir);
+  dirs.push_back(work_dir + "/data");
+
+  for(i=0; i<dirs.size(); i++)
   {
-    if(!S_ISDIR(st.st_mode))
+    status = stat(dirs[i].c_str(), &st);
+    if(status != 0)
     {
       cout<<"================================"<<endl
-          <<"'./data' is not a direcotry!"<<endl
-          <<"================================"<<endl;
-      exit(-1);
+          <<"Directory '"<<dirs[i]<<"' not exist! PyCALI create it."<<endl;
+      status = mkdir(dirs[i].c_str(), S_IRWXU | S_IRWXG | S_IROTH | S_IXOTH);
+      if(status!=0)
+      {
+        cout<<"Cannot create '"<<dirs[i]<<"'"<<endl
+            <<"================================"<<endl;
+      }
+    }
+    else
+    {
+      if(!S_ISDIR(st.st_mode))
+      {
+        cout<<"================================"<<endl
+            <<"'"<<dirs[i]<<"' is not a direcotry!"<<endl
+            <<"================================"<<endl;
+        exit(-1);
+      }
     }
   }
   return;
 }
 
+void Cali::check_directory()
+{
+  check_work_dir(work_dir);
+  return;
+}
+
 void Cali::align(double *model)
 {
   int i, idx;
@@ -1221,12 +1986,27 @@ void Cali::align_with_error()
   }
 }
 
-void Cali::mcmc()
+/* 
+ * run mcmc sampling, checkpoints are periodically saved to work_dir/data/restart_dnest.bin.
+ * resume: continue from the checkpoint if exists, otherwise start from scratch.
+ * throw a runtime_error if the checkpoint cannot be read (e.g., of other settings) or written.
+ */
+void Cali::mcmc(bool resume)
 {
   int i, argc=0;
   char **argv;
   double logz_con;
   char dnest_options_file[256];
+  double t0 = dnest_wtime();
+
+  /* cancelled before the start, keep the outputs of the previous run */
+  if(dnest_get_stop_request(sampler))
+  {
+    cout<<"# Stop requested before mcmc starts, nothing is done."<<endl;
+    return;
+  }
+
+  reset_profile();
 
   argv = new char * [9];
   for(i=0; i<9; i++)
@@ -1234,470 +2014,726 @@ void Cali::mcmc()
     argv[i] = new char [256];
   }
   
+  char sample_dir[256];
+
   strcpy(argv[argc++], "dnest");
   strcpy(argv[argc++], "-s");
-  strcpy(argv[argc], "./");
-  strcat(argv[argc++], "/data/restart_dnest.txt");
+  strcpy(argv[argc], work_dir.c_str());
+  strcat(argv[argc++], "/data/restart_dnest.bin");
+  if(resume)
+  {
+    struct stat st;
+    if(stat(argv[argc-1], &st) == 0)
+    {
+      strcpy(argv[argc++], "-r");
+      strcpy(argv[argc], argv[argc-2]);
+      argc++;
+    }
+    else 
+    {
+      cout<<"# No checkpoint "<<argv[argc-1]<<", start from scratch."<<endl;
+    }
+  }
   //strcpy(argv[argc++], "-l");  //level-dependent sampling
+  if(binary_output)
+  {
+    strcpy(argv[argc++], "-b");  //binary sample files
+  }
 
   strcpy(dnest_options_file, "OPTIONS");
-  logz_con = dnest(argc, argv, fptrset, num_params, "data/", nmcmc, ptol, (void *)this);
+
+  /* particle caches are allocated when dnest initializes particles */
+  free_particle_cache();
+  dnest_set_num_threads(sampler, num_threads);
+  dnest_set_sync_policy(sampler, sync_policy);
+  dnest_set_stopping(sampler, stop_ess, stop_logz_tol, max_wall_time);
+  dnest_set_seed(sampler, seed);
+  if(auto_tune)
+  {
+    int np = num_particles_opt, nlevel = new_level_interval, nsave = save_interval;
+    tune_options(resume, &np, &nlevel, &nsave);
+    dnest_set_options(sampler, np, nlevel, nsave, thread_steps, max_num_levels, lambda, beta);
+  }
+  else 
+  {
+    dnest_set_options(sampler, num_particles_opt, new_level_interval, save_interval, thread_steps, max_num_levels, 
+                      lambda, beta);
+  }
+  /* layout of parameters stored in headers of binary files */
+  int layout[5] = {num_params, num_params_var, (int)ncode, (int)lines.size(), num_params_free};
+  dnest_set_bin_layout(sampler, layout, 5);
+  if(dnest_get_thistask() == 0)
+    save_free_params();
+  /* restored from the checkpoint when resuming, see restart_action_cali() */
+  reset_step_width();
+
+  strcpy(sample_dir, work_dir.c_str());
+  strcat(sample_dir, "/data/");
+  logz_con = dnest(sampler, argc, argv, fptrset, num_params_free, sample_dir, nmcmc, ptol, (void *)this);
 
   for(i=0; i<9; i++)
   {
     delete[] argv[i];
   }
   delete[] argv;
-}
-
-void Cali::get_best_params()
-{
-  int i, j, num_ps;
-  FILE *fp;
-  char posterior_sample_file[256];
-  double *post_model, *posterior_sample;
-  double *pm, *pmstd;
-
-  strcpy(posterior_sample_file, "data/posterior_sample.txt");
+  time_stages["mcmc"] = dnest_wtime() - t0;
 
-  /* open file for posterior sample */
-  fp = fopen(posterior_sample_file, "r");
-  if(fp == NULL)
+  if(dnest_get_error(sampler) == DNEST_ERROR_STOPPED)
   {
-    fprintf(stderr, "# Error: Cannot open file %s.\n", posterior_sample_file);
-    exit(0);
+    return;
   }
-
-  /* read number of points in posterior sample */
-  if(fscanf(fp, "# %d", &num_ps) < 1)
+  /* e.g., the checkpoint does not match the settings, the messages of dnest tell the reason */
+  if(dnest_get_error(sampler) != 0)
   {
-    fprintf(stderr, "# Error: Cannot read file %s.\n", posterior_sample_file);
-    exit(0);
+    throw runtime_error("mcmc failed in reading or writing the checkpoint in " + work_dir + "/data/.");
   }
-  printf("# Number of points in posterior sample: %d\n", num_ps);
 
-  if(num_ps < 500)
+  /* with MPI, the posterior sample is on the root task only */
+  if(dnest_get_thistask() != 0)
   {
-    cout<<"########################################################\n"
-          "# Too few effective posterior samples.\n"
-          "# Try to increse nmcmc, or decrease ptol,\n"
-          "# or set a more appropriate range for scale and shift.\n"
-          "########################################################"<<endl;
-    exit(-1);
+    return;
   }
 
-  post_model = new double[num_params*sizeof(double)];
-  posterior_sample = new double[num_ps * num_params*sizeof(double)];
-  
+  /* keep the posterior sample in memory, with the fixed parameters filled in */
+  delete[] posterior_sample;
+  delete[] posterior_sample_info;
+  num_ps = dnest_get_num_posterior_sample(sampler);
+  posterior_sample = new double[num_ps * num_params];
+  posterior_sample_info = new double[num_ps];
+  double *ps_free = new double[num_ps * num_params_free];
+  dnest_get_posterior_sample(sampler, ps_free, posterior_sample_info);
+  dnest_free_posterior_sample(sampler);
   for(i=0; i<num_ps; i++)
   {
-    for(j=0; j<num_params; j++)
+    memcpy(posterior_sample + (size_t)i*num_params, expand_model(ps_free + (size_t)i*num_params_free), 
+           num_params*sizeof(double));
+  }
+  delete[] ps_free;
+  sample_marg_shift();
+  save_posterior_sample();
+  time_stages["mcmc"] = dnest_wtime() - t0;
+}
+
+/*
+ * pick the dnest options left unset (0) from the number of free parameters and 
+ * the measured cost of a step, aiming at the shortest time to a given ESS.
+ *
+ * save_interval: sqrt(TUNE_COST_REF/cost) sweeps (num_params_free steps) within 
+ *   [TUNE_SWEEPS_MIN, TUNE_SWEEPS_MAX]; cheap likelihoods are saved less often, 
+ *   as the bookkeeping of a save is then not negligible, expensive ones more often;
+ * new_level_interval: 2*save_interval, at least TUNE_LEVEL_MIN so that the 
+ *   quantile of a new level is well determined in small problems;
+ * num_particles: as many particles per thread (up to TUNE_PARTICLES_MAX) as can 
+ *   each make one sweep between two synchronizations of threads.
+ *
+ * a resumed run reads back the options in work_dir/data/dnest_options.txt, 
+ * since the checkpoint requires the same options.
+ */
+void Cali::tune_options(bool resume, int *np, int *nlevel, int *nsave)
+{
+  int i, k, nsweep, nstep, np_thread;
+  double cost, t0;
+  string fname = work_dir + "/data/dnest_options.txt";
+  ifstream fin;
+  ofstream fout;
+
+  if(resume)
+  {
+    fin.open(fname);
+    if(!fin.fail())
     {
-      if(fscanf(fp, "%lf", (double *)post_model + j) < 1)
+      string line;
+      getline(fin, line);
+      if(fin>>*np>>*nlevel>>*nsave)
       {
-        fprintf(stderr, "# Error: Cannot read file %s.\n", posterior_sample_file);
-        exit(0);
+        cout<<"# Auto-tuned options of dnest read from "<<fname<<"."<<endl;
+        return;
       }
+      cout<<"# Cannot read "<<fname<<", tune the options of dnest afresh."<<endl;
     }
-    fscanf(fp, "\n");
-
-    memcpy(posterior_sample+i*num_params, post_model, num_params*sizeof(double));
-
   }
-  fclose(fp);
 
-  /* calcaulte mean and standard deviation of posterior samples. */
-  pm = (double *)best_params;
-  pmstd = (double *)best_params_std;
-  for(j=0; j<num_params; j++)
+  /* cost of the likelihood at the centers of the priors, a perturbation 
+   * mostly recomputes the block of one light curve */
+  double *pm_free = new double[num_params_free];
+  for(k=0; k<num_params_free; k++)
   {
-    pm[j] = pmstd[j] = 0.0;
+    i = idx_free[k];
+    if(par_prior_model[i] == GAUSSIAN)
+      pm_free[k] = par_prior_gaussian[i][0];
+    else if(par_prior_model[i] == LOG)
+      pm_free[k] = sqrt(par_range_model[i][0] * par_range_model[i][1]);
+    else
+      pm_free[k] = 0.5*(par_range_model[i][0] + par_range_model[i][1]);
   }
-  for(i=0; i<num_ps; i++)
+  double *pm = expand_model(pm_free);
+  log_likelihood(pm); /* warm up */
+  t0 = dnest_wtime();
+  for(i=0; i<TUNE_NUM_PROBES; i++)
+    log_likelihood(pm);
+  cost = (dnest_wtime() - t0)/TUNE_NUM_PROBES/(1 + lines.size());
+  delete[] pm_free;
+
+  if(*nsave <= 0)
+  {
+    nsweep = (int)ceil(sqrt(TUNE_COST_REF/fmax(cost, 1.0e-9)));
+    nsweep = min(max(nsweep, TUNE_SWEEPS_MIN), TUNE_SWEEPS_MAX);
+    *nsave = nsweep * num_params_free;
+  }
+  if(*nlevel <= 0)
   {
-    for(j =0; j<num_params; j++)
-      pm[j] += *((double *)posterior_sample + i*num_params + j );
+    *nlevel = max(2 * (*nsave), TUNE_LEVEL_MIN);
+  }
+  if(*np <= 0)
+  {
+    nstep = (thread_steps > 0) ? thread_steps : max(*nlevel/num_threads, 1);
+    np_thread = min(max(nstep/num_params_free, 1), TUNE_PARTICLES_MAX);
+    *np = np_thread * num_threads;
   }
 
-  for(j=0; j<num_params; j++)
-    pm[j] /= num_ps;
+  /* with MPI, the options of the root task are used by all tasks, see setup() of dnest */
+  if(dnest_get_thistask() != 0)
+    return;
+
+  cout<<"# Auto-tuned options of dnest: cost of a step "<<cost<<" s, "<<*np<<" particles, new level interval "
+      <<*nlevel<<", save interval "<<*nsave<<"."<<endl;
+
+  fout.open(fname);
+  fout<<"# num_particles new_level_interval save_interval, cost of a step "<<cost<<" s"<<endl;
+  fout<<*np<<" "<<*nlevel<<" "<<*nsave<<endl;
+  fout.close();
+}
+
+/*
+ * draw the analytically marginalized shifts of each posterior sample from 
+ * their Gaussian posterior conditioned on the other parameters.
+ */
+void Cali::sample_marg_shift()
+{
+  int i, k;
+  double *pm, *coef, *z;
+  double *work = workspace;
+  gsl_rng *gsl_r;
+
+  if(nq_cont == 1 || num_ps == 0)
+    return;
+
+  gsl_r = gsl_rng_alloc(gsl_rng_default);
+#ifndef Debug
+  if(seed > 0)
+    gsl_rng_set(gsl_r, seed + num_threads + 2);
+  else
+    gsl_rng_set(gsl_r, time(NULL));
+#else
+  gsl_rng_set(gsl_r, 6666);
+#endif
 
+  coef = new double [nq_cont*(nq_cont+1)];
+  z = coef + nq_cont*nq_cont;
   for(i=0; i<num_ps; i++)
   {
-    for(j=0; j<num_params; j++)
-      pmstd[j] += pow( *((double *)posterior_sample + i*num_params + j ) - pm[j], 2.0 );
+    pm = posterior_sample + (size_t)i*num_params;
+    prob_cont(pm, work, NULL, coef);
+    /* (mean, offsets) = U^-T * (U^-1*L^T*C^-1*y + n), n ~ N(0, 1) */
+    for(k=0; k<nq_cont; k++)
+      z[k] += gsl_ran_ugaussian(gsl_r);
+    cblas_dtrsv(CblasRowMajor, CblasLower, CblasTrans, CblasNonUnit, nq_cont, coef, nq_cont, z, 1);
+    for(k=1; k<nq_cont; k++)
+      pm[num_params_var + ncode + code_marg[k]] = z[k];
   }
+  delete[] coef;
+  gsl_rng_free(gsl_r);
+}
 
-  for(j=0; j<num_params; j++)
-  {
-    if(num_ps > 1)
-      pmstd[j] = sqrt(pmstd[j]/(num_ps-1.0));
-    else
-      pmstd[j] = 0.0;
-  }  
+/*
+ * write the posterior sample in memory with all parameters, replacing the 
+ * one of dnest, which only has the free parameters.
+ */
+void Cali::save_posterior_sample()
+{
+  int i;
+  FILE *fp;
+  string fname;
 
-  /* find out the largest likelihood */
-  ifstream fin;
-  vector<double> prob(num_ps);
-  string str;
-  double prob_max;
-  int ip_max;
-  fin.open("data/posterior_sample_info.txt");
-  if(!fin.good())
+  if(binary_output)
   {
-    cout<<"Error: Cannot open file data/posterior_sample_info.txt.\n"<<endl;
-    exit(0);
+    fname = work_dir + "/data/posterior_sample.bin";
+    fp = fopen(fname.c_str(), "wb");
   }
-  getline(fin, str);
-  prob_max = -DBL_MAX;
-  for(i=0; i<num_ps; i++)
+  else
+  {
+    fname = work_dir + "/data/posterior_sample.txt";
+    fp = fopen(fname.c_str(), "w");
+  }
+  if(fp == NULL)
+  {
+    cout<<"Error: Cannot open file "<<fname<<"."<<endl;
+    exit(-1);
+  }
+  if(binary_output)
+  {
+    int layout[5] = {num_params, num_params_var, (int)ncode, (int)lines.size(), num_params_free};
+    dnest_write_bin_header(fp, num_params, num_ps, layout, 5);
+    fwrite(posterior_sample, sizeof(double), (size_t)num_ps*num_params, fp);
+  }
+  else
   {
-    fin>>prob[i];
-    if(prob_max < prob[i])
+    fprintf(fp, "# %d\n", num_ps);
+    for(i=0; i<num_ps; i++)
     {
-      prob_max = prob[i];
-      ip_max = i;
+      for(int j=0; j<num_params; j++)
+        fprintf(fp, "%e ", posterior_sample[(size_t)i*num_params + j]);
+      fprintf(fp, "\n");
     }
   }
-  fin.close();
-  cout<<"Lmax:"<<prob_max<<" at "<<ip_max<<"th posterior sample."<<endl;
-  printf("The params with the maximum likelihood:\n");
-  printf("scale and shift\n");
-  for(i=0; i<ncode; i++)
+  fclose(fp);
+}
+
+/*
+ * write indices of the free parameters, i.e., the columns of the sample 
+ * files (sample.txt or sample.bin) in the full parameter layout.
+ */
+void Cali::save_free_params()
+{
+  int i;
+  ofstream fout;
+
+  fout.open(work_dir + "/data/free_params.txt");
+  fout<<"# "<<num_params_free<<" of "<<num_params<<endl;
+  for(i=0; i<num_params_free; i++)
+    fout<<idx_free[i]<<" ";
+  fout<<endl;
+  fout.close();
+}
+
+/*
+ * full parameters from the free parameters of the sampler, stored 
+ * in the buffer of the calling thread.
+ */
+double * Cali::expand_model(const double *pm_free)
+{
+  int i;
+  double *pm = model_full + dnest_get_thread_num() * num_params;
+
+  for(i=0; i<num_params_free; i++)
+    pm[idx_free[i]] = pm_free[i];
+  return pm;
+}
+
+/* 
+ * load posterior sample from binary files in work_dir/data/ through mmap.
+ * throw a runtime_error if the files cannot be read or do not match.
+ */
+void Cali::load_posterior_sample_bin()
+{
+  DNestBinHeader header;
+  double *data;
+  size_t map_size;
+  int n;
+  string posterior_sample_file = work_dir + "/data/posterior_sample.bin";
+  string posterior_sample_info_file = work_dir + "/data/posterior_sample_info.bin";
+
+  data = dnest_mmap_bin(posterior_sample_file.c_str(), &header, &map_size);
+  if(data == NULL)
   {
-    cout<<scientific
-        <<cont.code_list[i]<<"\t"<<*((double *)posterior_sample + ip_max*num_params + num_params_var + i)
-                           <<"\t"<<*((double *)posterior_sample + ip_max*num_params + num_params_var + i + ncode)<<endl;
+    throw runtime_error("cannot read file " + posterior_sample_file + ".");
   }
-  printf("syserr and error scale of continuum\n");
-  for(i=0; i<ncode; i++)
+  if(header.num_cols != num_params)
   {
-    cout<<scientific
-        <<cont.code_list[i]<<"\t"<<*((double *)posterior_sample + ip_max*num_params + num_params_var + i + 2*ncode)
-                           <<"\t"<<*((double *)posterior_sample + ip_max*num_params + num_params_var + i + 3*ncode)<<endl;
+    dnest_munmap_bin(data, map_size);
+    throw runtime_error("number of parameters in " + posterior_sample_file + " does not match ("
+                        + to_string(header.num_cols) + " vs " + to_string(num_params) + ").");
   }
+  n = header.num_rows;
+  double *ps = new double[(size_t)n * num_params];
+  memcpy(ps, data, (size_t)n * num_params * sizeof(double));
+  dnest_munmap_bin(data, map_size);
 
-  if(!fline.empty())
+  data = dnest_mmap_bin(posterior_sample_info_file.c_str(), &header, &map_size);
+  if(data == NULL || header.num_rows != n)
   {
-    for(j=0; j<fline.size(); j++)
-    {
-      printf("syserr and error scale of line %d\n", j);
-      for(i=0; i<ncode; i++)
-      {
-        cout<<scientific
-            <<cont.code_list[i]<<"\t"<<*((double *)posterior_sample + ip_max*num_params + num_params_var + i + (4+2*j)*ncode)
-                               <<"\t"<<*((double *)posterior_sample + ip_max*num_params + num_params_var + i + (5+2*j)*ncode)<<endl;
-      }
-    }
+    delete[] ps;
+    if(data != NULL)
+      dnest_munmap_bin(data, map_size);
+    throw runtime_error("numbers of rows in " + posterior_sample_file + " and " 
+                        + posterior_sample_info_file + " do not match.");
   }
+  delete[] posterior_sample;
+  delete[] posterior_sample_info;
+  num_ps = n;
+  posterior_sample = ps;
+  posterior_sample_info = new double[num_ps];
+  memcpy(posterior_sample_info, data, num_ps * sizeof(double));
+  dnest_munmap_bin(data, map_size);
+}
 
-  /* calculate covariance */
-  double covar;
-  int k;
-  for(i=0; i<num_params; i++)
+/* 
+ * load posterior sample from files in work_dir/data/, 
+ * used when the sample is not in memory, e.g., generated by a previous run.
+ * throw a runtime_error if the files cannot be read, the sample in memory is then unchanged.
+ */
+void Cali::load_posterior_sample()
+{
+  int i, j, n;
+  FILE *fp;
+  double *ps, *psi;
+  string posterior_sample_file = work_dir + "/data/posterior_sample.txt";
+  string posterior_sample_info_file = work_dir + "/data/posterior_sample_info.txt";
+
+  if(binary_output)
   {
-    for(j=0; j<i; j++)
-    {
-      covar = 0.0;
-      for(k=0; k<num_ps; k++)
-      {
-        covar += (*((double *)posterior_sample + k*num_params + i )) * (*((double *)posterior_sample + k*num_params + j ));
-      }
-      best_params_covar[i*num_params+j] = best_params_covar[j*num_params+i] = covar/num_ps - best_params[i]*best_params[j];
-    }
-    best_params_covar[i*num_params+i] = best_params_std[i] * best_params_std[i];
+    load_posterior_sample_bin();
+    return;
   }
 
-  /* directly calculate flux and error */
-  stat_type = 2;  /* 0: median, 1: mean, 2, error peak */
-  double error_scale_shift;
-  DataLC cont_output(cont.time.size());
-  if(stat_type == 0)  /* mediate values */
+  /* open file for posterior sample */
+  fp = fopen(posterior_sample_file.c_str(), "r");
+  if(fp == NULL)
   {
-    double *flux, *error;
-    flux = new double [cont.time.size()*num_ps];
-    error = new double [cont.time.size()*num_ps];
+    throw runtime_error("cannot open file " + posterior_sample_file + ".");
+  }
 
-    for(i=0; i<num_ps; i++)
+  /* read number of points in posterior sample */
+  if(fscanf(fp, "# %d", &n) < 1 || n < 0)
+  {
+    fclose(fp);
+    throw runtime_error("cannot read file " + posterior_sample_file + ".");
+  }
+
+  ps = new double[(size_t)n * num_params];
+  for(i=0; i<n; i++)
+  {
+    for(j=0; j<num_params; j++)
     {
-      align_cont((double *)posterior_sample + i*num_params);
-      for(j=0; j<cont.time.size(); j++)
+      if(fscanf(fp, "%lf", ps + (size_t)i*num_params + j) < 1)
       {
-        flux[j * num_ps + i] = cont.flux[j];
-        error[j * num_ps + i] = cont.error[j];
+        fclose(fp);
+        delete[] ps;
+        throw runtime_error("cannot read file " + posterior_sample_file + ".");
       }
     }
-    /* sort, and use the media value */
-    for(j=0; j<cont.time.size(); j++)
-    {
-      /* ascending order */
-      qsort(flux+j*num_ps, num_ps, sizeof(double), compare);
-      cont_output.flux[j] = flux[j*num_ps + (int)(0.5*num_ps)];
-      qsort(error+j*num_ps, num_ps, sizeof(double), compare);
-      cont_output.error[j] = error[j*num_ps + (int)(0.5*num_ps)];
-      /* include error of scale and shift */
-      error_scale_shift = 0.5*( (cont_output.flux[j] - flux[j*num_ps + (int)(0.1585*num_ps)])
-                               +(flux[j*num_ps + (int)(0.8415*num_ps)] - cont_output.flux[j]) );
-      cont_output.error[j] = sqrt(cont_output.error[j]*cont_output.error[j] + error_scale_shift*error_scale_shift);
-    }
-  
-    cont.flux = cont_output.flux;
-    cont.error = cont_output.error;
-    delete[] flux;
-    delete[] error;
+    fscanf(fp, "\n");
+  }
+  fclose(fp);
 
-    if(!fline.empty())
+  ifstream fin;
+  string str;
+  fin.open(posterior_sample_info_file);
+  if(!fin.good())
+  {
+    delete[] ps;
+    throw runtime_error("cannot open file " + posterior_sample_info_file + ".");
+  }
+  psi = new double[n];
+  getline(fin, str);
+  for(i=0; i<n; i++)
+  {
+    fin>>psi[i];
+  }
+  fin.close();
+
+  delete[] posterior_sample;
+  delete[] posterior_sample_info;
+  num_ps = n;
+  posterior_sample = ps;
+  posterior_sample_info = psi;
+}
+
+void Cali::get_best_params()
+{
+  int i, j;
+  double *pm, *pmstd;
+  double t0 = dnest_wtime();
+
+  if(posterior_sample == NULL)
+  {
+    load_posterior_sample();
+  }
+  printf("# Number of points in posterior sample: %d\n", num_ps);
+
+  /* throw rather than exit, so that a python caller can recover, e.g., resume the run */
+  if(num_ps < POSTERIOR_SAMPLE_MIN)
+  {
+    cout<<"########################################################\n"
+          "# Too few effective posterior samples.\n"
+          "# Try to increse nmcmc, or decrease ptol,\n"
+          "# or set a more appropriate range for scale and shift.\n"
+          "########################################################"<<endl;
+    throw runtime_error("too few effective posterior samples ("+to_string(num_ps)+").");
+  }
+
+  /* transpose posterior sample so that each parameter is contiguous */
+  double *pt, *pc;
+  pt = new double [(size_t)num_params*num_ps];
+  for(i=0; i<num_ps; i++)
+  {
+    for(j=0; j<num_params; j++)
+      pt[(size_t)j*num_ps + i] = posterior_sample[(size_t)i*num_params + j];
+  }
+
+  /* calcaulte mean of posterior samples. */
+  pm = (double *)best_params;
+  pmstd = (double *)best_params_std;
+  for(j=0; j<num_params; j++)
+  {
+    pm[j] = 0.0;
+    for(i=0; i<num_ps; i++)
+      pm[j] += pt[(size_t)j*num_ps + i];
+    pm[j] /= num_ps;
+  }
+
+  /* covariance from the centered sample, C = Xc * Xc^T */
+  pc = new double [(size_t)num_params*num_ps];
+  for(j=0; j<num_params; j++)
+  {
+    for(i=0; i<num_ps; i++)
+      pc[(size_t)j*num_ps + i] = pt[(size_t)j*num_ps + i] - pm[j];
+  }
+  cblas_dsyrk(CblasRowMajor, CblasUpper, CblasNoTrans, num_params, num_ps, 
+              1.0, pc, num_ps, 0.0, best_params_covar, num_params);
+  delete[] pc;
+
+  for(j=0; j<num_params; j++)
+  {
+    if(num_ps > 1)
+      pmstd[j] = sqrt(best_params_covar[j*num_params+j]/(num_ps-1.0));
+    else
+      pmstd[j] = 0.0;
+  }
+
+  for(i=0; i<num_params; i++)
+  {
+    for(j=i+1; j<num_params; j++)
     {
-      list<Data>::iterator it;
-      int il=0;
-      for(it=lines.begin(); it!=lines.end(); ++it)
-      {
-        Data& line = *(it);
-        DataLC line_output(line.time.size());
-        flux = new double [line.time.size()*num_ps];
-        error = new double [line.time.size()*num_ps];
-        for(i=0; i<num_ps; i++)
-        {
-          align_line((double *)posterior_sample + i*num_params, il);
-          for(j=0; j<line.time.size(); j++)
-          {
-            flux[j * num_ps + i] = line.flux[j];
-            error[j * num_ps + i] = line.error[j];
-          }
-        }
-        /* sort, and use the media value */
-        for(j=0; j<line.time.size(); j++)
-        {
-          qsort(flux+j*num_ps, num_ps, sizeof(double), compare);
-          line_output.flux[j] = flux[j*num_ps + (int)(0.5*num_ps)];
-          qsort(error+j*num_ps, num_ps, sizeof(double), compare);
-          line_output.error[j] = error[j*num_ps + (int)(0.5*num_ps)];
-          /* include error of scale and shift */
-          error_scale_shift = 0.5*( (line_output.flux[j] - flux[j*num_ps + (int)(0.1585*num_ps)])
-                                 +(flux[j*num_ps + (int)(0.8415*num_ps)] - line_output.flux[j]) );
-          line_output.error[j] = sqrt(line_output.error[j]*line_output.error[j] + error_scale_shift*error_scale_shift);
-        }
-      
-        line.flux = line_output.flux;
-        line.error = line_output.error;
-        delete[] flux;
-        delete[] error;
-        il++;
-      }
+      best_params_covar[i*num_params+j] /= num_ps;
+      best_params_covar[j*num_params+i] = best_params_covar[i*num_params+j];
     }
+    best_params_covar[i*num_params+i] = best_params_std[i] * best_params_std[i];
   }
-  else if(stat_type == 1)  /* mean values */
+  /* find out the largest likelihood */
+  double prob_max;
+  int ip_max;
+  prob_max = -DBL_MAX;
+  for(i=0; i<num_ps; i++)
   {
-    vector<double> flux_rms(cont.time.size());
-    for(j=0; j<cont.time.size(); j++)
+    if(prob_max < posterior_sample_info[i])
     {
-      cont_output.flux[j] = 0.0;
-      cont_output.error[j] = 0.0;
-
-      flux_rms[j] = 0.0;
+      prob_max = posterior_sample_info[i];
+      ip_max = i;
     }
+  }
+  cout<<"Lmax:"<<prob_max<<" at "<<ip_max<<"th posterior sample."<<endl;
+  printf("The params with the maximum likelihood:\n");
+  printf("scale and shift\n");
+  for(i=0; i<ncode; i++)
+  {
+    cout<<scientific
+        <<cont.code_list[i]<<"\t"<<*((double *)posterior_sample + ip_max*num_params + num_params_var + i)
+                           <<"\t"<<*((double *)posterior_sample + ip_max*num_params + num_params_var + i + ncode)<<endl;
+  }
+  printf("syserr and error scale of continuum\n");
+  for(i=0; i<ncode; i++)
+  {
+    cout<<scientific
+        <<cont.code_list[i]<<"\t"<<*((double *)posterior_sample + ip_max*num_params + num_params_var + i + 2*ncode)
+                           <<"\t"<<*((double *)posterior_sample + ip_max*num_params + num_params_var + i + 3*ncode)<<endl;
+  }
 
-    for(i=0; i<num_ps; i++)
+  if(!fline.empty())
+  {
+    for(j=0; j<fline.size(); j++)
     {
-      align_cont((double *)posterior_sample + i*num_params);
-      for(j=0; j<cont.time.size(); j++)
+      printf("syserr and error scale of line %d\n", j);
+      for(i=0; i<ncode; i++)
       {
-        cont_output.flux[j] += cont.flux[j];
-        cont_output.error[j] += cont.error[j];
-
-        flux_rms[j] += cont.flux[j]*cont.flux[j];
+        cout<<scientific
+            <<cont.code_list[i]<<"\t"<<*((double *)posterior_sample + ip_max*num_params + num_params_var + i + (4+2*j)*ncode)
+                               <<"\t"<<*((double *)posterior_sample + ip_max*num_params + num_params_var + i + (5+2*j)*ncode)<<endl;
       }
     }
-    for(j=0; j<cont.time.size(); j++)
-    {
-      cont_output.flux[j] /= num_ps;
-      cont_output.error[j] /= num_ps;
-      
-      flux_rms[j] /= num_ps;
-      /* include error of scale */
-      error_scale_shift = fmax(0.0, flux_rms[j] - cont_output.flux[j]*cont_output.flux[j]);
-      cont_output.error[j] = sqrt(cont_output.error[j]*cont_output.error[j] + error_scale_shift);
-    }
-  
-    cont.flux = cont_output.flux;
-    cont.error = cont_output.error;
+  }
+
+  /* directly calculate flux and error */
+  stat_type = 2;  /* 0: median, 1: mean, 2, error peak */
+  if(stat_type == 0 || stat_type == 1 || stat_type == 2)
+  {
+    double *flux, *error;
+    double *ps_scale = pt + (size_t)num_params_var*num_ps;
+    double *es_shift = ps_scale + (size_t)ncode*num_ps;
+    double *syserr = es_shift + (size_t)ncode*num_ps;
+    double *error_scale = syserr + (size_t)ncode*num_ps;
+
+    flux = new double [size_max*num_ps];
+    error = new double [size_max*num_ps];
+
+    align_sample(cont, ps_scale, es_shift, syserr, error_scale, flux, error);
+    stat_sample(cont, flux, error);
 
     if(!fline.empty())
     {
       list<Data>::iterator it;
-      int il=0;
       for(it=lines.begin(); it!=lines.end(); ++it)
       {
         Data& line = *(it);
-        DataLC line_output(line.time.size());
-        flux_rms.resize(line.time.size());
-  
-        for(j=0; j<line.time.size(); j++)
-        {
-          line_output.flux[j] = 0.0;
-          line_output.error[j] = 0.0;
-  
-          flux_rms[j] = 0.0;
-        }
-  
-        for(i=0; i<num_ps; i++)
-        {
-          align_line((double *)posterior_sample + i*num_params, il);
-          for(j=0; j<line.time.size(); j++)
-          {
-            line_output.flux[j] += line.flux[j];
-            line_output.error[j] += line.error[j];
-  
-            flux_rms[j] += line.flux[j]*line.flux[j];
-          }
-        }
-        for(j=0; j<line.time.size(); j++)
-        {
-          line_output.flux[j] /= num_ps;
-          line_output.error[j] /= num_ps;
-  
-          flux_rms[j] /= num_ps;
-          /* include error of scale */
-          error_scale_shift = fmax(0.0, flux_rms[j] - line_output.flux[j]*line_output.flux[j]);
-          line_output.error[j] = sqrt(line_output.error[j]*line_output.error[j] + error_scale_shift);
-        }
-      
-        line.flux = line_output.flux;
-        line.error = line_output.error;
-        il++;
+        syserr = error_scale + (size_t)ncode*num_ps;
+        error_scale = syserr + (size_t)ncode*num_ps;
+        align_sample(line, ps_scale, NULL, syserr, error_scale, flux, error);
+        stat_sample(line, flux, error);
       }
     }
+    delete[] flux;
+    delete[] error;
   }
-  else if(stat_type == 2) /* use best likelihood-maximize values */
+  else /* error propagate */
   {
-    double *flux, *error;
-    double error_min, error_max;
-    gsl_histogram * he = gsl_histogram_alloc (20);
+    align_with_error();
+  }
+  delete[] pt;
+  time_stages["get_best_params"] = dnest_wtime() - t0;
+}
 
-    flux = new double [cont.time.size()*num_ps];
-    error = new double [cont.time.size()*num_ps];
-    
-    /* calculate errors of scale and shift */
+/*
+ * align a light curve with all posterior samples in one pass. 
+ * ps_scale, es_shift, syserr, and error_scale point to the rows of the transposed 
+ * posterior sample, each code has a row of num_ps samples; es_shift is NULL for lines.
+ * flux and error are output with a layout of [point][sample].
+ */
+void Cali::align_sample(Data& data, double *ps_scale, double *es_shift, double *syserr, double *error_scale,
+                        double *flux, double *error)
+{
+  int i, j, idx;
+  double fo, eo2, *s, *sh, *se, *es, *f, *e;
+  for(j=0; j<data.time.size(); j++)
+  {
+    idx = data.code[j];
+    fo = data.flux_org[j];
+    eo2 = data.error_org[j]*data.error_org[j];
+    s = ps_scale + (size_t)idx*num_ps;
+    se = syserr + (size_t)idx*num_ps;
+    es = error_scale + (size_t)idx*num_ps;
+    f = flux + (size_t)j*num_ps;
+    e = error + (size_t)j*num_ps;
+    if(es_shift != NULL)
+    {
+      sh = es_shift + (size_t)idx*num_ps;
+      for(i=0; i<num_ps; i++)
+        f[i] = fo * s[i] - sh[i];
+    }
+    else 
+    {
+      for(i=0; i<num_ps; i++)
+        f[i] = fo * s[i];
+    }
+    /* note that this error does not include errors of scale and shift */
     for(i=0; i<num_ps; i++)
+      e[i] = sqrt(eo2*es[i]*es[i] + se[i]*se[i]) * s[i];
+  }
+}
+
+/*
+ * statistics of the aligned fluxes and errors given by align_sample(), 
+ * the results are stored in data.flux and data.error.
+ * quantiles are obtained by selection, the order of flux and error is changed.
+ */
+void Cali::stat_sample(Data& data, double *flux, double *error)
+{
+  int i, j, im, ilo, ihi, nbin=20, ibin, imax;
+  double *f, *e, fm, flo, fhi, em, error_scale_shift;
+  double error_min, error_max, width, hist[20], range[21];
+
+  im = (int)(0.5*num_ps);
+  ilo = (int)(0.1585*num_ps);
+  ihi = (int)(0.8415*num_ps);
+  for(j=0; j<data.time.size(); j++)
+  {
+    f = flux + (size_t)j*num_ps;
+    e = error + (size_t)j*num_ps;
+    if(stat_type == 1) /* mean values */
     {
-      align_cont((double *)posterior_sample + i*num_params);
-      for(j=0; j<cont.time.size(); j++)
+      fm = em = error_scale_shift = 0.0;
+      for(i=0; i<num_ps; i++)
       {
-        flux[j * num_ps + i] = cont.flux[j];
-        error[j * num_ps + i] = cont.error[j];
+        fm += f[i];
+        em += e[i];
+        error_scale_shift += f[i]*f[i];
       }
+      fm /= num_ps;
+      em /= num_ps;
+      /* include error of scale */
+      error_scale_shift = fmax(0.0, error_scale_shift/num_ps - fm*fm);
+      data.flux[j] = fm;
+      data.error[j] = sqrt(em*em + error_scale_shift);
+      continue;
+    }
+
+    if(stat_type == 0) /* median values */
+    {
+      std::nth_element(e, e+im, e+num_ps);
+      em = e[im];
     }
-    for(j=0; j<cont.time.size(); j++)
+    else /* peak of error distribution with 20 bins */
     {
       error_min =  DBL_MAX;
       error_max = -DBL_MAX;
       for(i=0; i<num_ps; i++)
       {
-        error_min = fmin(error_min, error[j * num_ps + i]);
-        error_max = fmax(error_max, error[j * num_ps + i]);
+        error_min = fmin(error_min, e[i]);
+        error_max = fmax(error_max, e[i]);
       }
       if(error_min == error_max)
       {
         error_min -= 0.01*error_min;
         error_max += 0.01*error_max;
       }
-      gsl_histogram_reset(he);
-      gsl_histogram_set_ranges_uniform(he, error_min, error_max);
+      /* uniform bins as in gsl_histogram_set_ranges_uniform() */
+      for(ibin=0; ibin<=nbin; ibin++)
+        range[ibin] = ((double)(nbin-ibin)/nbin)*error_min + ((double)ibin/nbin)*error_max;
+      width = (error_max - error_min)/nbin;
+      for(ibin=0; ibin<nbin; ibin++)
+        hist[ibin] = 0.0;
       for(i=0; i<num_ps; i++)
       {
-        gsl_histogram_increment(he, error[j * num_ps + i]);
+        /* the upper edge is excluded */
+        if(e[i] < range[0] || e[i] >= range[nbin])
+          continue;
+        ibin = (int)((e[i] - error_min)/width);
+        ibin = ibin < nbin ? ibin : nbin-1;
+        while(ibin > 0 && e[i] < range[ibin])
+          ibin--;
+        while(ibin < nbin-1 && e[i] >= range[ibin+1])
+          ibin++;
+        hist[ibin] += 1.0;
       }
-      cont_output.error[j] = 0.5*(he->range[gsl_histogram_max_bin(he)] + he->range[gsl_histogram_max_bin(he)+1]);
-
-      /* ascending order */
-      qsort(flux+j*num_ps, num_ps, sizeof(double), compare);
-      cont_output.flux[j] = flux[j*num_ps + (int)(0.5*num_ps)];
-      /* include error of scale and shift */
-      error_scale_shift = 0.5*( (cont_output.flux[j] - flux[j*num_ps + (int)(0.1585*num_ps)])
-                               +(flux[j*num_ps + (int)(0.8415*num_ps)] - cont_output.flux[j]) );
-      cont_output.error[j] = sqrt(cont_output.error[j]*cont_output.error[j] + error_scale_shift*error_scale_shift);
-    }
-    cont.flux = cont_output.flux;
-    cont.error = cont_output.error;
-    delete[] flux;
-    delete[] error;
-
-    if(!fline.empty())
-    {
-      list<Data>::iterator it;
-      int il=0;
-      for(it=lines.begin(); it!=lines.end(); ++it)
+      imax = 0;
+      for(ibin=1; ibin<nbin; ibin++)
       {
-        Data& line = *(it);
-        DataLC line_output(line.time.size());
-
-        flux = new double [line.time.size()*num_ps];
-        error = new double [line.time.size()*num_ps];
-        for(i=0; i<num_ps; i++)
-        {
-          align_line((double *)posterior_sample + i*num_params, il);
-          for(j=0; j<line.time.size(); j++)
-          {
-            flux[j * num_ps + i] = line.flux[j];
-            error[j * num_ps + i] = line.error[j];
-          }
-        }
-  
-        /* sort, and use the media value */
-        for(j=0; j<line.time.size(); j++)
-        {
-          error_min =  DBL_MAX;
-          error_max = -DBL_MAX;
-          for(i=0; i<num_ps; i++)
-          {
-            error_min = fmin(error_min, error[j * num_ps + i]);
-            error_max = fmax(error_max, error[j * num_ps + i]);
-          }
-          if(error_min == error_max)
-          {
-            error_min -= 0.01*error_min;
-            error_max += 0.01*error_max;
-          }
-
-          gsl_histogram_reset(he);
-          gsl_histogram_set_ranges_uniform(he, error_min, error_max);
-          for(i=0; i<num_ps; i++)
-          {
-            gsl_histogram_increment(he, error[j * num_ps + i]);
-          }
-          line_output.error[j] = 0.5*(he->range[gsl_histogram_max_bin(he)] + he->range[gsl_histogram_max_bin(he)+1]);
-          
-          /* ascending order */
-          qsort(flux+j*num_ps, num_ps, sizeof(double), compare);
-          line_output.flux[j] = flux[j*num_ps + (int)(0.5*num_ps)];
-          /* include error of scale and shift */
-          error_scale_shift = 0.5*( (line_output.flux[j] - flux[j*num_ps + (int)(0.1585*num_ps)])
-                                 +(flux[j*num_ps + (int)(0.8415*num_ps)] - line_output.flux[j]) );
-          line_output.error[j] = sqrt(line_output.error[j]*line_output.error[j] + error_scale_shift*error_scale_shift);
-        }
-
-        line.flux = line_output.flux;
-        line.error = line_output.error;
-        delete[] flux;
-        delete[] error;
-        il++;
+        if(hist[ibin] > hist[imax])
+          imax = ibin;
       }
+      em = 0.5*(range[imax] + range[imax+1]);
     }
-    gsl_histogram_free(he);
-  }
-  else /* error propagate */
-  {
-    align_with_error();
-  }
 
-  delete[] post_model;
-  delete[] posterior_sample;
+    /* median and 1-sigma quantiles, each selection works on a partition of the former */
+    std::nth_element(f, f+im, f+num_ps);
+    fm = f[im];
+    std::nth_element(f, f+ilo, f+im);
+    flo = f[ilo];
+    std::nth_element(f+im+1, f+ihi, f+num_ps);
+    fhi = f[ihi];
+
+    /* include error of scale and shift */
+    error_scale_shift = 0.5*((fm - flo) + (fhi - fm));
+    data.flux[j] = fm;
+    data.error[j] = sqrt(em*em + error_scale_shift*error_scale_shift);
+  }
 }
 
 void Cali::output()
 {
   int i, j;
   ofstream fout;
+  double t0 = dnest_wtime();
+
   fout.open(fcont+"_cali");
   for(i=0; i<cont.time.size(); i++)
   {
@@ -1743,7 +2779,7 @@ void Cali::output()
     }
   }
 
-  fout.open("data/factor.txt");
+  fout.open(work_dir + "/data/factor.txt");
   fout<<"Code \t Scale  \t Error  \t Shift  \t Error    \t     Cov    \tSyserr_Cont    \t Err_Scale";
   if(!fline.empty())
   {
@@ -1773,7 +2809,7 @@ void Cali::output()
   }
   fout.close();
 
-  fout.open("data/PyCALI_output.txt");
+  fout.open(work_dir + "/data/PyCALI_output.txt");
   fout<<"# mean of continuum: "<<fcont<<endl;
   for(i=0; i<ncode; i++)
   {
@@ -1796,82 +2832,23 @@ void Cali::output()
     }
   }
   fout.close();
+  time_stages["output"] = dnest_wtime() - t0;
 }
 
 void Cali::recon()
 {
-  double *Lbuf, *ybuf, *y, *Cq, *yq, *W, *D, *phi;
-  double *USmat, *PEmat1, *PEmat2;
-  double syserr;
-
-  double *pm = (double *)best_params;
-  double sigma, sigma2, tau;
-  int i, info, nq;
-  int nd_cont = cont.time.size(), nd_cont_recon = cont_recon.time.size();
-
-  syserr = 0.0;
-  tau = exp(pm[1]);
-  sigma = exp(pm[0]) * sqrt(tau);
-  sigma2 = sigma*sigma;
-  
-  nq = 1;
-  Lbuf = workspace;
-  ybuf = Lbuf + nd_cont*nq; 
-  y = ybuf + nd_cont;
-  Cq = y + nd_cont;
-  yq = Cq + nq*nq;
-
-  W = new double [size_recon_max];
-  D = new double [size_recon_max];
-  phi = new double [size_recon_max];
-  USmat = new double [size_recon_max * size_max];
-  PEmat1 = new double [size_recon_max * size_max];
-  PEmat2 = new double [size_recon_max * size_recon_max];
-
-  compute_semiseparable_drw(cont.time.data(), nd_cont, sigma2, 1.0/tau, cont.error.data(), syserr, W, D, phi);
-  // Cq^-1 = L^TxC^-1xL
-  multiply_mat_semiseparable_drw(Larr_data, W, D, phi, nd_cont, nq, sigma2, Lbuf);
-  multiply_mat_MN_transposeA(Larr_data, Lbuf, Cq, nq, nq, nd_cont);
-
-  // L^TxC^-1xy
-  multiply_matvec_semiseparable_drw(cont.flux.data(), W, D, phi, nd_cont, sigma2, ybuf);
-  multiply_mat_MN_transposeA(Larr_data, ybuf, yq, nq, 1, nd_cont);
-
-  // (hat q) = Cqx(L^TxC^-1xy)
-  inverse_pomat(Cq, nq, &info);
-  multiply_mat_MN(Cq, yq, ybuf, nq, 1, nq);
-  for(i=0; i<nq; i++)
-    yq[i] = ybuf[i];
-  
-  // y = yc - Lxq
-  multiply_matvec_MN(Larr_data, nd_cont, nq, yq, ybuf);
-  for(i=0; i<nd_cont; i++)
-  {
-    y[i] = cont.flux[i] - ybuf[i];
-  }
-  
-  set_covar_Umat_cont(sigma, tau, USmat);
-  // (hat s) = SxC^-1xy
-  multiply_matvec_semiseparable_drw(y, W, D, phi, nd_cont, sigma2, ybuf);
-  multiply_matvec_MN(USmat, nd_cont_recon, nd_cont, ybuf, cont_recon.flux.data());
-
-  // SxC^-1xS^T
-  multiply_mat_transposeB_semiseparable_drw(USmat, W, D, phi, nd_cont, nd_cont_recon, sigma2, PEmat1);
-  multiply_mat_MN(USmat, PEmat1, PEmat2, nd_cont_recon, nd_cont_recon, nd_cont);
-
-  for(i=0; i<nd_cont_recon; i++)
-  {
-    cont_recon.error[i] = sqrt(sigma2 + syserr*syserr - PEmat2[i*nd_cont_recon + i]);
-  }
+  int i;
+  double t0 = dnest_wtime();
 
-  for(i=0; i<nd_cont_recon; i++)
+  predict(-1, cont_recon.time.data(), cont_recon.time.size(), cont_recon.flux.data(), cont_recon.error.data());
+  for(i=0; i<cont_recon.time.size(); i++)
   {
-    cont_recon.flux[i] += yq[0];
+    cont_recon.error[i] = sqrt(cont_recon.error[i]);
   }
 
   ofstream fout;
   fout.open(fcont+"_recon");
-  for(i=0; i<nd_cont_recon; i++)
+  for(i=0; i<cont_recon.time.size(); i++)
   {
     fout<<scientific
         <<cont_recon.time[i]<<"   "<<cont_recon.flux[i]*cont.norm<<"  "<<cont_recon.error[i]*cont.norm<<endl;
@@ -1890,64 +2867,16 @@ void Cali::recon()
     {
       Data& line = *(it);
       DataLC& line_recon = *(itr);
-      int nd_line = line.time.size(), nd_line_recon = line_recon.time.size();
-      
-      syserr = 0.0;
-      tau = exp(pm[3]);
-      sigma = exp(pm[2]) * sqrt(tau);
-      sigma2 = sigma*sigma;
-      
-      nq = 1;
-      Lbuf = workspace;
-      ybuf = Lbuf + nd_line*nq; 
-      y = ybuf + nd_line;
-      Cq = y + nd_line;
-      yq = Cq + nq*nq;
-  
-      compute_semiseparable_drw(line.time.data(), nd_line, sigma2, 1.0/tau, line.error.data(), syserr, W, D, phi);
-      // Cq^-1 = L^TxC^-1xL
-      multiply_mat_semiseparable_drw(Larr_data, W, D, phi, nd_line, nq, sigma2, Lbuf);
-      multiply_mat_MN_transposeA(Larr_data, Lbuf, Cq, nq, nq, nd_line);
-  
-      // L^TxC^-1xy
-      multiply_matvec_semiseparable_drw(line.flux.data(), W, D, phi, nd_line, sigma2, ybuf);
-      multiply_mat_MN_transposeA(Larr_data, ybuf, yq, nq, 1, nd_line);
-  
-      // (hat q) = Cqx(L^TxC^-1xy)
-      inverse_pomat(Cq, nq, &info);
-      multiply_mat_MN(Cq, yq, ybuf, nq, 1, nq);
-      for(i=0; i<nq; i++)
-        yq[i] = ybuf[i];
-    
-      // y = yc - Lxq
-      multiply_matvec_MN(Larr_data, nd_line, nq, yq, ybuf);
-      for(i=0; i<nd_line; i++)
-      {
-        y[i] = line.flux[i] - ybuf[i];
-      }
-    
-      set_covar_Umat_line(sigma, tau, USmat, il);
-      // (hat s) = SxC^-1xy
-      multiply_matvec_semiseparable_drw(y, W, D, phi, nd_line, sigma2, ybuf);
-      multiply_matvec_MN(USmat, nd_line_recon, nd_line, ybuf, line_recon.flux.data());
-  
-      // SxC^-1xS^T
-      multiply_mat_transposeB_semiseparable_drw(USmat, W, D, phi, nd_line, nd_line_recon, sigma2, PEmat1);
-      multiply_mat_MN(USmat, PEmat1, PEmat2, nd_line_recon, nd_line_recon, nd_line);
-  
-      for(i=0; i<nd_line_recon; i++)
-      {
-        line_recon.error[i] = sqrt(sigma2 + syserr*syserr - PEmat2[i*nd_line_recon + i]);
-      }
-  
-      for(i=0; i<nd_line_recon; i++)
+
+      predict(il, line_recon.time.data(), line_recon.time.size(), line_recon.flux.data(), line_recon.error.data());
+      for(i=0; i<line_recon.time.size(); i++)
       {
-        line_recon.flux[i] += yq[0];
+        line_recon.error[i] = sqrt(line_recon.error[i]);
       }
   
       ofstream fout;
       fout.open(*(ifl)+"_recon");
-      for(i=0; i<nd_line_recon; i++)
+      for(i=0; i<line_recon.time.size(); i++)
       {
         fout<<scientific
             <<line_recon.time[i]<<"   "<<line_recon.flux[i]*line.norm<<"  "<<line_recon.error[i]*line.norm<<endl;
@@ -1959,54 +2888,800 @@ void Cali::recon()
       il++;
     }
   }
-
-  delete[] D;
-  delete[] W;
-  delete[] phi;
-  delete[] USmat;
-  delete[] PEmat1;
-  delete[] PEmat2;
+  time_stages["recon"] = dnest_wtime() - t0;
 }
-void Cali::set_covar_Umat_cont(double sigma, double tau, double *USmat)
+
+/*
+ * predict the light curve at times tq with best_params, conditioned on the aligned data.
+ * il: -1 for the continuum, otherwise the il-th line, counting from 0.
+ * flux_q and var_q are the mean and variance in units of the normalized flux.
+ * tq needs not to be sorted.
+ */
+void Cali::predict(int il, double *tq, int n_query, double *flux_q, double *var_q)
 {
-  double t1, t2;
-  int i, j;
- 
-  for(i=0; i<cont_recon.time.size(); i++)
+  double *Lbuf, *ybuf, *y, *Cq, *yq, *W, *D, *phi;
+  double *work, *ts, *ys, *vs;
+  double syserr;
+  double *pm = (double *)best_params;
+  double sigma, sigma2, tau;
+  int i, info, nq, nd;
+  Data *pdata;
+  
+  if(il < 0)
   {
-    t1 = cont_recon.time[i];
-    for(j=0; j<cont.time.size(); j++)
-    {
-      t2 = cont.time[j];
-      USmat[i*cont.time.size()+j] = sigma*sigma * exp (- fabs(t1-t2) / tau );
-    }
+    pdata = &cont;
+    tau = exp(pm[1]);
+    sigma = exp(pm[0]) * sqrt(tau);
   }
-  return;
-}
-void Cali::set_covar_Umat_line(double sigma, double tau, double *USmat, unsigned int il)
-{
-  double t1, t2;
-  int i, j;
-  
-  list<Data>::iterator it = lines.begin();
+  else 
+  {
+    list<Data>::iterator it = lines.begin();
+    advance(it, il);
+    pdata = &(*it);
+    tau = exp(pm[3+2*il]);
+    sigma = exp(pm[2+2*il]) * sqrt(tau);
+  }
+  Data& data = *pdata;
+  nd = data.time.size();
+
+  syserr = 0.0;
+  sigma2 = sigma*sigma;
+  
+  nq = 1;
+  Lbuf = workspace;
+  ybuf = Lbuf + nd*nq; 
+  y = ybuf + nd;
+  Cq = y + nd;
+  yq = Cq + nq*nq;
+
+  W = new double [nd];
+  D = new double [nd];
+  phi = new double [nd];
+  /* linear in the number of points, see recon_kalman_drw() */
+  work = new double [5*(nd + n_query)];
+  ts = new double [3*n_query];
+  ys = ts + n_query;
+  vs = ys + n_query;
+
+  compute_semiseparable_drw(data.time.data(), nd, sigma2, 1.0/tau, data.error.data(), syserr, W, D, phi);
+  // Cq^-1 = L^TxC^-1xL
+  multiply_mat_semiseparable_drw(Larr_data, W, D, phi, nd, nq, sigma2, Lbuf);
+  multiply_mat_MN_transposeA(Larr_data, Lbuf, Cq, nq, nq, nd);
+
+  // L^TxC^-1xy
+  multiply_matvec_semiseparable_drw(data.flux.data(), W, D, phi, nd, sigma2, ybuf);
+  multiply_mat_MN_transposeA(Larr_data, ybuf, yq, nq, 1, nd);
+
+  // (hat q) = Cqx(L^TxC^-1xy)
+  inverse_pomat(Cq, nq, &info);
+  multiply_mat_MN(Cq, yq, ybuf, nq, 1, nq);
+  for(i=0; i<nq; i++)
+    yq[i] = ybuf[i];
+  
+  // y = yc - Lxq
+  multiply_matvec_MN(Larr_data, nd, nq, yq, ybuf);
+  for(i=0; i<nd; i++)
+  {
+    y[i] = data.flux[i] - ybuf[i];
+  }
+
+  /* the smoother runs over sorted times */
+  vector<int> idx(n_query);
+  iota(idx.begin(), idx.end(), 0);
+  stable_sort(idx.begin(), idx.end(), [tq](int a, int b){return tq[a] < tq[b];});
+  for(i=0; i<n_query; i++)
+  {
+    ts[i] = tq[idx[i]];
+  }
+  
+  // (hat s) = SxC^-1xy and its variance S_0 - SxC^-1xS^T, by a Kalman smoother
+  recon_kalman_drw(data.time.data(), y, data.error.data(), nd, syserr, sigma2, 1.0/tau, 
+                   ts, n_query, ys, vs, work);
+
+  for(i=0; i<n_query; i++)
+  {
+    flux_q[idx[i]] = ys[i] + yq[0];
+    var_q[idx[i]] = vs[i] + syserr*syserr;
+  }
+
+  delete[] D;
+  delete[] W;
+  delete[] phi;
+  delete[] work;
+  delete[] ts;
+}
+/*
+ * posterior-predictive reconstruction.
+ * draw nrecon posterior samples, and for each a realization of the DRW conditioned on the 
+ * data aligned with that sample, on the reconstruction grid. the mean level q is also drawn 
+ * from its conditional distribution.
+ * 
+ * the realizations are streamed to a binary file xxx_recon_sample.bin (nrecon rows, 
+ * one column for each time of the grid), readable by pycali.read_binary(); 
+ * the median and 1-sigma quantiles at each time are written to xxx_recon_quantile.
+ */
+void Cali::recon_posterior(int nrecon)
+{
+  int i, k, kb, nb, nq, nd, il, ntot;
+  int *ips;
+  double *real, *gauss, norm;
+  gsl_rng *gsl_r;
+  FILE *fp;
+  string fname;
+  list<Data>::iterator it = lines.begin();
   list<DataLC>::iterator itr = lines_recon.begin();
-  advance(it, il);
-  advance(itr, il);
+  list<string>::iterator ifl = fline.begin();
+  double t0 = dnest_wtime();
 
-  Data& line = *(it);
-  DataLC& line_recon = *(itr);
+  if(posterior_sample == NULL)
+  {
+    load_posterior_sample();
+  }
+  if(nrecon < 1)
+  {
+    cout<<"nrecon must be positive."<<endl;
+    exit(-1);
+  }
+  
+  /* draw posterior samples */
+  gsl_r = gsl_rng_alloc(gsl_rng_default);
+#ifndef Debug
+  if(seed != 0)
+    gsl_rng_set(gsl_r, seed + num_threads + 1);
+  else
+    gsl_rng_set(gsl_r, time(NULL));
+#else
+  gsl_rng_set(gsl_r, 7777);
+#endif
+  ips = new int [nrecon];
+  for(k=0; k<nrecon; k++)
+  {
+    ips[k] = gsl_rng_uniform_int(gsl_r, num_ps);
+  }
+
+  /* realizations are computed in blocks of nb and then written out */
+  nb = 8*num_threads;
+  nb = nb < nrecon ? nb : nrecon;
 
-  for(i=0; i<line_recon.time.size(); i++)
+  for(il=-1; il<(int)lines.size(); il++)
   {
-    t1 = line_recon.time[i];
-    for(j=0; j<line.time.size(); j++)
+    Data& data = (il < 0) ? cont : *(it);
+    DataLC& data_recon = (il < 0) ? cont_recon : *(itr);
+    fname = (il < 0) ? fcont : *(ifl);
+    nd = data.time.size();
+    nq = data_recon.time.size();
+    norm = data.norm;
+    ntot = nd + nq + 1;
+
+    real = new double [nb * nq];
+    gauss = new double [nb * ntot];
+
+    fp = fopen((fname+"_recon_sample.bin").c_str(), "wb");
+    if(fp == NULL)
+    {
+      cout<<"Error: Cannot open file "<<fname<<"_recon_sample.bin."<<endl;
+      exit(-1);
+    }
+    int layout[3] = {nrecon, nq, il};
+    dnest_write_bin_header(fp, nq, nrecon, layout, 3);
+
+    for(kb=0; kb<nrecon; kb+=nb)
+    {
+      int nk = (nrecon - kb < nb) ? (nrecon - kb) : nb;
+      /* random numbers are drawn serially so that the results do not depend on threads */
+      for(i=0; i<nk*ntot; i++)
+      {
+        gauss[i] = gsl_ran_ugaussian(gsl_r);
+      }
+
+#ifdef _OPENMP
+      #pragma omp parallel for num_threads(num_threads) schedule(dynamic)
+#endif
+      for(k=0; k<nk; k++)
+      {
+        recon_realization(il, posterior_sample + (size_t)ips[kb+k]*num_params, data_recon.time.data(), nq,
+                          gauss + (size_t)k*ntot, real + (size_t)k*nq);
+        for(int j=0; j<nq; j++)
+          real[(size_t)k*nq + j] *= norm;
+      }
+      fwrite(real, sizeof(double), (size_t)nk*nq, fp);
+    }
+    fclose(fp);
+    delete[] real;
+    delete[] gauss;
+
+    /* pointwise quantiles from the mapped file */
+    DNestBinHeader header;
+    size_t map_size;
+    double *sample, *col, qm, qlo, qhi;
+    int im, ilo, ihi;
+
+    sample = dnest_mmap_bin((fname+"_recon_sample.bin").c_str(), &header, &map_size);
+    if(sample == NULL)
+      exit(-1);
+    col = new double [nrecon];
+    im = (int)(0.5*nrecon);
+    ilo = (int)(0.1585*nrecon);
+    ihi = (int)(0.8415*nrecon);
+    
+    ofstream fout;
+    fout.open(fname+"_recon_quantile");
+    fout<<"# time   median   15.85%   84.15%"<<endl;
+    for(i=0; i<nq; i++)
+    {
+      for(k=0; k<nrecon; k++)
+      {
+        col[k] = sample[(size_t)k*nq + i];
+      }
+      nth_element(col, col+im, col+nrecon);
+      qm = col[im];
+      nth_element(col, col+ilo, col+im);
+      qlo = col[ilo];
+      if(im+1 < nrecon)
+        nth_element(col+im+1, col+ihi, col+nrecon);
+      qhi = (ihi > im) ? col[ihi] : qm;
+      fout<<scientific<<data_recon.time[i]<<"   "<<qm<<"  "<<qlo<<"  "<<qhi<<endl;
+    }
+    fout.close();
+    delete[] col;
+    dnest_munmap_bin(sample, map_size);
+
+    if(il >= 0)
     {
-      t2 = line.time[j];
-      USmat[i*line.time.size()+j] = sigma*sigma * exp (- fabs(t1-t2) / tau );
+      ++it;
+      ++itr;
+      ++ifl;
     }
   }
+
+  delete[] ips;
+  gsl_rng_free(gsl_r);
+  time_stages["recon_posterior"] = dnest_wtime() - t0;
+}
+
+/*
+ * a realization of the il-th light curve (-1 for the continuum) at times tq, 
+ * conditioned on the data aligned with the parameters model.
+ * gauss: nd+nq+1 standard Gaussian random numbers.
+ * output in units of the normalized flux.
+ */
+void Cali::recon_realization(int il, double *model, double *tq, int nq, double *gauss, double *real)
+{
+  int i, idx, info;
+  double sigma, sigma2, tau, Cq, yq, q;
+  double *ps_scale, *es_shift, *syserr, *error_scale;
+  double *flux, *error, *W, *D, *phi, *Lbuf, *ybuf, *y, *work;
+  Data *pdata;
+
+  ps_scale = model + num_params_var;
+  if(il < 0)
+  {
+    pdata = &cont;
+    es_shift = ps_scale + ncode;
+    syserr = es_shift + ncode;
+    error_scale = syserr + ncode;
+    tau = exp(model[1]);
+    sigma = exp(model[0]) * sqrt(tau);
+  }
+  else 
+  {
+    list<Data>::iterator it = lines.begin();
+    advance(it, il);
+    pdata = &(*it);
+    es_shift = NULL;
+    syserr = ps_scale + (4+2*il)*ncode;
+    error_scale = syserr + ncode;
+    tau = exp(model[3+2*il]);
+    sigma = exp(model[2+2*il]) * sqrt(tau);
+  }
+  Data& data = *pdata;
+  int nd = data.time.size();
+  sigma2 = sigma*sigma;
+
+  flux = new double [8*nd + 5*(nd+nq)];
+  error = flux + nd;
+  W = error + nd;
+  D = W + nd;
+  phi = D + nd;
+  Lbuf = phi + nd;
+  ybuf = Lbuf + nd;
+  y = ybuf + nd;
+  work = y + nd;
+  
+  /* align light curve */
+  for(i=0; i<nd; i++)
+  {
+    idx = data.code[i];
+    flux[i] = data.flux_org[i] * ps_scale[idx];
+    if(es_shift != NULL)
+      flux[i] -= es_shift[idx];
+    error[i] = sqrt(data.error_org[i]*data.error_org[i]*error_scale[idx]*error_scale[idx] 
+                    + syserr[idx]*syserr[idx]) * ps_scale[idx];
+  }
+
+  compute_semiseparable_drw(data.time.data(), nd, sigma2, 1.0/tau, error, 0.0, W, D, phi);
+  // Cq^-1 = L^TxC^-1xL
+  multiply_mat_semiseparable_drw(Larr_data, W, D, phi, nd, 1, sigma2, Lbuf);
+  multiply_mat_MN_transposeA(Larr_data, Lbuf, &Cq, 1, 1, nd);
+  // L^TxC^-1xy
+  multiply_matvec_semiseparable_drw(flux, W, D, phi, nd, sigma2, ybuf);
+  multiply_mat_MN_transposeA(Larr_data, ybuf, &yq, 1, 1, nd);
+
+  // q is drawn from N(Cq x L^TxC^-1xy, Cq)
+  inverse_pomat(&Cq, 1, &info);
+  q = Cq * yq + sqrt(Cq) * gauss[nd+nq];
+
+  for(i=0; i<nd; i++)
+  {
+    y[i] = flux[i] - q;
+  }
+  sample_kalman_drw(data.time.data(), y, error, nd, 0.0, sigma2, 1.0/tau, tq, nq, gauss, real, work);
+  for(i=0; i<nq; i++)
+  {
+    real[i] += q;
+  }
+
+  delete[] flux;
+}
+
+void Cali::allocate_particle_cache(unsigned int np)
+{
+  unsigned int i;
+  size_t nlines = lines.size();
+
+  free_particle_cache();
+
+  num_particles = np;
+  prob_cont_particles = new double[num_particles];
+  prob_cont_particles_perturb = new double[num_particles];
+  update_cont = new bool[num_particles];
+  if(nlines > 0)
+  {
+    prob_line_particles = new double[num_particles*nlines];
+    prob_line_particles_perturb = new double[num_particles*nlines];
+    update_line = new bool[num_particles*nlines];
+  }
+  for(i=0; i<num_particles; i++)
+  {
+    update_cont[i] = true;
+  }
+  for(i=0; i<num_particles*nlines; i++)
+  {
+    update_line[i] = true;
+  }
+  return;
+}
+
+void Cali::free_particle_cache()
+{
+  if(prob_cont_particles != NULL)
+  {
+    delete[] prob_cont_particles;
+    delete[] prob_cont_particles_perturb;
+    delete[] update_cont;
+  }
+  if(prob_line_particles != NULL)
+  {
+    delete[] prob_line_particles;
+    delete[] prob_line_particles_perturb;
+    delete[] update_line;
+  }
+  num_particles = 0;
+  prob_cont_particles = prob_cont_particles_perturb = NULL;
+  prob_line_particles = prob_line_particles_perturb = NULL;
+  update_cont = update_line = NULL;
   return;
 }
+
+/* 
+ * mark the light curve blocks of particle ip that depend on parameter "which".
+ */
+void Cali::set_update_flags(int which, unsigned int ip)
+{
+  unsigned int il;
+  size_t nlines = lines.size();
+  int idx_line_syserr = num_params_var + 4*ncode;
+
+  if(ip >= num_particles)
+    return;
+
+  if(which < 2)  /* DRW of continuum */
+  {
+    update_cont[ip] = true;
+  }
+  else if(which < num_params_var) /* DRW of lines */
+  {
+    update_line[ip*nlines + (which-2)/2] = true;
+  }
+  else if(which < num_params_var + (int)ncode) /* scale, applies to continuum and lines */
+  {
+    update_cont[ip] = true;
+    for(il=0; il<nlines; il++)
+      update_line[ip*nlines + il] = true;
+  }
+  else if(which < idx_line_syserr) /* shift, syserr and error scale of continuum */
+  {
+    update_cont[ip] = true;
+  }
+  else /* syserr and error scale of lines */
+  {
+    update_line[ip*nlines + (which - idx_line_syserr)/(2*ncode)] = true;
+  }
+  return;
+}
+
+/*
+ * proposal widths start from the full prior ranges, 
+ * and the scale-shift covariances are forgotten.
+ * the widths of each thread grow with the levels it visits, see get_step_width().
+ */
+void Cali::reset_step_width()
+{
+  int i;
+  for(i=0; i<num_threads; i++)
+  {
+    step_width[i].clear();
+    step_tries[i].clear();
+    step_accepts[i].clear();
+    step_rounds[i].clear();
+  }
+  for(i=0; i<3*num_threads; i++)
+    step_last[i] = -1;
+  for(i=0; i<2*num_threads; i++)
+    step_pair[i] = 0.0;
+  for(i=0; i<num_threads*(int)ncode*6; i++)
+    step_covar[i] = 0.0;
+}
+
+/* 
+ * with MPI, each task has its own file, as with the checkpoints of dnest.
+ */
+string Cali::step_restart_file()
+{
+  string fname = work_dir + "/data/restart_step.bin";
+  if(dnest_get_thistask() != 0)
+    fname += "." + to_string(dnest_get_thistask());
+  return fname;
+}
+
+/* 
+ * save the proposal widths, counters, and scale-shift covariances of all threads
+ * to work_dir/data/restart_step.bin along with the checkpoint of dnest, 
+ * so that a resumed run continues with the same proposals. 
+ * only the levels visited by each thread are written.
+ * written to a temporary file first and then renamed.
+ */
+void Cali::save_step_width()
+{
+  FILE *fp;
+  int i, version = STEP_RESTART_VERSION, nt = num_threads;
+  int np = num_params_free, nc = ncode, nlevel;
+  unsigned int count_saves = dnest_get_count_saves();
+  size_t n;
+  string fname = step_restart_file(), ftmp = fname + ".tmp";
+
+  fp = fopen(ftmp.c_str(), "wb");
+  if(fp == NULL)
+  {
+    cout<<"# Cannot write "<<ftmp<<", ignored."<<endl;
+    return;
+  }
+  fwrite(STEP_RESTART_MAGIC, 1, 8, fp);
+  fwrite(&version, sizeof(int), 1, fp);
+  fwrite(&nt, sizeof(int), 1, fp);
+  fwrite(&np, sizeof(int), 1, fp);
+  fwrite(&nc, sizeof(int), 1, fp);
+  fwrite(&count_saves, sizeof(unsigned int), 1, fp);
+  for(i=0; i<num_threads; i++)
+  {
+    n = step_width[i].size();
+    nlevel = (np > 0) ? n/np : 0;
+    fwrite(&nlevel, sizeof(int), 1, fp);
+    fwrite(step_width[i].data(), sizeof(double), n, fp);
+    fwrite(step_tries[i].data(), sizeof(unsigned int), n, fp);
+    fwrite(step_accepts[i].data(), sizeof(unsigned int), n, fp);
+    fwrite(step_rounds[i].data(), sizeof(unsigned int), n, fp);
+  }
+  fwrite(step_last, sizeof(int), 3*num_threads, fp);
+  fwrite(step_pair, sizeof(double), 2*num_threads, fp);
+  fwrite(step_covar, sizeof(double), (size_t)num_threads*ncode*6, fp);
+  if(fclose(fp) != 0 || rename(ftmp.c_str(), fname.c_str()) != 0)
+  {
+    cout<<"# Cannot write "<<fname<<", ignored."<<endl;
+  }
+}
+
+/* 
+ * load the proposal widths saved by save_step_width(), called after dnest 
+ * restores its checkpoint. if missing or not of the same checkpoint, 
+ * the widths start afresh.
+ */
+void Cali::load_step_width()
+{
+  FILE *fp;
+  int i, version, nt, nlevel, np, nc;
+  unsigned int count_saves;
+  size_t n, nn = (size_t)num_threads*ncode*6;
+  char magic[8];
+  string fname = step_restart_file();
+  bool flag;
+
+  fp = fopen(fname.c_str(), "rb");
+  if(fp == NULL)
+  {
+    cout<<"# No "<<fname<<", proposal widths start afresh."<<endl;
+    return;
+  }
+
+  flag = (fread(magic, 1, 8, fp) == 8 && memcmp(magic, STEP_RESTART_MAGIC, 8) == 0)
+      && (fread(&version, sizeof(int), 1, fp) == 1 && version == STEP_RESTART_VERSION)
+      && (fread(&nt, sizeof(int), 1, fp) == 1 && nt == num_threads)
+      && (fread(&np, sizeof(int), 1, fp) == 1 && np == num_params_free)
+      && (fread(&nc, sizeof(int), 1, fp) == 1 && nc == (int)ncode)
+      && (fread(&count_saves, sizeof(unsigned int), 1, fp) == 1 && count_saves == dnest_get_count_saves());
+  for(i=0; flag && i<num_threads; i++)
+  {
+    /* the number of levels saved by each thread, at most that of dnest */
+    flag = fread(&nlevel, sizeof(int), 1, fp) == 1 && nlevel >= 0 && nlevel <= LEVEL_NUM_MAX;
+    if(!flag)
+      break;
+    n = (size_t)nlevel*num_params_free;
+    step_width[i].resize(n);
+    step_tries[i].resize(n);
+    step_accepts[i].resize(n);
+    step_rounds[i].resize(n);
+    flag = fread(step_width[i].data(), sizeof(double), n, fp) == n
+        && fread(step_tries[i].data(), sizeof(unsigned int), n, fp) == n
+        && fread(step_accepts[i].data(), sizeof(unsigned int), n, fp) == n
+        && fread(step_rounds[i].data(), sizeof(unsigned int), n, fp) == n;
+  }
+  flag = flag
+      && fread(step_last, sizeof(int), 3*num_threads, fp) == (size_t)3*num_threads
+      && fread(step_pair, sizeof(double), 2*num_threads, fp) == (size_t)2*num_threads
+      && fread(step_covar, sizeof(double), nn, fp) == nn;
+  fclose(fp);
+
+  for(i=0; flag && i<num_threads; i++)
+  {
+    /* the last move must lie in the levels saved */
+    flag = step_last[3*i] < (int)(step_width[i].size()/(num_params_free > 0 ? num_params_free : 1))
+        && step_last[3*i+1] < num_params_free && step_last[3*i+2] < (int)ncode;
+  }
+
+  if(!flag)
+  {
+    cout<<"# Invalid "<<fname<<", proposal widths start afresh."<<endl;
+    reset_step_width();
+  }
+}
+
+/* 
+ * width of a move of the k-th free parameter of a particle at the given level, 
+ * in units of the prior range. the width is tuned from the acceptance rate of 
+ * its last STEP_ADAPT_INTERVAL tries, with a gain that decreases as the tuning 
+ * goes on; a level visited for the first time takes the width of the level below.
+ * each thread has its own widths, as each thread has its own copy of levels, 
+ * and only the calling thread grows its arrays.
+ */
+double Cali::get_step_width(int level, int k)
+{
+  int tid = dnest_get_thread_num(), nlevel;
+  size_t idx, n;
+  double rate;
+  vector<double>& width = step_width[tid];
+  vector<unsigned int>& tries = step_tries[tid], &accepts = step_accepts[tid], &rounds = step_rounds[tid];
+
+  if(level >= LEVEL_NUM_MAX)
+    level = LEVEL_NUM_MAX-1;
+  nlevel = width.size()/num_params_free;
+  if(level >= nlevel)
+  {
+    n = (size_t)(level+1)*num_params_free;
+    width.resize(n, 1.0);
+    tries.resize(n, 0);
+    accepts.resize(n, 0);
+    rounds.resize(n, 0);
+  }
+  idx = (size_t)level*num_params_free + k;
+
+  if(level > 0 && rounds[idx] == 0 && tries[idx] == 0)
+  {
+    width[idx] = width[idx - num_params_free];
+  }
+  else if(tries[idx] >= STEP_ADAPT_INTERVAL)
+  {
+    rate = (double)accepts[idx]/tries[idx];
+    rounds[idx]++;
+    width[idx] *= exp(2.0*(rate - STEP_TARGET_RATE)/sqrt((double)rounds[idx]));
+    width[idx] = fmax(fmin(width[idx], 1.0), STEP_WIDTH_MIN);
+    tries[idx] = accepts[idx] = 0;
+  }
+
+  tries[idx]++;
+  step_last[3*tid] = level;
+  step_last[3*tid+1] = k;
+  step_last[3*tid+2] = -1;
+  return width[idx];
+}
+
+/* 
+ * the last move of the calling thread is a joint move of the scale and shift of a code, 
+ * the proposed pair enters the covariance only if accepted, see accept_step_width().
+ */
+void Cali::set_step_pair(int code, double scale, double shift)
+{
+  int tid = dnest_get_thread_num();
+  step_last[3*tid+2] = code;
+  step_pair[2*tid] = scale;
+  step_pair[2*tid+1] = shift;
+}
+
+/* 
+ * the last move of the calling thread is accepted.
+ */
+void Cali::accept_step_width()
+{
+  int tid = dnest_get_thread_num();
+  if(step_last[3*tid] < 0)
+    return;
+  step_accepts[tid][(size_t)step_last[3*tid]*num_params_free + step_last[3*tid+1]]++;
+  if(step_last[3*tid+2] >= 0)
+    update_step_covar(step_last[3*tid+2], step_pair[2*tid], step_pair[2*tid+1]);
+}
+
+/* 
+ * add an accepted scale and shift of a code to the running 
+ * covariance of the calling thread, with exponential forgetting.
+ */
+void Cali::update_step_covar(int code, double scale, double shift)
+{
+  double *c = step_covar + ((size_t)dnest_get_thread_num()*ncode + code)*6;
+  double a, dx, dy;
+
+  c[0] += 1.0;
+  a = 1.0/fmin(c[0], (double)STEP_COVAR_MEMORY);
+  dx = scale - c[1];
+  dy = shift - c[2];
+  c[1] += a*dx;
+  c[2] += a*dy;
+  c[3] = (1.0-a)*(c[3] + a*dx*dx);
+  c[4] = (1.0-a)*(c[4] + a*dx*dy);
+  c[5] = (1.0-a)*(c[5] + a*dy*dy);
+}
+
+/* 
+ * regression of shift on scale (from_scale = true) or the other way round, 
+ * the partner moves by slope times the move plus a scatter of the given std.
+ * before enough moves are seen, the partner follows with a slope of 1 and 
+ * a scatter of 0.1.
+ */
+void Cali::get_step_coupling(int code, bool from_scale, double *slope, double *scatter)
+{
+  double *c = step_covar + ((size_t)dnest_get_thread_num()*ncode + code)*6;
+  double vx = c[3], vy = c[5];
+
+  if(!from_scale)
+  {
+    vx = c[5];
+    vy = c[3];
+  }
+
+  if(c[0] < STEP_COVAR_MIN || vx <= 0.0)
+  {
+    *slope = 1.0;
+    *scatter = 0.1;
+    return;
+  }
+  *slope = c[4]/vx;
+  *scatter = sqrt(fmax(vy - c[4]*c[4]/vx, 0.0));
+}
+
+void Cali::reset_profile()
+{
+  int i;
+  for(i=0; i<PROF_STRIDE*num_threads; i++)
+  {
+    prof_time[i] = 0.0;
+    prof_count[i] = 0;
+  }
+  time_stages.clear();
+}
+
+/*
+ * timers (seconds) and counters of the last mcmc run and of the stages called so far. 
+ * times of likelihood, align, semiseparable, and solve are summed over threads 
+ * (the last three are estimated from one in every PROF_INTERVAL calls), 
+ * the others are wall-clock times.
+ */
+void Cali::get_profile(map<string, double>& times, map<string, unsigned long long int>& counts, 
+                       vector<double>& level_accept_rates)
+{
+  int i, j, num_levels;
+  double time_sampling, time_likelihood, time_io, time_convergence, time_postprocess;
+  unsigned long long int bytes_written, *accepts, *tries;
+  map<string, double>::iterator it;
+
+  times.clear();
+  counts.clear();
+  level_accept_rates.clear();
+
+  dnest_get_timing(sampler, &time_sampling, &time_likelihood);
+  dnest_get_io_stats(sampler, &time_io, &time_convergence, &time_postprocess, &bytes_written);
+  times["sampling"] = time_sampling;
+  times["likelihood"] = time_likelihood;
+  times["io"] = time_io;
+  times["convergence"] = time_convergence;
+  times["postprocess"] = time_postprocess;
+  times["align"] = times["semiseparable"] = times["solve"] = 0.0;
+  counts["likelihood"] = counts["cont"] = counts["line"] = 0;
+  for(i=0; i<num_threads; i++)
+  {
+    /* timed once every PROF_INTERVAL calls */
+    times["align"] += prof_time[i*PROF_STRIDE + PROF_ALIGN] * PROF_INTERVAL;
+    times["semiseparable"] += prof_time[i*PROF_STRIDE + PROF_SEMISEPARABLE] * PROF_INTERVAL;
+    times["solve"] += prof_time[i*PROF_STRIDE + PROF_SOLVE] * PROF_INTERVAL;
+    counts["likelihood"] += prof_count[i*PROF_STRIDE + PROF_LIKELIHOOD];
+    counts["cont"] += prof_count[i*PROF_STRIDE + PROF_CONT];
+    counts["line"] += prof_count[i*PROF_STRIDE + PROF_LINE];
+  }
+  for(it=time_stages.begin(); it!=time_stages.end(); ++it)
+  {
+    times[it->first] = it->second;
+  }
+
+  counts["steps"] = dnest_get_steps_sampling(sampler);
+  counts["bytes_written"] = bytes_written;
+  counts["num_threads"] = num_threads;
+  
+  num_levels = dnest_get_level_stats(sampler, &accepts, &tries);
+  counts["num_levels"] = num_levels;
+  for(j=0; j<num_levels; j++)
+  {
+    level_accept_rates.push_back(tries[j] > 0 ? (double)accepts[j]/tries[j] : 0.0);
+  }
+}
+
+/* 
+ * save the profile in JSON, by default to work_dir/data/profile.json 
+ */
+void Cali::save_profile(const string& fname)
+{
+  map<string, double> times;
+  map<string, unsigned long long int> counts;
+  vector<double> level_accept_rates;
+  map<string, double>::iterator it;
+  map<string, unsigned long long int>::iterator ic;
+  string fprof = fname.empty() ? work_dir + "/data/profile.json" : fname;
+  FILE *fp;
+  size_t i;
+
+  get_profile(times, counts, level_accept_rates);
+
+  fp = fopen(fprof.c_str(), "w");
+  if(fp == NULL)
+  {
+    cout<<"Cannot open file "<<fprof<<endl;
+    exit(-1);
+  }
+  fprintf(fp, "{\n  \"time\": {");
+  for(it=times.begin(); it!=times.end(); ++it)
+  {
+    fprintf(fp, "%s\n    \"%s\": %.6e", (it==times.begin()?"":","), it->first.c_str(), it->second);
+  }
+  fprintf(fp, "\n  },\n  \"count\": {");
+  for(ic=counts.begin(); ic!=counts.end(); ++ic)
+  {
+    fprintf(fp, "%s\n    \"%s\": %llu", (ic==counts.begin()?"":","), ic->first.c_str(), ic->second);
+  }
+  fprintf(fp, "\n  },\n  \"level_accept_rate\": [");
+  for(i=0; i<level_accept_rates.size(); i++)
+  {
+    fprintf(fp, "%s%.6f", (i==0?"":", "), level_accept_rates[i]);
+  }
+  fprintf(fp, "]\n}\n");
+  fclose(fp);
+}
+
 double Cali::get_norm_cont()
 {
   return cont.norm;
@@ -2018,158 +3693,374 @@ double Cali::get_norm_line(unsigned int il)
   Data& line = *(it);
   return line.norm;
 }
-/*=============================================================*/
-double prob_cali(const void *model, const void *arg)
+/*
+ * log-likelihood of a light curve with a DRW model, 
+ * the nq linear coefficients of Larr (nd*nq) are marginalized out, 
+ * i.e., the mean (nq=1), or the mean and offsets of codes (see Cali::initialize()).
+ * 
+ * work is a buffer with a size at least size_work, the aligned 
+ * fluxes and errors are stored in work instead of in data.
+ * phi_in, if not NULL, holds exp(-(t[i]-t[i-1])/tau) computed beforehand.
+ * coef, if not NULL and nq > 1, receives the Cholesky factor of L^T C^-1 L (nq*nq, lower) 
+ * followed by its inverse times L^T C^-1 y (nq).
+ */
+double Cali::prob_drw(Data& data, double *Larr, int nq, double sigma, double tau, double *ps_scale, 
+                      double *es_shift, double *syserr, double *error_scale, double *work, 
+                      double *phi_in, double *coef)
 {
-  Cali *cali = (Cali *)arg;
-  double prob, prob1=0.0, prob2=0.0, lambda, ave_con, lndet, sigma, sigma2, tau;
-  double lndet_n;
-  double *ybuf, *W, *D, *phi, *Cq, *Lbuf, *yq;
-  int i, nq;
-  double *workspace = cali->workspace;
-  double *pm = (double *)model;
-  double *ps_scale = pm + cali->num_params_var;
-  Data &cont = cali->cont;
-  int nd_cont = cont.time.size();
-  double *Larr_data = cali->Larr_data;
-
-  nq = 1;
-  Lbuf = workspace;
-  ybuf = Lbuf + nd_cont*nq;
-  W = ybuf + nd_cont;
-  D = W + nd_cont;
-  phi = D + nd_cont;
-  Cq = phi + nd_cont;
+  double prob, lambda, ave_con, lndet, lndet_n, lndet_q, sigma2;
+  double *ybuf, *W, *D, *phi, *Cq, *Lbuf, *yq, *flux, *error;
+  int i, idx, info;
+  int nd = data.time.size();
+  int tid = dnest_get_thread_num();
+  double t0=0.0, t1=0.0, *ptime = prof_time + tid * PROF_STRIDE;
+  unsigned long long int *pcount = prof_count + tid * PROF_STRIDE;
+  bool timed = ((pcount[PROF_CONT] + pcount[PROF_LINE]) % PROF_INTERVAL == 0);
+
+  if(timed) t0 = dnest_wtime();
+  Lbuf = work;
+  ybuf = Lbuf + nd*nq;
+  W = ybuf + nd;
+  D = W + nd;
+  phi = D + nd;
+  Cq = phi + nd;
   yq = Cq + nq*nq;
+  flux = yq + nq;
+  error = flux + nd;
 
-  tau = exp(pm[1]);
-  sigma = exp(pm[0]) * sqrt(tau);
   sigma2 = sigma*sigma;
-  
-  cali->align(pm);
 
-  compute_semiseparable_drw(cont.time.data(), nd_cont, sigma2, 1.0/tau, cont.error.data(), 0.0, W, D, phi);
+  /* align light curve */
+  for(i=0; i<nd; i++)
+  {
+    idx = data.code[i];
+    flux[i] = data.flux_org[i] * ps_scale[idx];
+    if(es_shift != NULL)
+      flux[i] -= es_shift[idx];
+    error[i] = sqrt(data.error_org[i]*data.error_org[i]*error_scale[idx]*error_scale[idx] 
+                    + syserr[idx]*syserr[idx]) * ps_scale[idx];
+  }
+  if(timed)
+  {
+    t1 = dnest_wtime();
+    ptime[PROF_ALIGN] += t1 - t0;
+  }
+
+  if(phi_in != NULL)
+  {
+    phi = phi_in;
+    compute_semiseparable_drw_phi(phi, nd, sigma2, error, 0.0, W, D);
+  }
+  else
+  {
+    compute_semiseparable_drw(data.time.data(), nd, sigma2, 1.0/tau, error, 0.0, W, D, phi);
+  }
+  if(timed)
+  {
+    t0 = dnest_wtime();
+    ptime[PROF_SEMISEPARABLE] += t0 - t1;
+  }
+
   lndet = 0.0;
-  for(i=0; i<nd_cont; i++)
+  for(i=0; i<nd; i++)
     lndet += log(D[i]);
 
   /* calculate L^T*C^-1*L */
-  multiply_mat_semiseparable_drw(Larr_data, W, D, phi, nd_cont, nq, sigma2, Lbuf);
-  multiply_mat_MN_transposeA(Larr_data, Lbuf, Cq, nq, nq, nd_cont);
+  multiply_mat_semiseparable_drw(Larr, W, D, phi, nd, nq, sigma2, Lbuf);
+  multiply_mat_MN_transposeA(Larr, Lbuf, Cq, nq, nq, nd);
 
   /* calculate L^T*C^-1*y */
-  multiply_matvec_semiseparable_drw(cont.flux.data(), W, D, phi, nd_cont, sigma2, ybuf);
-  multiply_mat_MN_transposeA(Larr_data, ybuf, yq, nq, 1, nd_cont);
+  multiply_matvec_semiseparable_drw(flux, W, D, phi, nd, sigma2, ybuf);
+  multiply_mat_MN_transposeA(Larr, ybuf, yq, nq, 1, nd);
   
-  lambda = Cq[0];
-  ave_con = yq[0]/Cq[0];
+  if(nq == 1)
+  {
+    lambda = Cq[0];
+    ave_con = yq[0]/Cq[0];
 
-/* get the probability */
-  for(i=0;i<nd_cont;i++)
+    /* get the probability */
+    for(i=0;i<nd;i++)
+    {
+      ybuf[i] = flux[i] - ave_con;
+    }
+    multiply_matvec_semiseparable_drw(ybuf, W, D, phi, nd, sigma2, Lbuf);
+    prob = -0.5 * cblas_ddot(nd, ybuf, 1, Lbuf, 1);
+    lndet_q = log(lambda);
+  }
+  else 
   {
-    ybuf[i] = cont.flux[i] - ave_con;
+    /* L^T*C^-1*L = U*U^T, y^T*(C^-1 - C^-1*L*(L^T*C^-1*L)^-1*L^T*C^-1)*y = y^T*C^-1*y - |U^-1*L^T*C^-1*y|^2 */
+    Chol_decomp_L(Cq, nq, &info);
+    if(info != 0)
+      return -DBL_MAX;
+    cblas_dtrsv(CblasRowMajor, CblasLower, CblasNoTrans, CblasNonUnit, nq, Cq, nq, yq, 1);
+    prob = -0.5 * (cblas_ddot(nd, flux, 1, ybuf, 1) - cblas_ddot(nq, yq, 1, yq, 1));
+    lndet_q = 0.0;
+    for(i=0; i<nq; i++)
+      lndet_q += 2.0*log(Cq[i*nq+i]);
+
+    if(coef != NULL)
+    {
+      memcpy(coef, Cq, nq*nq*sizeof(double));
+      memcpy(coef+nq*nq, yq, nq*sizeof(double));
+    }
   }
-  multiply_matvec_semiseparable_drw(ybuf, W, D, phi, nd_cont, sigma2, Lbuf);
-  prob1 = -0.5 * cblas_ddot(nd_cont, ybuf, 1, Lbuf, 1);
   
   lndet_n = 0.0;
-  for(i=0; i<cont.num_code.size(); i++)
+  for(i=0; i<data.num_code.size(); i++)
   {
-    lndet_n += 2.0*log(ps_scale[i]) * cont.num_code[i];
+    lndet_n += 2.0*log(ps_scale[i]) * data.num_code[i];
   }
-  prob1 = prob1 - 0.5*lndet - 0.5*log(lambda) + 0.5 * lndet_n;
-  
-  if(!cali->fline.empty())
+  prob += - 0.5*lndet - 0.5*lndet_q + 0.5 * lndet_n;
+  if(timed)
+    ptime[PROF_SOLVE] += dnest_wtime() - t0;
+  return prob;
+}
+
+double Cali::prob_cont(double *model, double *work, double *phi, double *coef)
+{
+  double sigma, tau;
+  double *ps_scale = model + num_params_var;
+  double *es_shift = ps_scale + ncode;
+  double *syserr = es_shift + ncode;
+  double *error_scale = syserr + ncode;
+
+  tau = exp(model[1]);
+  sigma = exp(model[0]) * sqrt(tau);
+  prof_count[dnest_get_thread_num() * PROF_STRIDE + PROF_CONT]++;
+  return prob_drw(cont, Larr_cont, nq_cont, sigma, tau, ps_scale, es_shift, syserr, error_scale, work, phi, coef);
+}
+
+/* il-th line, counting from 0 */
+double Cali::prob_line(double *model, Data& line, int il, double *work, double *phi)
+{
+  double sigma, tau;
+  double *ps_scale = model + num_params_var;
+  double *syserr = ps_scale + (4+2*il)*ncode;
+  double *error_scale = syserr + ncode;
+
+  tau = exp(model[3+il*2]);
+  sigma = exp(model[2+il*2]) * sqrt(tau);
+  prof_count[dnest_get_thread_num() * PROF_STRIDE + PROF_LINE]++;
+  return prob_drw(line, Larr_data, 1, sigma, tau, ps_scale, NULL, syserr, error_scale, work, phi);
+}
+
+/* log-likelihood of a set of parameters, computed from scratch without the particle caches */
+double Cali::log_likelihood(double *model)
+{
+  double prob;
+  int il;
+  list<Data>::iterator it;
+  double *work = workspace + dnest_get_thread_num() * size_work;
+
+  prob = prob_cont(model, work);
+  for(it=lines.begin(), il=0; it!=lines.end(); ++it, ++il)
+    prob += prob_line(model, *it, il, work);
+  return prob;
+}
+
+/* 
+ * log-likelihoods of nk sets of parameters stored row by row in models.
+ * 
+ * the sets are split across threads in blocks of BATCH_BLOCK, each thread works 
+ * in its own segment of the workspace. within a block, the exponentials of the 
+ * DRW covariance are computed for all sets in one pass for each light curve.
+ */
+void Cali::log_likelihood_batch(double *models, int nk, double *probs)
+{
+  int nblock = (nk + BATCH_BLOCK - 1)/BATCH_BLOCK;
+
+#ifdef _OPENMP
+  #pragma omp parallel num_threads(num_threads)
+#endif
   {
-    unsigned int il;
+    double *work = workspace + dnest_get_thread_num() * size_work;
+    double *phi = new double [BATCH_BLOCK * size_max];
+    double c1[BATCH_BLOCK];
+    int ib, k, kb, nb, il;
     list<Data>::iterator it;
-    il = 0;
-    for(it=cali->lines.begin(); it!=cali->lines.end(); ++it)
+
+#ifdef _OPENMP
+    #pragma omp for schedule(dynamic)
+#endif
+    for(ib=0; ib<nblock; ib++)
     {
-      Data& line = *(it);
-      int nd_line = line.time.size();
-
-      Lbuf = workspace;
-      ybuf = Lbuf + nd_line*nq;
-      W = ybuf + nd_line;
-      D = W + nd_line;
-      phi = D + nd_line;
-      Cq = phi + nd_line;
-      yq = Cq + nq*nq;
-  
-      tau = exp(pm[3+il*2]);
-      sigma = exp(pm[2+il*2])*sqrt(tau);
-      sigma2 = sigma*sigma;
-  
-      compute_semiseparable_drw(line.time.data(), nd_line, sigma2, 1.0/tau, line.error.data(), 0.0, W, D, phi);
-      lndet = 0.0;
-      for(i=0; i<nd_line; i++)
-        lndet += log(D[i]);
-  
-      /* calculate L^T*C^-1*L */
-      multiply_mat_semiseparable_drw(Larr_data, W, D, phi, nd_line, nq, sigma2, Lbuf);
-      multiply_mat_MN_transposeA(Larr_data, Lbuf, Cq, nq, nq, nd_line);
-  
-      /* calculate L^T*C^-1*y */
-      multiply_matvec_semiseparable_drw(line.flux.data(), W, D, phi, nd_line, sigma2, ybuf);
-      multiply_mat_MN_transposeA(Larr_data, ybuf, yq, nq, 1, nd_line);
-    
-      lambda = Cq[0];
-      ave_con = yq[0]/Cq[0];
-  
-      for(i=0;i<nd_line;i++)
-      {
-        ybuf[i] = line.flux[i] - ave_con;
-      }
-      multiply_matvec_semiseparable_drw(ybuf, W, D, phi, nd_line, sigma2, Lbuf);
-      prob2 += -0.5 * cblas_ddot(nd_line, ybuf, 1, Lbuf, 1);
-  
-      lndet_n =  0.0;
-      for(i=0; i<line.num_code.size(); i++)
+      kb = ib * BATCH_BLOCK;
+      nb = (nk - kb < BATCH_BLOCK) ? (nk - kb) : BATCH_BLOCK;
+
+      for(k=0; k<nb; k++)
+        c1[k] = 1.0/exp(models[(size_t)(kb+k)*num_params + 1]);
+      compute_semiseparable_drw_phi_batch(cont.time.data(), cont.time.size(), c1, nb, phi);
+      for(k=0; k<nb; k++)
+        probs[kb+k] = prob_cont(models + (size_t)(kb+k)*num_params, work, phi + k*cont.time.size());
+
+      for(it=lines.begin(), il=0; it!=lines.end(); ++it, ++il)
       {
-        lndet_n += 2.0*log(ps_scale[i]) * line.num_code[i];
+        for(k=0; k<nb; k++)
+          c1[k] = 1.0/exp(models[(size_t)(kb+k)*num_params + 3 + 2*il]);
+        compute_semiseparable_drw_phi_batch(it->time.data(), it->time.size(), c1, nb, phi);
+        for(k=0; k<nb; k++)
+          probs[kb+k] += prob_line(models + (size_t)(kb+k)*num_params, *it, il, work, phi + k*it->time.size());
       }
-  
-      prob2 += - 0.5*lndet - 0.5*log(lambda) + 0.5 * lndet_n;
+    }
+    delete[] phi;
+  }
+}
+/*=============================================================*/
+/* 
+ * likelihood of a perturbed particle, only the blocks marked 
+ * by perturb_cali are recomputed, the rest are taken from 
+ * the cache of the particle.
+ */
+double prob_cali(const void *model, const void *arg)
+{
+  Cali *cali = (Cali *)arg;
+  double prob;
+  unsigned int il, ip, nlines = cali->lines.size();
+  double *pm = cali->expand_model((const double *)model);
+  list<Data>::iterator it;
+  /* each thread works in its own segment of the workspace */
+  double *work = cali->workspace + dnest_get_thread_num() * cali->size_work;
 
-      il++;
-    }    
+  cali->prof_count[dnest_get_thread_num() * PROF_STRIDE + PROF_LIKELIHOOD]++;
+
+  ip = dnest_get_which_particle_update();
+  if(cali->prob_cont_particles == NULL || ip >= cali->num_particles) /* no cache available */
+  {
+    prob = cali->prob_cont(pm, work);
+    for(it=cali->lines.begin(), il=0; it!=cali->lines.end(); ++it, ++il)
+      prob += cali->prob_line(pm, *it, il, work);
+    return prob;
+  }
+
+  if(cali->update_cont[ip])
+    cali->prob_cont_particles_perturb[ip] = cali->prob_cont(pm, work);
+  else
+    cali->prob_cont_particles_perturb[ip] = cali->prob_cont_particles[ip];
+  prob = cali->prob_cont_particles_perturb[ip];
+
+  for(it=cali->lines.begin(), il=0; it!=cali->lines.end(); ++it, ++il)
+  {
+    if(cali->update_line[ip*nlines + il])
+      cali->prob_line_particles_perturb[ip*nlines + il] = cali->prob_line(pm, *it, il, work);
+    else
+      cali->prob_line_particles_perturb[ip*nlines + il] = cali->prob_line_particles[ip*nlines + il];
+    prob += cali->prob_line_particles_perturb[ip*nlines + il];
   }
-  
-  prob = prob1 + prob2;
-  
   return prob;
 }
+/* 
+ * likelihood calculated from scratch, used when initializing or restarting particles.
+ * fill up the cache of the particle.
+ */
+double prob_initial_cali(const void *model, const void *arg)
+{
+  Cali *cali = (Cali *)arg;
+  double prob, prob_line;
+  unsigned int il, ip, nlines = cali->lines.size();
+  double *pm = cali->expand_model((const double *)model);
+  list<Data>::iterator it;
+  double *work = cali->workspace + dnest_get_thread_num() * cali->size_work;
+
+  cali->prof_count[dnest_get_thread_num() * PROF_STRIDE + PROF_LIKELIHOOD]++;
+  if(cali->prob_cont_particles == NULL)
+  {
+    cali->allocate_particle_cache(dnest_get_num_particles());
+  }
+  ip = dnest_get_which_particle_update();
+
+  prob = cali->prob_cont(pm, work);
+  if(ip < cali->num_particles)
+    cali->prob_cont_particles[ip] = prob;
+
+  for(it=cali->lines.begin(), il=0; it!=cali->lines.end(); ++it, ++il)
+  {
+    prob_line = cali->prob_line(pm, *it, il, work);
+    if(ip < cali->num_particles)
+      cali->prob_line_particles[ip*nlines + il] = prob_line;
+    prob += prob_line;
+  }
+  return prob;
+}
+/* 
+ * the perturbed particle is accepted, update its cache.
+ */
+void accept_action_cali()
+{
+  Cali *cali = (Cali *)dnest_get_arg();
+  unsigned int il, ip, nlines = cali->lines.size();
+
+  cali->accept_step_width();
+
+  ip = dnest_get_which_particle_update();
+  if(cali->prob_cont_particles == NULL || ip >= cali->num_particles)
+    return;
+
+  cali->prob_cont_particles[ip] = cali->prob_cont_particles_perturb[ip];
+  for(il=0; il<nlines; il++)
+  {
+    cali->prob_line_particles[ip*nlines + il] = cali->prob_line_particles_perturb[ip*nlines + il];
+  }
+}
+/* 
+ * a checkpoint is saved (iflag = 0) or restored (iflag = 1), 
+ * save or restore the proposal widths along with it.
+ */
+void restart_action_cali(int iflag)
+{
+  Cali *cali = (Cali *)dnest_get_arg();
+
+  if(iflag == 0)
+    cali->save_step_width();
+  else
+    cali->load_step_width();
+}
+/* 
+ * particle i is replaced by particle i_copy, copy the cache.
+ */
+void kill_action_cali(int i, int i_copy)
+{
+  Cali *cali = (Cali *)dnest_get_arg();
+  unsigned int il, nlines = cali->lines.size();
+
+  if(cali->prob_cont_particles == NULL)
+    return;
+
+  cali->prob_cont_particles[i] = cali->prob_cont_particles[i_copy];
+  for(il=0; il<nlines; il++)
+  {
+    cali->prob_line_particles[i*nlines + il] = cali->prob_line_particles[i_copy*nlines + il];
+  }
+}
+/* 
+ * the model of the sampler holds the free parameters only, 
+ * k-th of which is the idx_free[k]-th parameter.
+ */
 void from_prior_cali(void *model, const void *arg)
 {
-  int i;
+  int i, k;
   double *pm = (double *)model;
   
   Cali *cali = (Cali *)arg;
 
-  for(i=0; i<cali->num_params; i++)
+  for(k=0; k<cali->num_params_free; k++)
   {
+    i = cali->idx_free[k];
     if(cali->par_prior_model[i] == GAUSSIAN )
     {
-      pm[i] = dnest_randn() * cali->par_prior_gaussian[i][1] + cali->par_prior_gaussian[i][0];
-      dnest_wrap(&pm[i], cali->par_range_model[i][0], cali->par_range_model[i][1]);
+      pm[k] = dnest_randn() * cali->par_prior_gaussian[i][1] + cali->par_prior_gaussian[i][0];
+      dnest_wrap(&pm[k], cali->par_range_model[i][0], cali->par_range_model[i][1]);
     }
     else if(cali->par_prior_model[i] == LOG)
     {
-      pm[i] = log(cali->par_range_model[i][0]) + dnest_rand()*(log(cali->par_range_model[i][1]) - log(cali->par_range_model[i][0]));
-      pm[i] = exp(pm[i]);
+      pm[k] = log(cali->par_range_model[i][0]) + dnest_rand()*(log(cali->par_range_model[i][1]) - log(cali->par_range_model[i][0]));
+      pm[k] = exp(pm[k]);
     }
     else 
     {
-      pm[i] = cali->par_range_model[i][0] + dnest_rand()*(cali->par_range_model[i][1] - cali->par_range_model[i][0]);
+      pm[k] = cali->par_range_model[i][0] + dnest_rand()*(cali->par_range_model[i][1] - cali->par_range_model[i][0]);
     }
   }
-
-  for(i=0; i<cali->num_params; i++)
-  {
-    if(cali->par_fix[i] == FIXED)
-      pm[i] = cali->par_fix_val[i];
-  }
 }
 void print_particle_cali(FILE *fp, const void *model, const void *arg)
 {
@@ -2178,7 +4069,7 @@ void print_particle_cali(FILE *fp, const void *model, const void *arg)
 
   Cali *cali = (Cali *)arg;
 
-  for(i=0; i<cali->num_params; i++)
+  for(i=0; i<cali->num_params_free; i++)
   {
     fprintf(fp, "%e ", pm[i] );
   }
@@ -2186,57 +4077,78 @@ void print_particle_cali(FILE *fp, const void *model, const void *arg)
 }
 double perturb_cali(void *model, const void *arg)
 {
-  double *pm = (double *)model;
+  double *pm_free = (double *)model, *pw;
   double logH = 0.0, width, move;
-  int which;
+  int which, k;
+  
+  unsigned int il, ip;
   
   Cali *cali = (Cali *)arg;
 
-  /* sample variability parameters more frequently */
-  do
+  /* pick a free parameter, "which" is its index in the full parameters */
+  k = dnest_rand_int(cali->num_params_free);
+  which = cali->idx_free[k];
+  pw = pm_free + k;
+
+  /* clear update flags of this particle */
+  ip = dnest_get_which_particle_update();
+  if(cali->prob_cont_particles != NULL && ip < cali->num_particles)
   {
-    which = dnest_rand_int(cali->num_params);
-  }while(cali->par_fix[which] == FIXED);
+    cali->update_cont[ip] = false;
+    for(il=0; il<cali->lines.size(); il++)
+      cali->update_line[ip*cali->lines.size() + il] = false;
+  }
+  cali->set_update_flags(which, ip);
 
-  width = ( cali->par_range_model[which][1] - cali->par_range_model[which][0] );
+  /* the width adapts to the level of the particle, see Cali::get_step_width() */
+  width = ( cali->par_range_model[which][1] - cali->par_range_model[which][0] )
+         * cali->get_step_width(dnest_get_which_level_update(), k);
   
-  move = pm[which];
+  move = *pw;
   if(cali->par_prior_model[which] == UNIFORM)
   {
-    pm[which] += dnest_randh() * width;
-    dnest_wrap(&(pm[which]), cali->par_range_model[which][0], cali->par_range_model[which][1]);
+    *pw += dnest_randh() * width;
+    dnest_wrap(pw, cali->par_range_model[which][0], cali->par_range_model[which][1]);
   }
   else if(cali->par_prior_model[which] == LOG)
   {
-    logH -= (-log(pm[which]));
-    pm[which] += dnest_randh() * width;
-    dnest_wrap(&(pm[which]), cali->par_range_model[which][0], cali->par_range_model[which][1]);
-    logH += (-log(pm[which]));
+    logH -= (-log(*pw));
+    *pw += dnest_randh() * width;
+    dnest_wrap(pw, cali->par_range_model[which][0], cali->par_range_model[which][1]);
+    logH += (-log(*pw));
   }
   else
   {
-    logH -= (-0.5*pow((pm[which] - cali->par_prior_gaussian[which][0])/cali->par_prior_gaussian[which][1], 2.0) );
-    pm[which] += dnest_randh() * width;
-    dnest_wrap(&pm[which], cali->par_range_model[which][0], cali->par_range_model[which][1]);
-    logH += (-0.5*pow((pm[which] - cali->par_prior_gaussian[which][0])/cali->par_prior_gaussian[which][1], 2.0) );
+    logH -= (-0.5*pow((*pw - cali->par_prior_gaussian[which][0])/cali->par_prior_gaussian[which][1], 2.0) );
+    *pw += dnest_randh() * width;
+    dnest_wrap(pw, cali->par_range_model[which][0], cali->par_range_model[which][1]);
+    logH += (-0.5*pow((*pw - cali->par_prior_gaussian[which][0])/cali->par_prior_gaussian[which][1], 2.0) );
   }
-  move = pm[which] - move;
+  move = *pw - move;
 
-  /* scale (phi) and shift (G) are degenerated
-   * phi - G approx constant  
+  /* scale (phi) and shift (G) are degenerated, 
+   * the partner follows the move along their running correlation, see Cali::get_step_coupling()
    */
   if(which >= cali->num_params_var && which < cali->num_params_var + cali->ncode && cali->par_fix[which+cali->ncode] == NOFIXED)
   {
-    pm[which+cali->ncode] += move + dnest_randh() * (dnest_randn()*0.1);  /* random scatter with a std of 0.1*/
-    dnest_wrap(&(pm[which+cali->ncode]), cali->par_range_model[which+cali->ncode][0], cali->par_range_model[which+cali->ncode][1]);
+    double *ps = pm_free + cali->pos_free[which+cali->ncode], slope, scatter;
+    cali->get_step_coupling(which - cali->num_params_var, true, &slope, &scatter);
+    *ps += slope * move + dnest_randh() * (dnest_randn()*scatter);
+    dnest_wrap(ps, cali->par_range_model[which+cali->ncode][0], cali->par_range_model[which+cali->ncode][1]);
+    cali->set_step_pair(which - cali->num_params_var, *pw, *ps);
+    cali->set_update_flags(which+cali->ncode, ip);
   }
   else if (which >= cali->num_params_var + cali->ncode && which < cali->num_params_var + 2*cali->ncode 
            && cali->par_fix[which-cali->ncode] == NOFIXED)
   {
-    logH -= (-log(pm[which-cali->ncode]));
-    pm[which-cali->ncode] += move + dnest_randh() * (dnest_randn()*0.1); /* random scatter with a std of 0.1*/
-    dnest_wrap(&(pm[which-cali->ncode]), cali->par_range_model[which-cali->ncode][0], cali->par_range_model[which-cali->ncode][1]);
-    logH += (-log(pm[which-cali->ncode]));
+    double *ps = pm_free + cali->pos_free[which-cali->ncode], slope, scatter;
+    cali->get_step_coupling(which - cali->num_params_var - cali->ncode, false, &slope, &scatter);
+    logH -= (-log(*ps));
+    *ps += slope * move + dnest_randh() * (dnest_randn()*scatter);
+    dnest_wrap(ps, cali->par_range_model[which-cali->ncode][0], cali->par_range_model[which-cali->ncode][1]);
+    logH += (-log(*ps));
+    cali->set_step_pair(which - cali->num_params_var - cali->ncode, *ps, *pw);
+    cali->set_update_flags(which-cali->ncode, ip);
   }
   return logH;
 }
\ No newline at end of file
@@ -5,13 +5,49 @@
 #include <string>
 #include <vector>
 #include <list>
+#include <map>
 
 #include "../cdnest/dnestvars.h"
 
 #define WhiteSpace " \t\v\r"
 
+/* binary cache of light curves, see Data::load_cache() */
+#define DATA_CACHE_MAGIC "PYCALILC"
+#define DATA_CACHE_VERSION 1
+
 enum PRIOR_TYPE {GAUSSIAN=1, UNIFORM=2, LOG=3};
 enum PAR_FIX {NOFIXED=false, FIXED=true};
+/* timers and counters of the likelihood, see Cali::get_profile(), 
+ * each thread owns PROF_STRIDE slots, so that threads do not share cache lines.
+ * stages inside prob_drw() are timed once every PROF_INTERVAL calls to keep the overhead low */
+enum PROF_TYPE {PROF_LIKELIHOOD=0, PROF_CONT, PROF_LINE, PROF_ALIGN, PROF_SEMISEPARABLE, PROF_SOLVE, PROF_NUM};
+#define PROF_STRIDE 8
+#define PROF_INTERVAL 16
+/* number of parameter vectors that share one pass of exponentials in Cali::log_likelihood_batch() */
+#define BATCH_BLOCK 8
+/* adaptive proposal widths of perturb_cali(), in units of the prior range,
+ * adjusted every STEP_ADAPT_INTERVAL tries towards an acceptance rate of STEP_TARGET_RATE */
+#define STEP_ADAPT_INTERVAL 16
+#define STEP_TARGET_RATE 0.3
+#define STEP_WIDTH_MIN 1.0e-6
+/* the joint scale-shift moves use the running covariance of the pair over 
+ * the last ~STEP_COVAR_MEMORY moves, once STEP_COVAR_MIN moves are seen */
+#define STEP_COVAR_MEMORY 1000
+#define STEP_COVAR_MIN 100
+/* the widths and covariances are saved along with the checkpoint of dnest, see Cali::save_step_width() */
+#define STEP_RESTART_MAGIC "PYCALISW"
+#define STEP_RESTART_VERSION 2
+/* auto-tuning of the dnest options, see Cali::tune_options(),
+ * TUNE_COST_REF is the cost of a step (s) at which TUNE_SWEEPS_MIN sweeps per save pay off */
+#define TUNE_NUM_PROBES 20
+#define TUNE_COST_REF 1.0e-3
+#define TUNE_SWEEPS_MIN 2
+#define TUNE_SWEEPS_MAX 20
+#define TUNE_LEVEL_MIN 200
+#define TUNE_PARTICLES_MAX 5
+/* minimum size of the posterior sample for Cali::get_best_params(), 
+ * also the minimum of a nonzero StopESS */
+#define POSTERIOR_SAMPLE_MIN 500
 
 using namespace std;
 
@@ -19,6 +55,11 @@ double prob_cali(const void *model, const void *arg);
 void from_prior_cali(void *model, const void *arg);
 void print_particle_cali(FILE *fp, const void *model, const void *arg);
 double perturb_cali(void *model, const void *arg);
+double prob_initial_cali(const void *model, const void *arg);
+void accept_action_cali();
+void kill_action_cali(int i, int i_copy);
+void restart_action_cali(int iflag);
+void check_work_dir(const string& work_dir);
 
 class Config;
 class DataLC;
@@ -41,15 +82,36 @@ class Config
              double sigma_range_low= 1.0e-4, double sigma_range_up=1.0,
              double tau_range_low = 1.0, double tau_range_up = 1.0e4,
              bool fixed_scale = false, bool fixed_shift = false,
-             bool fixed_syserr=true, bool fixed_error_scale=true);
+             bool fixed_syserr=true, bool fixed_error_scale=true,
+             const string& work_dir=".");
     string get_param_filename();
     void print_cfg();
     void parse_fline_str(const string& fline_str);
     vector<double> test(const vector<double>& range = vector<double>({0.5, 1.5}));
 
     string fname;
+    string work_dir;   /* outputs are placed in work_dir/data/ */
+    string cache_dir;  /* binary cache of light curves, empty: no cache */
+    bool binary_output;  /* binary sample files */
+    int sync_policy;     /* 0: sync sample files at the end; 1: flush periodically; 2: flush and fsync periodically */
+    /* early stopping, see dnest_set_stopping() */
+    double stop_ess;      /* target effective sample size, 0: run all nmcmc steps */
+    double stop_logz_tol; /* tolerance of log evidence between successive checks */
+    double max_wall_time; /* maximum wall-clock time of sampling in seconds, 0: no limit */
+    int seed;             /* seed of random numbers, 0: seeded by time */
+    int marg_shift;       /* 1: marginalize shifts of the continuum analytically */
+    /* options of dnest, 0 for the defaults, see dnest_set_options() */
+    int num_particles, new_level_interval, save_interval, thread_steps, max_num_levels;
+    double lambda, beta;
+    int auto_tune;        /* 1: tune the unset num_particles, new_level_interval and save_interval, see Cali::tune_options() */
+    /* grid of reconstruction, see Cali::set_recon_time() */
+    double recon_cadence;
+    double recon_time_low, recon_time_up;
+    vector<double> recon_time_cont;
+    list< vector<double> > recon_time_line;
     size_t nmcmc;
     double ptol;
+    int num_threads;
     double scale_range_up, scale_range_low;
     double shift_range_up, shift_range_low;
     double syserr_range_up, syserr_range_low;
@@ -81,9 +143,18 @@ class Data
 {
   public:
     Data();
-    Data(const string& fname);
+    Data(const string& fname, const string& cache_dir="");
+    Data(const double *t, const double *f, const double *e, const int *c, size_t n, 
+         const vector<string>& code_list_in);
     ~Data();
-    void load(const string& fname);
+    void load(const string& fname, const string& cache_dir="");
+    void load(const double *t, const double *f, const double *e, const int *c, size_t n, 
+              const vector<string>& code_list_in);
+    void parse(char *buf, size_t size, const string& fname);
+    void print_info();
+    unsigned long long int hash_content(const char *buf, size_t size);
+    bool load_cache(const string& fcache, unsigned long long int hash);
+    void save_cache(const string& fcache, unsigned long long int hash);
     void normalize();
     void sort_data();
     void check_code(Data& data);
@@ -103,20 +174,57 @@ class Cali
   public:
     Cali();
     Cali(Config& cfg);
+    Cali(Config& cfg, const Data& cont_in, const list<Data>& lines_in);
     ~Cali();
-    void mcmc();
+    void initialize(Config& cfg);
+    void mcmc(bool resume=false);
     void align(double *model);
     void align_cont(double *model);
     void align_line(double *model, int il);
     void align_with_error();
     void get_best_params();
+    void align_sample(Data& data, double *ps_scale, double *es_shift, double *syserr, double *error_scale,
+                      double *flux, double *error);
+    void stat_sample(Data& data, double *flux, double *error);
+    void load_posterior_sample();
+    void load_posterior_sample_bin();
     void output();
     void recon();
-    void set_covar_Umat_cont(double sigma, double tau, double *USmat);
-    void set_covar_Umat_line(double sigma, double tau, double *USmat, unsigned int il);
+    void set_recon_time(Data& data, DataLC& data_recon, const vector<double>& time_recon, Config& cfg);
+    void predict(int il, double *tq, int n_query, double *flux_q, double *var_q);
+    void recon_posterior(int nrecon);
+    void recon_realization(int il, double *model, double *tq, int nq, double *gauss, double *real);
     double get_norm_cont();
     double get_norm_line(unsigned int il);
     void check_directory();
+    double prob_cont(double *model, double *work, double *phi=NULL, double *coef=NULL);
+    double prob_line(double *model, Data& line, int il, double *work, double *phi=NULL);
+    double prob_drw(Data& data, double *Larr, int nq, double sigma, double tau, double *ps_scale, 
+                    double *es_shift, double *syserr, double *error_scale, double *work, 
+                    double *phi_in=NULL, double *coef=NULL);
+    void sample_marg_shift();
+    void save_posterior_sample();
+    void save_free_params();
+    void tune_options(bool resume, int *np, int *nlevel, int *nsave);
+    double * expand_model(const double *pm_free);
+    double log_likelihood(double *model);
+    void log_likelihood_batch(double *models, int nk, double *probs);
+    void allocate_particle_cache(unsigned int np);
+    void free_particle_cache();
+    void set_update_flags(int which, unsigned int ip);
+    void reset_profile();
+    void reset_step_width();
+    string step_restart_file();
+    void save_step_width();
+    void load_step_width();
+    double get_step_width(int level, int k);
+    void set_step_pair(int code, double scale, double shift);
+    void accept_step_width();
+    void update_step_covar(int code, double scale, double shift);
+    void get_step_coupling(int code, bool from_scale, double *slope, double *scatter);
+    void get_profile(map<string, double>& times, map<string, unsigned long long int>& counts, 
+                     vector<double>& level_accept_rates);
+    void save_profile(const string& fname="");
 
     string fcont;
     list<string> fline;
@@ -127,6 +235,22 @@ class Cali
 
     int num_params;
     int num_params_var;
+    /* the sampler works on the free parameters, idx_free maps them to the full 
+     * parameters and pos_free the other way round (-1 if fixed) */
+    int num_params_free;
+    int *idx_free, *pos_free;
+    double *model_full;
+    /* proposal widths of each thread, level and free parameter, see perturb_cali(),
+     * indexed by [thread][level*num_params_free + k], grown with the levels in use */
+    vector< vector<double> > step_width;
+    vector< vector<unsigned int> > step_tries, step_accepts, step_rounds;
+    /* level, free parameter, and code (-1 if not a scale-shift move) of the last move 
+     * of each thread, and the proposed scale and shift of that code */
+    int *step_last;
+    double *step_pair;
+    /* running number, means and covariance (xx, xy, yy) of accepted scale and shift 
+     * of each thread and code, indexed by (thread*ncode + code)*6 */
+    double *step_covar;
     double **par_range_model;
     bool *par_fix;
     double *par_fix_val;
@@ -134,19 +258,54 @@ class Cali
     double **par_prior_gaussian;
     double *best_params, *best_params_std, *best_params_covar;
 
+    /* posterior sample kept in memory after mcmc */
+    int num_ps;
+    double *posterior_sample, *posterior_sample_info;
+
     double *Larr_data;
+    /* design matrix of the mean and marginalized offsets of the continuum */
+    int nq_cont;
+    int *code_marg;
+    double *Larr_cont;
     double *workspace;
+    size_t size_work;
 
     size_t nmcmc;
     double ptol;
+    int num_threads;
+    string work_dir;
+    bool binary_output;
+    int sync_policy;
+    double stop_ess, stop_logz_tol, max_wall_time;
+    int seed;
+    int marg_shift;
+    /* options of dnest, num_particles is taken by the particle cache */
+    int num_particles_opt, new_level_interval, save_interval, thread_steps, max_num_levels;
+    double lambda, beta;
+    int auto_tune;
     /* reconstruction */
     DataLC cont_recon;
     list<DataLC> lines_recon;
     size_t size_recon_max;
 
     DNestFptrSet *fptrset;
+    /* state of the sampler, each Cali has its own so that several can run mcmc at the same time */
+    DNestContext *sampler;
+
+    /* log-likelihood of each light curve block for each particle,
+     * only blocks touched by a perturbation are recomputed */
+    unsigned int num_particles;
+    double *prob_cont_particles, *prob_cont_particles_perturb;
+    double *prob_line_particles, *prob_line_particles_perturb;
+    bool *update_cont, *update_line;
 
     int stat_type;
+
+    /* timers and counters of the likelihood for each thread, indexed by PROF_TYPE */
+    double *prof_time;
+    unsigned long long int *prof_count;
+    /* wall-clock time of mcmc, get_best_params, output, recon, and recon_posterior */
+    map<string, double> time_stages;
 };
 
 #endif
\ No newline at end of file
@@ -1,17 +1,58 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <pybind11/numpy.h>
+#include <memory>
 
 #include "utilities.hpp"
 
 namespace py = pybind11;
 
+/* callback of a running mcmc, the exception it raises, and the sampler to stop on the exception */
+struct ProgressArg
+{
+  py::function func;
+  std::unique_ptr<py::error_already_set> error;
+  DNestContext *sampler;
+};
+
+/* called by dnest after every save, with the GIL released during mcmc */
+static void progress_callback(int count_saves, int num_levels, double rate, void *arg)
+{
+  py::gil_scoped_acquire acquire;
+  auto *p = (ProgressArg *)arg;
+  if(p->error) return;
+  try
+  {
+    p->func(count_saves, num_levels, rate);
+  }
+  catch(py::error_already_set& e)
+  {
+    p->error.reset(new py::error_already_set(std::move(e)));
+    dnest_set_stop_request(p->sampler, 1);
+  }
+}
+
+/* settings of Config set as attributes after setup(), which are not checked by Config */
+static void check_cfg(const Config& cfg)
+{
+  if(cfg.stop_ess > 0.0 && cfg.stop_ess < POSTERIOR_SAMPLE_MIN)
+    throw py::value_error("stop_ess should be 0 or not less than " + to_string(POSTERIOR_SAMPLE_MIN) + ".");
+}
+
+/* numpy view over a vector held by the python object base, no data are copied */
+template <typename T>
+static py::array_t<T> vector_view(vector<T>& v, py::handle base)
+{
+  return py::array_t<T>(v.size(), v.data(), base);
+}
+
 PYBIND11_MODULE(pycali, m)
 {
   py::class_<Config>(m, "Config")
     .def(py::init([]() {return new Config(); }))
     .def(py::init([](const std::string& fname) {return new Config(fname);}))
     .def("get_param_filename", &Config::get_param_filename)
-    .def("setup", &Config::setup, py::arg("fcont"), py::arg("fline")=list<string>({}),
+    .def("setup", &Config::setup, py::arg("fcont")="", py::arg("fline")=list<string>({}),
                   py::arg("nmcmc")=2000, py::arg("ptol")=0.7, 
                   py::arg("scale_range_low")=0.5, py::arg("scale_range_up")=1.5,
                   py::arg("shift_range_low")=-1.0, py::arg("shift_range_up")=1.0,
@@ -20,17 +61,41 @@ PYBIND11_MODULE(pycali, m)
                   py::arg("sigma_range_low")=1.0e-4, py::arg("sigma_range_up")=1.0,
                   py::arg("tau_range_low")=1.0, py::arg("tau_range_up")=1.0e4,
                   py::arg("fixed_scale")=false, py::arg("fixed_shift")=false,
-                  py::arg("fixed_syserr")=true, py::arg("fixed_error_scale")=true
+                  py::arg("fixed_syserr")=true, py::arg("fixed_error_scale")=true,
+                  py::arg("work_dir")="."
                   )
     .def("print_cfg", &Config::print_cfg)
     .def("test", &Config::test, py::arg("range")=vector<double>({0.5, 1.5}))
     .def_readwrite("fcont", &Config::fcont)
     .def_readwrite("fline", &Config::fline)
+    .def_readwrite("work_dir", &Config::work_dir)
+    .def_readwrite("cache_dir", &Config::cache_dir)
+    .def_readwrite("binary_output", &Config::binary_output)
+    .def_readwrite("sync_policy", &Config::sync_policy)
+    .def_readwrite("stop_ess", &Config::stop_ess)
+    .def_readwrite("stop_logz_tol", &Config::stop_logz_tol)
+    .def_readwrite("max_wall_time", &Config::max_wall_time)
+    .def_readwrite("seed", &Config::seed)
+    .def_readwrite("marg_shift", &Config::marg_shift)
+    .def_readwrite("num_particles", &Config::num_particles)
+    .def_readwrite("new_level_interval", &Config::new_level_interval)
+    .def_readwrite("save_interval", &Config::save_interval)
+    .def_readwrite("thread_steps", &Config::thread_steps)
+    .def_readwrite("max_num_levels", &Config::max_num_levels)
+    .def_readwrite("lambda_", &Config::lambda)
+    .def_readwrite("beta", &Config::beta)
+    .def_readwrite("auto_tune", &Config::auto_tune)
     .def_readwrite("nmcmc", &Config::nmcmc)
+    .def_readwrite("ptol", &Config::ptol)
+    .def_readwrite("num_threads", &Config::num_threads)
     .def_readwrite("scale_range_low", &Config::scale_range_low)
     .def_readwrite("scale_range_up", &Config::scale_range_up)
     .def_readwrite("shift_range_low", &Config::shift_range_low)
     .def_readwrite("shift_range_up", &Config::shift_range_up)
+    .def_readwrite("syserr_range_low", &Config::syserr_range_low)
+    .def_readwrite("syserr_range_up", &Config::syserr_range_up)
+    .def_readwrite("errscale_range_low", &Config::errscale_range_low)
+    .def_readwrite("errscale_range_up", &Config::errscale_range_up)
     .def_readwrite("sigma_range_low", &Config::sigma_range_low)
     .def_readwrite("sigma_range_up", &Config::sigma_range_up)
     .def_readwrite("tau_range_low", &Config::tau_range_low)
@@ -38,18 +103,189 @@ PYBIND11_MODULE(pycali, m)
     .def_readwrite("fixed_scale", &Config::fixed_scale)
     .def_readwrite("fixed_shift", &Config::fixed_shift)
     .def_readwrite("fixed_syserr", &Config::fixed_syserr)
-    .def_readwrite("fixed_error_scale", &Config::fixed_error_scale);
+    .def_readwrite("fixed_error_scale", &Config::fixed_error_scale)
+    .def_readwrite("recon_cadence", &Config::recon_cadence)
+    .def_readwrite("recon_time_low", &Config::recon_time_low)
+    .def_readwrite("recon_time_up", &Config::recon_time_up)
+    .def_readwrite("recon_time_cont", &Config::recon_time_cont)
+    .def_readwrite("recon_time_line", &Config::recon_time_line);
+
+  py::class_<DataLC>(m, "DataLC")
+    .def(py::init<>())
+    .def_property_readonly("time", [](py::object self) {return vector_view(self.cast<DataLC&>().time, self);})
+    .def_property_readonly("flux", [](py::object self) {return vector_view(self.cast<DataLC&>().flux, self);})
+    .def_property_readonly("error", [](py::object self) {return vector_view(self.cast<DataLC&>().error, self);});
+
+  py::class_<Data>(m, "Data")
+    .def(py::init<>())
+    .def(py::init<const string&, const string&>(), py::arg("fname"), py::arg("cache_dir")="")
+    .def(py::init([](py::array_t<double, py::array::c_style | py::array::forcecast> time, 
+                     py::array_t<double, py::array::c_style | py::array::forcecast> flux, 
+                     py::array_t<double, py::array::c_style | py::array::forcecast> error, 
+                     py::object code, vector<string> code_list) {
+        /* light curves from arrays through the buffer protocol, code are indices of datasets */
+        ssize_t n = time.size();
+        if(flux.size() != n || error.size() != n) throw py::value_error("time, flux, and error have different lengths.");
+        if(code.is_none())
+        {
+          vector<int> code_zero(n, 0);
+          return new Data(time.data(), flux.data(), error.data(), code_zero.data(), n, code_list);
+        }
+        auto code_arr = py::array_t<int, py::array::c_style | py::array::forcecast>::ensure(code);
+        if(!code_arr) throw py::type_error("code cannot be converted to an integer array.");
+        if(code_arr.size() != n) throw py::value_error("code has a different length from time.");
+        return new Data(time.data(), flux.data(), error.data(), code_arr.data(), n, code_list);}), 
+        py::arg("time"), py::arg("flux"), py::arg("error"), py::arg("code")=py::none(), 
+        py::arg("code_list")=vector<string>())
+    .def_readonly("norm", &Data::norm)
+    .def_readonly("code_list", &Data::code_list)
+    .def_readonly("num_code", &Data::num_code)
+    .def_property_readonly("time", [](py::object self) {return vector_view(self.cast<Data&>().time, self);})
+    .def_property_readonly("flux", [](py::object self) {return vector_view(self.cast<Data&>().flux, self);})
+    .def_property_readonly("error", [](py::object self) {return vector_view(self.cast<Data&>().error, self);})
+    .def_property_readonly("flux_org", [](py::object self) {return vector_view(self.cast<Data&>().flux_org, self);})
+    .def_property_readonly("error_org", [](py::object self) {return vector_view(self.cast<Data&>().error_org, self);})
+    .def_property_readonly("code", [](py::object self) {return vector_view(self.cast<Data&>().code, self);});
 
   py::class_<Cali>(m, "Cali")
     .def(py::init<>())
-    .def(py::init([](Config& cfg) {return new Cali(cfg);}))
-    .def("mcmc", &Cali::mcmc)
+    .def(py::init([](Config& cfg) {check_cfg(cfg); return new Cali(cfg);}))
+    .def(py::init([](Config& cfg, const Data& cont, const list<Data>& lines) {
+        check_cfg(cfg); 
+        return new Cali(cfg, cont, lines);}), 
+         py::arg("cfg"), py::arg("cont"), py::arg("lines")=list<Data>())
+    .def_property_readonly("cont", [](Cali& cali) {return &cali.cont;}, py::return_value_policy::reference_internal)
+    .def_property_readonly("cont_recon", [](Cali& cali) {return &cali.cont_recon;}, py::return_value_policy::reference_internal)
+    .def_property_readonly("lines", [](py::object self) {
+        py::list lines;
+        for(auto& line : self.cast<Cali&>().lines) lines.append(py::cast(&line, py::return_value_policy::reference_internal, self));
+        return lines;})
+    .def_property_readonly("lines_recon", [](py::object self) {
+        py::list lines;
+        for(auto& line : self.cast<Cali&>().lines_recon) lines.append(py::cast(&line, py::return_value_policy::reference_internal, self));
+        return lines;})
+    .def("mcmc", [](Cali& cali, bool resume, py::object callback) {
+        /* run with the GIL released, callback(count_saves, num_levels, likelihood_per_second) 
+         * is called after every save, an exception raised in callback stops the sampling 
+         * and is raised again after mcmc returns */
+        ProgressArg arg;
+        arg.sampler = cali.sampler;
+        if(!callback.is_none())
+        {
+          arg.func = callback.cast<py::function>();
+          dnest_set_progress(cali.sampler, progress_callback, &arg);
+        }
+        try
+        {
+          py::gil_scoped_release release;
+          cali.mcmc(resume);
+        }
+        catch(...)
+        {
+          /* arg is gone after return */
+          dnest_set_progress(cali.sampler, NULL, NULL);
+          dnest_set_stop_request(cali.sampler, 0);
+          throw;
+        }
+        dnest_set_progress(cali.sampler, NULL, NULL);
+        dnest_set_stop_request(cali.sampler, 0);
+        if(arg.error) throw *arg.error;}, py::arg("resume")=false, py::arg("callback")=py::none())
+    .def("stop", [](Cali& cali) {
+        /* request a stop of the running mcmc from another thread, it stops at the next 
+         * round with a checkpoint saved, so that mcmc(resume=True) continues. 
+         * if called before mcmc starts, the next mcmc returns at once and keeps 
+         * the outputs of the previous run */
+        dnest_set_stop_request(cali.sampler, 1);})
     .def("get_best_params", &Cali::get_best_params)
     .def("align_with_error", &Cali::align_with_error)
     .def("output", &Cali::output)
     .def("recon", &Cali::recon)
+    .def("recon_posterior", &Cali::recon_posterior, py::arg("nrecon")=100)
+    .def("predict", [](Cali& cali, py::array_t<double, py::array::c_style | py::array::forcecast> t, int il) {
+        /* mean and variance at times t in units of the input flux, call after get_best_params */
+        if(il < -1 || il >= (int)cali.lines.size()) throw py::index_error("il is out of range.");
+        double norm = (il < 0) ? cali.cont.norm : std::next(cali.lines.begin(), il)->norm;
+        py::array_t<double> flux(t.size()), var(t.size());
+        double *pf = flux.mutable_data(), *pv = var.mutable_data();
+        cali.predict(il, (double *)t.data(), t.size(), pf, pv);
+        for(ssize_t i=0; i<t.size(); i++)
+        {
+          pf[i] *= norm;
+          pv[i] *= norm*norm;
+        }
+        return py::make_tuple(flux, var);}, py::arg("t"), py::arg("il")=-1)
+    .def("log_likelihood", [](Cali& cali, py::array_t<double, py::array::c_style | py::array::forcecast> model) -> py::object {
+        /* log-likelihood of parameters in the layout of best_params, 
+         * a (K, num_params) array gives K values computed with the GIL released */
+        if(model.ndim() == 1)
+        {
+          if(model.size() != cali.num_params) throw py::value_error("model has a wrong number of parameters.");
+          double prob;
+          {
+            py::gil_scoped_release release;
+            prob = cali.log_likelihood((double *)model.data());
+          }
+          return py::float_(prob);
+        }
+        if(model.ndim() != 2 || model.shape(1) != cali.num_params) 
+          throw py::value_error("model must have a shape of (num_params,) or (K, num_params).");
+        py::array_t<double> prob(model.shape(0));
+        double *pm = (double *)model.data(), *pp = prob.mutable_data();
+        int nk = model.shape(0);
+        {
+          py::gil_scoped_release release;
+          cali.log_likelihood_batch(pm, nk, pp);
+        }
+        return std::move(prob);}, py::arg("model"))
     .def("get_norm_cont", &Cali::get_norm_cont)
     .def("get_norm_line", &Cali::get_norm_line)
     .def_readwrite("ncode", &Cali::ncode)
-    .def_readwrite("num_params", &Cali::num_params);
+    .def_readwrite("num_params", &Cali::num_params)
+    .def_property_readonly("free_params", [](Cali& cali) {
+        /* indices of the free parameters, i.e., the columns of sample.txt or sample.bin */
+        return vector<int>(cali.idx_free, cali.idx_free + cali.num_params_free);})
+    .def_readonly("work_dir", &Cali::work_dir)
+    .def("get_sampler_timing", [](Cali& cali) {
+        /* timing of the last mcmc run */
+        double time_sampling, time_likelihood;
+        unsigned long long int steps = dnest_get_steps_sampling(cali.sampler);
+        dnest_get_timing(cali.sampler, &time_sampling, &time_likelihood);
+        py::dict timing;
+        timing["steps"] = steps;
+        timing["num_threads"] = cali.num_threads;
+        timing["time_sampling"] = time_sampling;
+        timing["time_likelihood"] = time_likelihood;
+        timing["steps_per_second"] = (time_sampling > 0.0) ? steps/time_sampling : 0.0;
+        timing["likelihood_per_second"] = (time_likelihood > 0.0) ? steps/time_likelihood : 0.0;
+        return timing;})
+    .def("get_profile", [](Cali& cali) {
+        /* timers and counters of the last mcmc run and of the stages called so far */
+        map<string, double> times;
+        map<string, unsigned long long int> counts;
+        vector<double> level_accept_rates;
+        cali.get_profile(times, counts, level_accept_rates);
+        py::dict prof;
+        prof["time"] = times;
+        prof["count"] = counts;
+        prof["level_accept_rate"] = level_accept_rates;
+        return prof;})
+    .def("save_profile", &Cali::save_profile, py::arg("fname")="")
+    .def("get_posterior_sample", [](Cali& cali) {
+        /* copy of the posterior sample in memory, shape (num_ps, num_params) */
+        if(cali.posterior_sample == NULL) cali.load_posterior_sample();
+        py::array_t<double> ps({cali.num_ps, cali.num_params});
+        memcpy(ps.mutable_data(), cali.posterior_sample, cali.num_ps*cali.num_params*sizeof(double));
+        return ps;})
+    .def("get_posterior_sample_info", [](Cali& cali) {
+        /* log-likelihoods of the posterior sample */
+        if(cali.posterior_sample == NULL) cali.load_posterior_sample();
+        py::array_t<double> info(cali.num_ps);
+        memcpy(info.mutable_data(), cali.posterior_sample_info, cali.num_ps*sizeof(double));
+        return info;})
+    .def_property_readonly("best_params", [](Cali& cali) {
+        if(cali.best_params == NULL) return vector<double>();
+        return vector<double>(cali.best_params, cali.best_params + cali.num_params);})
+    .def_property_readonly("best_params_std", [](Cali& cali) {
+        if(cali.best_params_std == NULL) return vector<double>();
+        return vector<double>(cali.best_params_std, cali.best_params_std + cali.num_params);});
 }
\ No newline at end of file